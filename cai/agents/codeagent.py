@@ -14,7 +14,6 @@ interactions.
 """
 
 # Standard library imports
-import copy
 import platform
 import re
 import signal
@@ -31,7 +30,7 @@ from cai.agents.meta.local_python_executor import (
     fix_final_answer_code,
     truncate_content,
 )
-from cai.types import Agent, Result
+from cai.types import Agent, ConversationLog, Result
 
 
 class CodeAgentException(Exception):
@@ -507,8 +506,8 @@ I'll execute your code and show you the results.
                             "Python code block.")
             }
 
-            # Clone the messages and add our code generation prompt
-            messages_copy = copy.deepcopy(messages)
+            # Fork the messages and add our code generation prompt
+            messages_copy = ConversationLog(messages)
             messages_copy.append(code_generation_message)
 
             # Get completion from the model
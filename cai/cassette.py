@@ -0,0 +1,222 @@
+"""
+This module contains the record/replay layer for LLM completions.
+
+A Cassette stores completions in a SQLite file, keyed by a canonical
+hash of the request (see request_key). CAI.get_chat_completion looks
+requests up in the cassette before calling the model, so a recorded
+engagement can be re-run offline, at near-zero latency and without
+paying for the model, while the tools still run for real. This is
+meant for deterministic re-runs, CI and benchmarking the framework
+and its tools in isolation.
+
+It is configured through environment variables:
+
+    CAI_CASSETTE: path of the cassette file (unset disables the layer)
+    CAI_CASSETTE_MODE: one of
+        record: always call the model and store (or overwrite) the
+            completion
+        replay: only answer from the cassette; a request that was
+            not recorded fails the completion
+        record-missing (default): replay recorded requests and call
+            the model (and record) for the others
+
+Cassettes can also be built from DataRecorder JSONL logs, see
+Cassette.import_jsonl and tools/jsonl_to_cassette.py.
+"""
+# Standard library imports
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Third party imports
+import litellm  # pylint: disable=import-error
+
+from cai.datarecorder import iter_jsonl_records
+
+
+MODES = ("record", "replay", "record-missing")
+
+# Request fields that select the completion. Transport and retry
+# settings (stream, timeout, api_base, ...) are left out, so a
+# streamed request replays a non-streamed recording and vice versa.
+KEY_FIELDS = ("model", "messages", "tools", "tool_choice",
+              "response_format", "reasoning_effort", "thinking")
+
+# Fields of a completion needed to rebuild it
+RESPONSE_FIELDS = ("id", "object", "created", "model", "choices", "usage",
+                   "system_fingerprint")
+
+
+# Environment section of the system prompt (CAI_ENV_CONTEXT, see
+# system_master_template.md): hostname, IPs and wordlists of the
+# machine that renders it, so it is left out of the key for
+# recordings to replay on other hosts.
+ENV_CONTEXT = re.compile(
+    r'Environment context \(in "tree" format\):\n.*?'
+    r'└── Role: Attacker\n'
+    r'(?:\nAvailable wordlists \(/usr/share/wordlists\):\n(?:├── .*\n)*)?',
+    re.DOTALL)
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a request that was not recorded."""
+
+
+def _json_default(value):
+    if hasattr(value, "model_json_schema"):  # pydantic response_format
+        return value.model_json_schema()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def _without_env_context(message):
+    if message.get("role") != "system":
+        return message
+    content = message.get("content")
+    if isinstance(content, str):
+        content = ENV_CONTEXT.sub("", content)
+    elif isinstance(content, (list, tuple)):
+        content = [
+            {**part, "text": ENV_CONTEXT.sub("", part["text"])}
+            if isinstance(part.get("text"), str) else part
+            for part in content
+        ]
+    return {**message, "content": content}
+
+
+def request_key(params):
+    """
+    Canonical hash of the completion request params.
+
+    Only KEY_FIELDS are hashed, serialized as JSON with sorted keys,
+    so that equal requests give the same key regardless of key order
+    or of how the messages were built. The environment section of
+    system messages (see ENV_CONTEXT) is left out.
+
+    Returns:
+        str: hex SHA-256 digest
+    """
+    request = {k: params[k] for k in KEY_FIELDS if k in params}
+    if "messages" in request:
+        request["messages"] = [
+            _without_env_context(m) for m in request["messages"]]
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    SQLite store of completions keyed by request_key.
+
+    Safe to share between threads; several processes may use the same
+    file (SQLite locks it on writes).
+    """
+
+    def __init__(self, path, mode="record-missing"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}'. "
+                             f"Choose one of: {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "created REAL)")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def lookup(self, key):
+        """
+        Recorded completion for the request with the given
+        request_key.
+
+        Returns:
+            litellm.ModelResponse or None: None if the request must go
+                to the model (record mode, or a miss in record-missing
+                mode)
+
+        Raises:
+            CassetteMiss: in replay mode, if the request was not
+                recorded
+        """
+        if self.mode == "record":
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM completions WHERE key = ?",
+                (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise CassetteMiss(
+                    f"request {key[:12]} is not recorded in {self.path}")
+            return None
+        self.hits += 1
+        return litellm.ModelResponse(**json.loads(row[0]))
+
+    def store(self, key, completion):
+        """Record completion as the answer to the request with the
+        given request_key."""
+        if hasattr(completion, "model_dump"):
+            completion = completion.model_dump(mode="json")
+        response = {k: completion[k] for k in RESPONSE_FIELDS
+                    if completion.get(k) is not None}
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                (key, response.get("model"),
+                 json.dumps(response, default=_json_default), time.time()))
+
+    def import_jsonl(self, file_path):
+        """
+        Record the request/completion pairs of a DataRecorder JSONL
+        log (v1 or v2 layout).
+
+        Returns:
+            int: number of completions recorded
+        """
+        count = 0
+        request = None
+        for record in iter_jsonl_records(file_path):
+            if "choices" in record and request is not None:
+                self.store(request_key(request), record)
+                count += 1
+                request = None
+            elif "messages" in record and "model" in record:
+                request = record
+        return count
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
+
+
+def get_cassette():
+    """
+    Cassette configured by CAI_CASSETTE and CAI_CASSETTE_MODE.
+
+    Returns:
+        Cassette or None: None when CAI_CASSETTE is not set
+    """
+    path = os.getenv("CAI_CASSETTE")
+    if not path:
+        return None
+    return Cassette(path, os.getenv("CAI_CASSETTE_MODE", "record-missing"))
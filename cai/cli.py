@@ -26,6 +26,10 @@ Environment Variables
             - 1: Verbose debug output
             - 2: CLI debug output
         CAI_BRIEF: Enable/disable brief output mode (default: "false")
+        CAI_STREAM: Enable/disable token streaming of model responses
+            (default: "false"). When enabled, responses are rendered as
+            they arrive and tools start running as soon as their
+            arguments are complete.
         CAI_MAX_TURNS: Maximum number of turns for
             agent interactions (default: "inf")
         CAI_TRACING: Enable/disable OpenTelemetry tracing
@@ -47,6 +51,10 @@ Environment Variables
             (default: "false")
         CAI_ENV_CONTEXT: Add enviroment context, dirs and
             current env available (default: "true")
+        CAI_ENV_CONTEXT_TTL: Seconds the environment context is
+            cached before probing again (default: "300")
+        CAI_TEMPLATE_MODULE_DIR: Directory where compiled prompt
+            templates are kept across runs (default: unset)
         CAI_MEMORY_ONLINE_INTERVAL: Number of turns between
             online memory updates (default: "5")
         CAI_PRICE_LIMIT: Price limit for the conversation in dollars
@@ -55,6 +63,67 @@ Environment Variables
             (default: "o3-mini")
         CAI_SUPPORT_INTERVAL: Number of turns between support agent
             executions (default: "5")
+        CAI_PARALLEL_TOOL_WORKERS: Maximum number of tool calls run
+            concurrently for agents with parallel_tool_calls
+            (default: "4")
+        CAI_TOOL_TIMEOUT: Seconds to wait for a tool call dispatched
+            in the background before reporting a timeout
+            (default: "300")
+        CAI_CONTEXT_RESERVE: Tokens of the model's context window kept
+            free for the reply when trimming history before a request
+            (default: "4096")
+        CAI_RATE_LIMIT_RPM: Requests per minute allowed per provider,
+            0 for unlimited (default: "0"). Override for one provider
+            with CAI_RATE_LIMIT_RPM_<PROVIDER>, e.g. _OPENAI
+        CAI_RATE_LIMIT_TPM: Tokens per minute allowed per provider,
+            0 for unlimited (default: "0"). Override for one provider
+            with CAI_RATE_LIMIT_TPM_<PROVIDER>, e.g. _ANTHROPIC
+        CAI_TOOL_OUTPUT_NORMALIZE: Comma separated normalization
+            stages applied to tool outputs before they enter the
+            history: ansi, cr, rle, blank, or "none"
+            (default: "all")
+        CAI_SPILL_TOOL_OUTPUT: Save tool outputs too long for the
+            prompt under <workspace>/.cai/spill and let the agent read
+            them with read_tool_output, instead of truncating them
+            (default: "true")
+        CAI_SESSION_OUTPUT_LIMIT: Bytes of output kept per interactive
+            session; older output is dropped (default: "1048576")
+        CAI_CONTAINER_WORKER: Run the commands of the active container
+            through one long-lived docker exec instead of one per
+            command; needs python3 in the container (default: "true")
+        CAI_COMMAND_OUTPUT_LIMIT: Bytes of the stdout and of the stderr
+            of a command kept, half from the start and half from the
+            end (default: "1048576")
+        CAI_COMMAND_OUTPUT_CAP: Bytes of output after which a command
+            is killed, "0" for no cap (default: "67108864")
+        CAI_SSH_MULTIPLEX: Reuse one SSH connection (an OpenSSH
+            ControlMaster) per host for the SSH commands run from the
+            host (default: "true")
+        CAI_SSH_MAX_SESSIONS: Commands run at once over the connection
+            to a host (default: "10")
+        CAI_SSH_CONTROL_PERSIST: Idle seconds before the connection to
+            a host is closed (default: "600")
+        CAI_LOG_FORMAT: Layout of the JSONL logs in logs/: 2 writes
+            each message and tool schema once, 1 repeats them in
+            every request (default: "2")
+        CAI_LOG_ROTATE_SIZE: Size (e.g. "64M") at which the JSONL log
+            is rotated into a compressed segment (default: no rotation)
+        CAI_LOG_ROTATE_SECONDS: Age in seconds at which the JSONL log
+            is rotated into a compressed segment (default: no rotation)
+        CAI_LOG_COMPRESSION: Compression of rotated log segments,
+            "zstd" or "gzip" (default: "zstd" if the zstandard package
+            is installed, else "gzip")
+        CAI_PUBLIC_IP: Public IP used in log file names: "auto" looks
+            it up in the background and caches it, "false" skips the
+            lookup, any other value is used as is (default: "auto")
+        CAI_PUBLIC_IP_TTL: Seconds the looked up public IP is cached
+            for (default: "86400")
+        CAI_CASSETTE: SQLite file where completions are recorded and
+            replayed from, keyed by a hash of the request (default:
+            unset, disabled)
+        CAI_CASSETTE_MODE: "record", "replay" (offline, fails on
+            unrecorded requests) or "record-missing"
+            (default: "record-missing")
         CTF_ARTIFACTS: Enable/disable artifacts mode (default: "false")
             only if you have caiextensions-memory installed
     Extensions (only applicable if the right extension is installed):
@@ -222,6 +291,7 @@ def run_with_env():
         run_cai_cli(
             cai_initial_agent,
             debug=float(os.getenv('CAI_DEBUG', '2')),
+            stream=os.getenv('CAI_STREAM', "false").lower() == "true",
             max_turns=float(os.getenv('CAI_MAX_TURNS', 'inf')),
             ctf=ctf if os.getenv('CTF_NAME', None) else None,
             state_agent=state_agent,
@@ -10,11 +10,16 @@ and local modules.
 """
 
 # Standard library imports
+import asyncio
 import copy
+import functools
+import inspect
 import json
 import os
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 
 # Third-party imports
@@ -33,15 +38,24 @@ from cai import (
 from cai.agents.codeagent import CodeAgent
 from cai.agents.meta.reasoner_support import create_reasoner_agent
 from cai.datarecorder import DataRecorder
+from cai.cassette import CassetteMiss, get_cassette, request_key
 from cai.logger import exploit_logger
+from cai.normalize import format_savings, normalizer
+from cai.ratelimit import rate_limiter
 from cai.state.common import StateAgent
+from cai.tools.misc.spill import read_tool_output, spill_store
 from cai.types import (
     Agent,
     AgentFunction,
     ChatCompletionMessage,
     ChatCompletionMessageToolCall,
+    ConversationLog,
+    Function,
+    MessageRecord,
+    ReadOnlyError,
     Response,
     Result,
+    thaw,
 )
 from cai.util import (
     check_flag,
@@ -49,14 +63,20 @@ from cai.util import (
     cli_print_codeagent_output,
     cli_print_state,
     cli_print_tool_call,
+    cli_stream_display,
+    cli_update_stream_display,
     debug_print,
+    estimate_message_tokens,
+    fit_messages,
     fix_message_list,
-    function_to_json,
     get_ollama_api_base,
     initialize_global_timer,
     flatten_gemini_fields,
+    get_model_input_tokens,
     get_template_content,
+    get_tool_schemas,
     load_prompt_template,
+    merge_chunk,
 )
 from cai.util import start_active_time, start_idle_time
 from cai.internal.components.metrics import process_intermediate_metrics
@@ -66,6 +86,216 @@ __CTX_VARS_NAME__ = "context_variables"
 litellm.suppress_debug_info = True
 
 
+_SYNC_INTERRUPT = "cai-sync-interrupt"
+_sync_loops = threading.local()
+
+
+def _run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    Each thread keeps its own event loop so that the async clients
+    cached by litellm stay bound to a live loop across calls. When
+    the calling thread already runs a loop, the coroutine runs on a
+    helper thread instead. A Ctrl+C that arrives while the loop is
+    waiting cancels the task with _SYNC_INTERRUPT, which arun()
+    handles like a KeyboardInterrupt.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(_run_sync, coro).result()
+
+    loop = getattr(_sync_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _sync_loops.loop = asyncio.new_event_loop()
+    task = loop.create_task(coro)
+    while True:
+        try:
+            return loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            if task.done():
+                raise
+            task.cancel(_SYNC_INTERRUPT)
+
+
+class _CompletionAborted(Exception):
+    """
+    Raised by CAI.recover_completion when no completion can be
+    obtained and the problem has already been reported to the user.
+    """
+
+
+class _OutboundView:  # pylint: disable=too-few-public-methods
+    """
+    The messages of a history that are sent to the model, kept up to
+    date as the history grows.
+
+    Each history message goes through the outbound filters (Report and
+    Reasoner agent messages, add_memory tool calls) once, when first
+    seen. If the history is replaced or shrinks instead of growing,
+    the view is rebuilt.
+    """
+
+    HIDDEN_SENDERS = ("Report Agent", "Reasoner Agent")
+
+    def __init__(self, history=None):
+        self.history = history
+        self.scanned = 0
+        self.last = None
+        self.messages = []
+        # model -> [per-message token estimates, their sum]
+        self.tokens = {}
+
+    @classmethod
+    def is_outbound(cls, msg):
+        """Whether a history message is sent to the model."""
+        return (msg.get("sender") not in cls.HIDDEN_SENDERS and
+                not any("add_memory" in call.get("function", {}).get("name", "")  # noqa: E501
+                        for call in (msg.get("tool_calls") if msg.get("tool_calls")  # noqa: E501
+                                     else [])))
+
+    def sync(self, history):
+        """Bring the view up to date with history and return it."""
+        if (history is not self.history or len(history) < self.scanned or
+                (self.scanned and history[self.scanned - 1] is not self.last)):
+            self.__init__(history)
+        for i in range(self.scanned, len(history)):
+            if self.is_outbound(history[i]):
+                self.messages.append(history[i])
+        self.scanned = len(history)
+        self.last = history[-1] if history else None
+        return self.messages
+
+    def token_counts(self, model):
+        """
+        Token estimates of the messages in the view for model.
+
+        Each message is tokenized once; the view must be in sync.
+
+        Returns:
+            tuple: (list of per-message estimates, their sum)
+        """
+        counts = self.tokens.setdefault(model, [[], 0])
+        estimate = functools.partial(estimate_message_tokens, model)
+        for msg in self.messages[len(counts[0]):]:
+            # records are shared with forks of the history, and with
+            # the next turns, so they keep their estimates
+            tokens = (msg.cached(("tokens", model), estimate)
+                      if isinstance(msg, MessageRecord) else estimate(msg))
+            counts[0].append(tokens)
+            counts[1] += tokens
+        return counts[0], counts[1]
+
+
+class _StreamAssembler:  # pylint: disable=too-few-public-methods
+    """
+    Incrementally assembles a streamed completion.
+
+    See CAI.consume_stream for the behaviour; this holds the state
+    shared by the sync and async stream consumers.
+    """
+
+    def __init__(self, agent, create_params, debug, on_tool_call_ready):
+        self.agent_name = agent.name
+        self.create_params = create_params
+        self.model = create_params["model"]
+        self.on_tool_call_ready = on_tool_call_ready
+        self.chunks = []
+        self.message = {
+            "content": "",
+            "tool_calls": defaultdict(
+                lambda: {
+                    "id": "",
+                    "type": "",
+                    "function": {"name": "", "arguments": ""},
+                }),
+        }
+        self.notified = set()
+        self.live = cli_stream_display(self.agent_name, self.model, debug)
+
+    def add(self, chunk):
+        """Merge one chunk, refreshing the display and notifying
+        completed tool calls."""
+        self.chunks.append(chunk)
+        if not chunk.choices:
+            return  # e.g. the trailing usage chunk
+        delta = chunk.choices[0].delta
+        delta_tool_calls = getattr(delta, "tool_calls", None) or []
+        for tool_call in delta_tool_calls:
+            index = tool_call.index or 0
+            for previous in list(self.message["tool_calls"]):
+                if previous < index:
+                    self._notify(previous)
+        merge_chunk(self.message, {
+            "content": delta.content,
+            "tool_calls": [
+                tool_call.model_dump() for tool_call in delta_tool_calls
+            ],
+        })
+        if delta.content:
+            cli_update_stream_display(
+                self.live, self.agent_name, self.model,
+                self.message["content"])
+        if chunk.choices[0].finish_reason:
+            for index in list(self.message["tool_calls"]):
+                self._notify(index)
+
+    def close(self):
+        """Remove the transient display."""
+        if self.live is not None:
+            self.live.stop()
+            self.live = None
+
+    def build(self):
+        """
+        Rebuild the full completion from the chunks.
+
+        The message is the one merged in add(), where tool call
+        fragments are assembled by their index; the chunk builder
+        only provides the rest of the completion (usage, cost, ids).
+        """
+        completion = litellm.stream_chunk_builder(
+            self.chunks, messages=self.create_params["messages"])
+        if completion is None or not completion.choices:
+            return completion
+        message = completion.choices[0].message
+        message.content = self.message["content"] or None
+        tool_calls = [
+            ChatCompletionMessageToolCall(
+                id=call["id"],
+                type="function",
+                function=Function(name=call["function"]["name"],
+                                  arguments=call["function"]["arguments"]))
+            for _, call in sorted(self.message["tool_calls"].items())
+        ]
+        message.tool_calls = tool_calls or None
+        return completion
+
+    def _notify(self, index):
+        if self.on_tool_call_ready is None or index in self.notified:
+            return
+        self.notified.add(index)
+        call = self.message["tool_calls"][index]
+        if not call["id"] or not call["function"]["name"]:
+            return
+        try:
+            json.loads(call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError:
+            return  # handle_tool_calls reports it later
+        self.on_tool_call_ready(ChatCompletionMessageToolCall(
+            id=call["id"],
+            type="function",
+            function=Function(
+                name=call["function"]["name"],
+                arguments=call["function"]["arguments"] or "{}",
+            ),
+        ))
+
+
 class CAI:  # pylint: disable=too-many-instance-attributes
     """
     Cybersecurity AI (CAI) object
@@ -139,6 +369,26 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         self.max_chars_per_message = 5000  # number of characters
         self.last_reasoning_content = ""
 
+        # tool calls dispatched ahead of handle_tool_calls (while the
+        # completion is still streaming or in parallel), keyed by
+        # tool_call_id -> (args, Future, timing)
+        self._pending_tool_calls = {}
+        self._outbound = _OutboundView()
+        # models for which litellm rewrites messages in place
+        self._rewritten_models = set()
+        self._tool_tokens = {}
+        self.context_reserve = int(os.getenv("CAI_CONTEXT_RESERVE", "4096"))
+        self.prompt_tokens_estimate = 0
+        self._tool_executor = None
+        self._parallel_tool_executor = None
+        # timing of the dispatched tool calls that have not finished
+        self._tool_timings = []
+        self.max_parallel_tools = int(
+            os.getenv("CAI_PARALLEL_TOOL_WORKERS", "4"))
+        self.tool_timeout = float(os.getenv("CAI_TOOL_TIMEOUT", "300"))
+        # record/replay of completions (CAI_CASSETTE)
+        self.cassette = get_cassette()
+
         # training data
         if log_training_data:
             # Get the current workspace name from environment variables
@@ -185,7 +435,7 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         if not openai_api_key:
             os.environ["OPENAI_API_KEY"] = "sk-proj-1234567890"
 
-    def get_chat_completion(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,line-too-long,too-many-statements # noqa: E501
+    def get_chat_completion(  # pylint: disable=too-many-arguments
         self,
         agent: Agent,
         history: List,
@@ -193,13 +443,144 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         model_override: str,
         stream: bool,
         debug: bool,
-        master_template: str = "system_master_template.md"
+        master_template: str = "system_master_template.md",
+        on_tool_call_ready=None
     ) -> ChatCompletionMessage:
         """
         Get a chat completion for the given agent, history,
         and context variables.
+
+        When stream is True, the completion is consumed chunk by
+        chunk (see consume_stream) and on_tool_call_ready, if given,
+        is called with each tool call as soon as its arguments are
+        complete, before the stream finishes. Tools started from it
+        run, with their side effects, before the completion is known
+        to succeed: if the stream fails later, None is returned all
+        the same, and the caller must still record or cancel them
+        (see aprocess_interaction).
+
+        With a cassette (CAI_CASSETTE, see cai.cassette), recorded
+        completions are replayed instead of calling the model.
+
+        Synchronous wrapper around aget_chat_completion.
+        """
+        return _run_sync(self.aget_chat_completion(
+            agent, history, context_variables, model_override, stream,
+            debug, master_template=master_template,
+            on_tool_call_ready=on_tool_call_ready))
+
+    async def aget_chat_completion(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches # noqa: E501
+        self,
+        agent: Agent,
+        history: List,
+        context_variables: dict,
+        model_override: str,
+        stream: bool,
+        debug: bool,
+        master_template: str = "system_master_template.md",
+        on_tool_call_ready=None
+    ) -> ChatCompletionMessage:
+        """
+        Get a chat completion, see get_chat_completion, through
+        litellm.acompletion.
+
+        Requests share litellm's async HTTP client (and its connection
+        pool) with every other session on the event loop, and waiting
+        on rate limits does not block the loop. The less common error
+        recovery paths of recover_completion run in a worker thread.
         """
+        create_params = self.prepare_completion_params(
+            agent, history, context_variables, model_override, stream,
+            debug, master_template)
 
+        first_attempt = True
+        try:
+            cassette_key, recorded = self._cassette_lookup(create_params)
+            if recorded is not None:
+                return self.record_completion(create_params, recorded)
+            while True:
+                litellm_completion = None
+                recovered = False
+                try:
+                    self._set_request_timeout(create_params, first_attempt)
+                    first_attempt = False
+                    async with rate_limiter.aslot(
+                            create_params["model"],
+                            self.prompt_tokens_estimate):
+                        if os.getenv("OLLAMA", "").lower() == "true":
+                            litellm_completion = await litellm.acompletion(
+                                **create_params,
+                                api_base=get_ollama_api_base(),
+                                custom_llm_provider="openai"
+                            )
+                        else:
+                            litellm_completion = await litellm.acompletion(
+                                **create_params)
+                except litellm.exceptions.RateLimitError as e:
+                    # the next aslot() waits out the backoff
+                    self.handle_rate_limit(e, create_params["model"])
+                except Exception as e:  # pylint: disable=W0718
+                    recovered = True
+                    litellm_completion = await asyncio.to_thread(
+                        self.recover_completion, e, create_params)
+                if self._needs_retry(create_params, litellm_completion):
+                    continue
+                if litellm_completion:
+                    break
+
+            if isinstance(litellm_completion, litellm.CustomStreamWrapper):
+                if recovered:  # synchronous stream from recover_completion
+                    litellm_completion = await asyncio.to_thread(
+                        self.consume_stream,
+                        litellm_completion,
+                        agent,
+                        create_params,
+                        debug,
+                        on_tool_call_ready=on_tool_call_ready)
+                else:
+                    litellm_completion = await self.aconsume_stream(
+                        litellm_completion,
+                        agent,
+                        create_params,
+                        debug,
+                        on_tool_call_ready=on_tool_call_ready)
+
+            if cassette_key:
+                self.cassette.store(cassette_key, litellm_completion)
+            return self.record_completion(create_params, litellm_completion)
+        except _CompletionAborted:
+            return None
+        except CassetteMiss as e:
+            print(f"\033[31mCassette miss: {str(e)}\033[0m")
+            return None
+        except litellm.Timeout as e:
+            print(f"\033[31mRequest timed out: {str(e)}\033[0m")
+            self.print_timeout_error_message()
+            return None
+        except litellm.APIError as e:
+            print(f"\033[31mAPI error: {str(e)}\033[0m")
+            self.print_connection_error_message()
+            return None
+        except Exception as e:  # pylint: disable=W0718
+            print(f"\033[31mUnexpected error in completion process: {str(e)}\033[0m")
+            self.print_timeout_error_message()
+            return None
+
+    def prepare_completion_params(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements # noqa: E501
+        self,
+        agent: Agent,
+        history: List,
+        context_variables: dict,
+        model_override: str,
+        stream: bool,
+        debug: bool,
+        master_template: str = "system_master_template.md"
+    ) -> dict:
+        """
+        Build the litellm completion parameters (system prompt,
+        outbound messages, tools and model specific settings) for
+        the given agent and history.
+        """
         context_variables = defaultdict(str, context_variables)
 
         # Use the template loading utility instead of hardcoded paths
@@ -208,19 +589,25 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         # --------------------------------
         # Messages
         # --------------------------------
+        # litellm may modify the list it is given (e.g. popping system
+        # messages for Anthropic), so it gets its own shallow copy
         messages = [{"role": "system", "content": load_prompt_template(
             template_path,
             agent=agent,
             ctf_instructions=history[0]["content"],
             context_variables=context_variables,
             reasoning_content=self.last_reasoning_content)
-        }]
-        for msg in history:
-            if (msg.get("sender") not in ["Report Agent", "Reasoner Agent"] and
-                not any("add_memory" in call.get("function", {}).get("name", "")  # noqa: E501
-                        for call in (msg.get("tool_calls") if msg.get("tool_calls")  # noqa: E501
-                                     else []))):
-                messages.append(msg)
+        }, *self._outbound.sync(history)]
+        messages = self.fit_context(
+            model_override or agent.model, messages,
+            get_tool_schemas(self.agent_functions(agent)))
+
+        # History records are read-only, down to their nested values,
+        # and sent as-is; only the providers for which litellm rewrites
+        # messages in place (e.g. their content) get deep copies, see
+        # recover_completion
+        if (model_override or agent.model) in self._rewritten_models:
+            messages = [thaw(msg) for msg in messages]
 
         # Add support for prompt caching for claude (not automatically applied)
         # Gemini supports it too
@@ -230,12 +617,8 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         if ((agent.model.startswith("claude") or 
              "gemini" in agent.model) and 
             len(messages) > 0):
-            # Create a copy of the last message and add cache_control to it
-            # It's important to create a copy to avoid modifying the original
-            # message
-            last_msg = messages[-1].copy()
-            last_msg["cache_control"] = {"type": "ephemeral"}
-            messages[-1] = last_msg
+            messages[-1] = {**messages[-1],
+                            "cache_control": {"type": "ephemeral"}}
 
         # --------------------------------
         # Debug
@@ -249,24 +632,13 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         # --------------------------------
         # Tools
         # --------------------------------
-        tools = []
-        for f in agent.functions:
-            if callable(f):
-                if "gemini" in (model_override or agent.model):
-                    # Gemini format
-                    tool = function_to_json(f)
-                    tool["function"]["name"] = tool["function"].get("name", "").replace("-", "_")
-                    tools.append(tool)
-                else:
-                    tools.append(function_to_json(f))
-        # Process all tools in a single loop
-        for tool in tools:
-            params = tool["function"]["parameters"]
-
-            # Hide context_variables from model
-            params["properties"].pop(__CTX_VARS_NAME__, None)
-            if __CTX_VARS_NAME__ in params["required"]:
-                params["required"].remove(__CTX_VARS_NAME__)
+        # Schemas are cached per function and provider; litellm
+        # rewrites them in place for some providers (e.g. Gemini), so
+        # each request gets its own mutable copy
+        tools = copy.deepcopy(list(get_tool_schemas(
+            self.agent_functions(agent),
+            "gemini" if "gemini" in (model_override or agent.model)
+            else "default")))
 
         # --------------------------------
         # Inference parameters
@@ -288,6 +660,11 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                     create_params["stream_options"] = {"include_usage": True}
             if not isinstance(agent, CodeAgent):  # Don't set temperature for CodeAgent  # noqa: E501
                 create_params["temperature"] = 0.7
+        if (stream and "stream_options" not in create_params and
+                not any(x in create_params["model"]
+                        for x in ["azure", "gemini", "deepseek"])):
+            # usage is only reported in the last chunk when requested
+            create_params["stream_options"] = {"include_usage": True}
         # Refer to https://docs.litellm.ai/docs/completion/json_mode
         if agent.structured_output_class:
             # if providing the schema
@@ -331,259 +708,399 @@ class CAI:  # pylint: disable=too-many-instance-attributes
             create_params.pop("parallel_tool_calls", None)
         if any(x in agent.model for x in ["deepseek/deepseek-chat"]):
             create_params.pop("parallel_tool_calls", None)
-            litellm.drop_params = True 
-        # --------------------------------
-        # Inference
-        # --------------------------------
-        # We keep trying when we reach the rate limit
-        first_attempt = True  # Track if this is the first API call attempt
-        try:
-            while True:
-                litellm_completion = None
-                try:
-                    if first_attempt:
-                        
-                        # NOTE: This is a workaround for those cases wherein there's neither a 
-                        # remote model enabled (via its corresponding API keys) nor a local model
-                        # available (via ollama). In this case, the model will not be able to
-                        # respond to the user's message, and the conversation will hang.
-                        #
-                        # To avoid this, we set a default timeout of 300 seconds.
-                        create_params["timeout"] = int(
-                            os.getenv("CAI_TIMEOUT", "300")
-                        )
-                        first_attempt = False
-                    elif "timeout" in create_params:
-                        del create_params["timeout"]
-                        
-                    if os.getenv("OLLAMA", "").lower() == "true":
-                        litellm_completion = litellm.completion(
-                            **create_params,
-                            api_base=get_ollama_api_base(),
-                            custom_llm_provider="openai"
-                        )
-                    else:
-                        litellm_completion = litellm.completion(**create_params)
-                except litellm.AuthenticationError as e:
-                    # Extract provider information from the model string
-                    model_name = create_params.get("model", "Unknown model")
-                    
-                    # Determine provider and API key environment variable name
-                    provider_info = {
-                        "gpt": {"name": "OpenAI", "env_var": "OPENAI_API_KEY", "url": "https://platform.openai.com/api-keys"},
-                        "claude": {"name": "Anthropic", "env_var": "ANTHROPIC_API_KEY", "url": "https://console.anthropic.com/settings/keys"},
-                        "gemini": {"name": "Google", "env_var": "GEMINI_API_KEY", "url": "https://aistudio.google.com/app/apikey"},
-                        "deepseek": {"name": "DeepSeek", "env_var": "DEEPSEEK_API_KEY", "url": "https://platform.deepseek.com/api-keys"}
-                    }
-                    
-                    # Determine which provider is being used
-                    provider_key = next((k for k in provider_info.keys() if k in model_name.lower()), None)
-                    
-                    if provider_key:
-                        provider = provider_info[provider_key]
-                        print(f"\033[31mAuthentication Error: Missing or invalid API key for {provider['name']}.\033[0m")
-                        print(f"\033[31mPlease set the {provider['env_var']} environment variable.\033[0m")
-                        print(f"\033[31mYou can obtain an API key from: {provider['url']}\033[0m")
-                        print(f"\033[31mAdd it to your environment with: export {provider['env_var']}=your_api_key\033[0m")
-                    else:
-                        # Generic message if provider cannot be determined
-                        print(f"\033[31mAuthentication Error: Missing or invalid API key for model {model_name}.\033[0m")
-                        print(f"\033[31mPlease ensure you have set the appropriate API key environment variable.\033[0m")
-                    
-                    return None
+            litellm.drop_params = True
+        return create_params
+
+    def fit_context(self, model, messages, tool_schemas=()):
+        """
+        Trim the outbound messages before sending so that the prompt
+        fits the input window of model.
+
+        The window is get_model_input_tokens(model) minus
+        CAI_CONTEXT_RESERVE tokens left for the reply, the system
+        prompt and the tool schemas. Message token counts are cached
+        in the outbound view, so when the prompt fits this costs no
+        more than tokenizing the system prompt.
+
+        Args:
+            model: Model the request is sent to
+            messages: System prompt followed by the outbound view
+            tool_schemas: Tool schemas from get_tool_schemas
+
+        Returns:
+            list: messages, or a trimmed copy (see fit_messages)
+        """
+        self.prompt_tokens_estimate = 0
+        counts, total = self._outbound.token_counts(model)
+        if len(counts) != len(messages) - 1:  # not the outbound view
+            return messages
+        tools_key = (model, id(tool_schemas))
+        cached = self._tool_tokens.get(tools_key)
+        if cached is None or cached[0] is not tool_schemas:
+            cached = self._tool_tokens[tools_key] = (
+                tool_schemas,
+                estimate_message_tokens(model, {
+                    "role": "system",
+                    "content": json.dumps(tool_schemas)}
+                ) if tool_schemas else 0)
+        overhead = cached[1] + estimate_message_tokens(model, messages[0])
+        self.prompt_tokens_estimate = overhead + total
+        budget = (get_model_input_tokens(model) - self.context_reserve -
+                  overhead)
+        if total <= budget:
+            return messages
+
+        outbound = messages[1:]
+        fitted = fit_messages(outbound, counts, budget)
+        if fitted is outbound:
+            return messages
+        print(f"\033[33mTrimmed history from {len(messages) - 1} to "
+              f"{len(fitted)} messages to fit the context window "
+              f"of {model}\033[0m")
+        self.prompt_tokens_estimate = overhead + min(total, budget)
+        return [messages[0], *fitted]
+
+    @staticmethod
+    def agent_functions(agent):
+        """
+        The tools of agent, plus read_tool_output once tool outputs
+        have been spilled (see cai.tools.misc.spill).
+        """
+        if (spill_store.sizes and agent.functions and
+                read_tool_output not in agent.functions):
+            return [*agent.functions, read_tool_output]
+        return agent.functions
+
+    def _cassette_lookup(self, create_params):
+        """
+        Look the request up in the cassette (see cai.cassette).
+
+        The key is taken before the request is sent, as litellm and
+        recover_completion may rewrite the params.
+
+        Returns:
+            tuple: (request key or None if there is no cassette,
+                recorded completion or None)
+        """
+        if self.cassette is None:
+            return None, None
+        key = request_key(create_params)
+        return key, self.cassette.lookup(key)
+
+    @staticmethod
+    def _set_request_timeout(create_params, first_attempt):
+        """Set the request timeout for the first attempt only."""
+        if first_attempt:
+            # NOTE: This is a workaround for those cases wherein there's neither a 
+            # remote model enabled (via its corresponding API keys) nor a local model
+            # available (via ollama). In this case, the model will not be able to
+            # respond to the user's message, and the conversation will hang.
+            #
+            # To avoid this, we set a default timeout of 300 seconds.
+            create_params["timeout"] = int(
+                os.getenv("CAI_TIMEOUT", "300")
+            )
+        elif "timeout" in create_params:
+            del create_params["timeout"]
+
+    @staticmethod
+    def _needs_retry(create_params, litellm_completion):
+        """
+        Gemini 2.5 Pro is special and sometimes returns empty completions <3
+        Maybe something Google fixes in the future
+        """
+        return (create_params["model"] == "gemini/gemini-2.5-pro-exp-03-25" and
+                litellm_completion and
+                not isinstance(litellm_completion,
+                               litellm.CustomStreamWrapper) and
+                len(litellm_completion.choices) == 0)
+
+    @staticmethod
+    def handle_rate_limit(e, model):
+        """
+        Report a RateLimitError to the rate limiter, which makes every
+        request to the same provider wait (for the provider's retry
+        hint, or exponential backoff with jitter).
+
+        Returns:
+            float: seconds until requests to the provider resume
+        """
+        print("Rate Limit Error:" + str(e))
+        retry_delay = rate_limiter.on_rate_limited(model, e)
+        print(f"Waiting {retry_delay:.1f} seconds before retrying...")
+        return retry_delay
+
+    def recover_completion(self, e, create_params):  # pylint: disable=too-many-branches,too-many-statements # noqa: E501
+        """
+        Recover from an error raised by litellm.completion.
+
+        Depending on the error, create_params is fixed up (trimmed
+        history, repaired message list, empty contents, Ollama
+        fallback, ...) and the request is retried.
+
+        Returns:
+            The completion obtained after recovering, or None if the
+            request should simply be attempted again
+
+        Raises:
+            _CompletionAborted: if no completion can be obtained and
+                the error has already been reported to the user
+            Exception: the original error if it cannot be handled
+        """
+        cause = e  # litellm may wrap the error
+        while cause is not None and not isinstance(cause, ReadOnlyError):
+            cause = cause.__cause__ or cause.__context__
+        if cause is not None:
+            # litellm rewrites the messages of this provider in place:
+            # send it copies of the history records from now on
+            self._rewritten_models.add(create_params["model"])
+            create_params["messages"] = [
+                thaw(msg) for msg in create_params["messages"]]
+            return None
+        if isinstance(e, litellm.AuthenticationError):
+            # Extract provider information from the model string
+            model_name = create_params.get("model", "Unknown model")
+            
+            # Determine provider and API key environment variable name
+            provider_info = {
+                "gpt": {"name": "OpenAI", "env_var": "OPENAI_API_KEY", "url": "https://platform.openai.com/api-keys"},
+                "claude": {"name": "Anthropic", "env_var": "ANTHROPIC_API_KEY", "url": "https://console.anthropic.com/settings/keys"},
+                "gemini": {"name": "Google", "env_var": "GEMINI_API_KEY", "url": "https://aistudio.google.com/app/apikey"},
+                "deepseek": {"name": "DeepSeek", "env_var": "DEEPSEEK_API_KEY", "url": "https://platform.deepseek.com/api-keys"}
+            }
+            
+            # Determine which provider is being used
+            provider_key = next((k for k in provider_info.keys() if k in model_name.lower()), None)
+            
+            if provider_key:
+                provider = provider_info[provider_key]
+                print(f"\033[31mAuthentication Error: Missing or invalid API key for {provider['name']}.\033[0m")
+                print(f"\033[31mPlease set the {provider['env_var']} environment variable.\033[0m")
+                print(f"\033[31mYou can obtain an API key from: {provider['url']}\033[0m")
+                print(f"\033[31mAdd it to your environment with: export {provider['env_var']}=your_api_key\033[0m")
+            else:
+                # Generic message if provider cannot be determined
+                print(f"\033[31mAuthentication Error: Missing or invalid API key for model {model_name}.\033[0m")
+                print(f"\033[31mPlease ensure you have set the appropriate API key environment variable.\033[0m")
+            
+            raise _CompletionAborted() from e
+
+        if isinstance(e, litellm.exceptions.BadRequestError):
+            messages = create_params["messages"]
+            # Check if it's a context window exceeded error
+            if ("context window" in str(e).lower() or 
+                "prompt is too long" in str(e).lower() or 
+                "window exceeded" in str(e).lower()):
+                print(f"\033[33mContext window exceeded: {str(e)}\033[0m")
+                print("\033[33mTrimming conversation history to fit context window...\033[0m")
                 
-                except litellm.exceptions.BadRequestError as e:
-                    # Check if it's a context window exceeded error
-                    if ("context window" in str(e).lower() or 
-                        "prompt is too long" in str(e).lower() or 
-                        "window exceeded" in str(e).lower()):
-                        print(f"\033[33mContext window exceeded: {str(e)}\033[0m")
-                        print("\033[33mTrimming conversation history to fit context window...\033[0m")
-                        
-                        # Keep system prompt, first user message, and the most recent messages
-                        if len(messages) > 12:
-                            preserved_messages = [messages[0], messages[1]]  # System prompt and first message
-                            preserved_messages.extend(messages[-10:])  # Last 10 messages
-                            create_params["messages"] = preserved_messages
-                            print(f"\033[33mReduced history from {len(messages)} to {len(preserved_messages)} messages\033[0m")
-                            # Retry with smaller context
-                            continue
-                        else:
-                            # If we can't trim further, raise the exception
-                            raise e
-                    elif "LLM Provider NOT provided" in str(e):
-                        # Create a copy of params to avoid overwriting the original
-                        # ones
-                        ollama_params = create_params.copy()
-                        ollama_params["api_base"] = get_ollama_api_base()
-                        ollama_params["custom_llm_provider"] = "openai"
-                        try:
-                            litellm_completion = litellm.completion(**ollama_params)
-                        except litellm.exceptions.BadRequestError as e:  # pylint: disable=W0621,C0301 # noqa: E501
-                            #
-                            # CTRL C handler for ollama models
-                            #
-                            if "invalid message content type" in str(e):
-                                create_params["messages"] = fix_message_list(
-                                    create_params["messages"])
-                                litellm_completion = litellm.completion(
-                                    **create_params)
-                            else:
-                                raise e
-                    elif ("An assistant message with 'tool_calls'" in str(e) or
-                        "`tool_use` blocks must be followed by a user message with `tool_result`" in str(e)):  # noqa: E501 # pylint: disable=C0301
-                        print(f"Error: {str(e)}")
-                        # EDGE CASE: Report Agent CTRL C error
-                        # This fix CTRL C error when message list is incomplete
-                        # When a tool is not finished but the LLM generates a tool call
+                # The estimate was off: keep the system prompt, first
+                # user message and the most recent half of the tokens,
+                # without splitting tool calls from their results
+                outbound = messages[1:]
+                counts = [estimate_message_tokens(create_params["model"], msg)
+                          for msg in outbound]
+                fitted = fit_messages(outbound, counts, sum(counts) // 2)
+                if fitted is not outbound:
+                    preserved_messages = [messages[0], *fitted]
+                    create_params["messages"] = preserved_messages
+                    print(f"\033[33mReduced history from {len(messages)} to {len(preserved_messages)} messages\033[0m")
+                    # Retry with smaller context
+                    return None
+                # If we can't trim further, raise the exception
+                raise e
+            if "LLM Provider NOT provided" in str(e):
+                # Create a copy of params to avoid overwriting the original
+                # ones
+                ollama_params = create_params.copy()
+                ollama_params["api_base"] = get_ollama_api_base()
+                ollama_params["custom_llm_provider"] = "openai"
+                try:
+                    return litellm.completion(**ollama_params)
+                except litellm.exceptions.BadRequestError as e:  # pylint: disable=W0621,C0301 # noqa: E501
+                    #
+                    # CTRL C handler for ollama models
+                    #
+                    if "invalid message content type" in str(e):
                         create_params["messages"] = fix_message_list(
                             create_params["messages"])
-                        litellm_completion = litellm.completion(**create_params)
-                    # this captures an error related to the fact
-                    # that the messages list contains an empty
-                    # content position
-                    elif "expected a string, got null" in str(e):
-                        print(f"Error: {str(e)}")
-                        # Fix for null content in messages
-                        create_params["messages"] = [
-                            msg if msg.get("content") is not None else
-                            {**msg, "content": ""} for msg in create_params["messages"]
-                        ]
-                        litellm_completion = litellm.completion(**create_params)
-
-                    # Handle Anthropic error for empty text content blocks
-                    elif ("text content blocks must be non-empty" in str(e) or
-                        "cache_control cannot be set for empty text blocks" in str(e)):  # noqa
-                        # Only print the error message the first time it happens
-                        if not self.empty_content_error_shown:
-                            print(f"Error: {str(e)}")
-                            self.empty_content_error_shown = True
-                        
-                        # Fix for empty content in messages for Anthropic models
-                        create_params["messages"] = [
-                            msg if msg.get("content") not in [None, ""] else
-                            {
-                                **msg,
-                                "content": "Empty content block"
-                            } for msg in create_params["messages"]
-                        ]
-                        litellm_completion = litellm.completion(**create_params)
-                    else:
-                        raise e
-                except litellm.exceptions.RateLimitError as e:
-                    print("Rate Limit Error:" + str(e))
-                    # Try to extract retry delay from error response or use default
-                    retry_delay = 60  # Default delay in seconds
-                    try:
-                        # Extract the JSON part from the error message
-                        json_str = str(e.message).split('VertexAIException - ')[-1]
-                        error_details = json.loads(json_str)
-                        
-                        retry_info = next(
-                            (detail for detail in error_details.get('error', {}).get('details', [])
-                             if detail.get('@type') == 'type.googleapis.com/google.rpc.RetryInfo'),
-                            None
-                        )
-                        if retry_info and 'retryDelay' in retry_info:
-                            retry_delay = int(retry_info['retryDelay'].rstrip('s'))
-                    except Exception as parse_error:
-                        print(f"Could not parse retry delay, using default: {parse_error}")
-                    
-                    print(f"Waiting {retry_delay} seconds before retrying...")
-                    time.sleep(retry_delay)
-
-                except Exception:  # pylint: disable=W0718
-                    print("If you are using private models, there is a error. "
-                          "callback to ollama")
-                    ollama_params = create_params.copy()
-                    ollama_params["api_base"] = get_ollama_api_base()
-                    ollama_params["custom_llm_provider"] = "openai"
-                    create_params["timeout"] = 60
-                    try:
-                        litellm_completion = litellm.completion(**ollama_params)
-                    except Exception as e:  # pylint: disable=W0718  # noqa
-                        try:
-                            litellm_completion = litellm.completion(**create_params)
-                        except Exception as execp:  # pylint: disable=W0718
-                            print("Error: " + str(execp))
-                            return None
-                # Gemini 2.5 Pro is special and sometimes returns empty completions <3
-                # Maybe something Google fixes in the future
-                if create_params["model"] == "gemini/gemini-2.5-pro-exp-03-25":
-                    if litellm_completion and len(litellm_completion.choices) == 0:
-                        # We just need to retry
-                        continue
-                # If we get a valid completion, we exit the loop
-                if litellm_completion:
-                    break
+                        return litellm.completion(**create_params)
+                    raise e
+            if ("An assistant message with 'tool_calls'" in str(e) or
+                "`tool_use` blocks must be followed by a user message with `tool_result`" in str(e)):  # noqa: E501 # pylint: disable=C0301
+                print(f"Error: {str(e)}")
+                # EDGE CASE: Report Agent CTRL C error
+                # This fix CTRL C error when message list is incomplete
+                # When a tool is not finished but the LLM generates a tool call
+                create_params["messages"] = fix_message_list(
+                    create_params["messages"])
+                return litellm.completion(**create_params)
+            # this captures an error related to the fact
+            # that the messages list contains an empty
+            # content position
+            if "expected a string, got null" in str(e):
+                print(f"Error: {str(e)}")
+                # Fix for null content in messages
+                create_params["messages"] = [
+                    msg if msg.get("content") is not None else
+                    {**msg, "content": ""} for msg in create_params["messages"]
+                ]
+                return litellm.completion(**create_params)
+
+            # Handle Anthropic error for empty text content blocks
+            if ("text content blocks must be non-empty" in str(e) or
+                "cache_control cannot be set for empty text blocks" in str(e)):  # noqa
+                # Only print the error message the first time it happens
+                if not self.empty_content_error_shown:
+                    print(f"Error: {str(e)}")
+                    self.empty_content_error_shown = True
+                
+                # Fix for empty content in messages for Anthropic models
+                create_params["messages"] = [
+                    msg if msg.get("content") not in [None, ""] else
+                    {
+                        **msg,
+                        "content": "Empty content block"
+                    } for msg in create_params["messages"]
+                ]
+                return litellm.completion(**create_params)
+            raise e
+
+        if isinstance(e, litellm.exceptions.RateLimitError):
+            # the next rate_limiter.slot() waits out the backoff
+            self.handle_rate_limit(e, create_params["model"])
+            return None
 
-            # --------------------------------
-            # Training data
-            # --------------------------------
-            if self.rec_training_data:
-                self.rec_training_data.rec_training_data(
-                    create_params, litellm_completion, self.total_cost)
-
-            # --------------------------------
-            # Token counts
-            # --------------------------------
-            if litellm_completion.usage:
-                self.interaction_input_tokens = (
-                    litellm_completion.usage.prompt_tokens
-                )
-                self.interaction_output_tokens = (
-                    litellm_completion.usage.completion_tokens
-                )
-                if (hasattr(litellm_completion.usage, 'completion_tokens_details') and  # noqa: E501  # pylint: disable=C0103
-                        litellm_completion.usage.completion_tokens_details and
-                        hasattr(litellm_completion.usage.completion_tokens_details,
-                                'reasoning_tokens') and
-                        litellm_completion.usage.completion_tokens_details.reasoning_tokens):  # noqa: E501  # pylint: disable=C0103
-                    self.interaction_reasoning_tokens = (
-                        litellm_completion.usage.completion_tokens_details.reasoning_tokens)  # noqa: E501  # pylint: disable=C0103
-                    self.total_reasoning_tokens += self.interaction_reasoning_tokens  # noqa: E501  # pylint: disable=C0103
-                else:
-                    self.interaction_reasoning_tokens = 0
+        print("If you are using private models, there is a error. "
+              "callback to ollama")
+        ollama_params = create_params.copy()
+        ollama_params["api_base"] = get_ollama_api_base()
+        ollama_params["custom_llm_provider"] = "openai"
+        create_params["timeout"] = 60
+        try:
+            return litellm.completion(**ollama_params)
+        except Exception:  # pylint: disable=W0718  # noqa
+            try:
+                return litellm.completion(**create_params)
+            except Exception as execp:  # pylint: disable=W0718
+                print("Error: " + str(execp))
+                raise _CompletionAborted() from execp
 
-                self.total_input_tokens += (
-                    self.interaction_input_tokens
-                )
-                self.total_output_tokens += (
-                    self.interaction_output_tokens
-                )
+    def record_completion(self, create_params, litellm_completion):
+        """
+        Record training data, token counts and cost for a completion.
 
-            try:
-                interaction_cost = litellm.completion_cost(
-                    completion_response=litellm_completion,
-                    model=create_params["model"]
-                )
-                self.total_cost += float(interaction_cost)
-                # Store the interaction cost for display in CLI functions
-                self.interaction_cost = interaction_cost
-                # Add cost to litellm_completion for DataRecorder
-                litellm_completion.cost = interaction_cost
-            except Exception as e:  # pylint: disable=W0718
-                self.interaction_cost = 0.0
-                # If the error is about unmapped model, set cost to 0
-                if "model isn't mapped yet" in str(e):
-                    self.total_cost += 0.0
-                    litellm_completion.cost = 0.0
-                else:
-                    print(e)
+        Returns:
+            The same completion, with its cost attached
+        """
+        # --------------------------------
+        # Training data
+        # --------------------------------
+        if self.rec_training_data:
+            self.rec_training_data.rec_training_data(
+                create_params, litellm_completion, self.total_cost)
 
-            return litellm_completion
-        except litellm.Timeout as e:
-            print(f"\033[31mRequest timed out: {str(e)}\033[0m")
-            self.print_timeout_error_message()
-            return None
-        except litellm.APIError as e:
-            print(f"\033[31mAPI error: {str(e)}\033[0m")
-            self.print_connection_error_message()
-            return None
-        except Exception as e:
-            print(f"\033[31mUnexpected error in completion process: {str(e)}\033[0m")
-            self.print_timeout_error_message()
-            return None
+        # --------------------------------
+        # Token counts
+        # --------------------------------
+        if litellm_completion.usage:
+            self.interaction_input_tokens = (
+                litellm_completion.usage.prompt_tokens
+            )
+            self.interaction_output_tokens = (
+                litellm_completion.usage.completion_tokens
+            )
+            if (hasattr(litellm_completion.usage, 'completion_tokens_details') and  # noqa: E501  # pylint: disable=C0103
+                    litellm_completion.usage.completion_tokens_details and
+                    hasattr(litellm_completion.usage.completion_tokens_details,
+                            'reasoning_tokens') and
+                    litellm_completion.usage.completion_tokens_details.reasoning_tokens):  # noqa: E501  # pylint: disable=C0103
+                self.interaction_reasoning_tokens = (
+                    litellm_completion.usage.completion_tokens_details.reasoning_tokens)  # noqa: E501  # pylint: disable=C0103
+                self.total_reasoning_tokens += self.interaction_reasoning_tokens  # noqa: E501  # pylint: disable=C0103
+            else:
+                self.interaction_reasoning_tokens = 0
+
+            self.total_input_tokens += (
+                self.interaction_input_tokens
+            )
+            self.total_output_tokens += (
+                self.interaction_output_tokens
+            )
+            # account for the reply and any error in the estimate
+            rate_limiter.record_usage(
+                create_params["model"],
+                (self.interaction_input_tokens or 0) +
+                (self.interaction_output_tokens or 0) -
+                self.prompt_tokens_estimate)
+
+        try:
+            interaction_cost = litellm.completion_cost(
+                completion_response=litellm_completion,
+                model=create_params["model"]
+            )
+            self.total_cost += float(interaction_cost)
+            # Store the interaction cost for display in CLI functions
+            self.interaction_cost = interaction_cost
+            # Add cost to litellm_completion for DataRecorder
+            litellm_completion.cost = interaction_cost
+        except Exception as e:  # pylint: disable=W0718
+            self.interaction_cost = 0.0
+            # If the error is about unmapped model, set cost to 0
+            if "model isn't mapped yet" in str(e):
+                self.total_cost += 0.0
+                litellm_completion.cost = 0.0
+            else:
+                print(e)
+
+        return litellm_completion
+
+    def consume_stream(  # pylint: disable=too-many-arguments
+            self, stream, agent, create_params, debug,
+            on_tool_call_ready=None):
+        """
+        Consume a litellm completion stream as chunks arrive.
+
+        Assistant content is rendered incrementally and tool call
+        fragments are merged per index with merge_chunk. Providers
+        emit tool calls one after another, so once a fragment for a
+        higher index shows up, the previous call is complete and is
+        handed to on_tool_call_ready (if its arguments are valid
+        JSON) while the rest of the stream is still being received.
+
+        Args:
+            stream: litellm.CustomStreamWrapper returned by completion
+            agent: Agent producing the completion
+            create_params: Parameters used for the completion
+            debug: Debug level
+            on_tool_call_ready: Optional callable receiving a
+                ChatCompletionMessageToolCall
+
+        Returns:
+            ModelResponse: the completion rebuilt from all chunks,
+                including usage, as if stream had been False
+        """
+        assembler = _StreamAssembler(
+            agent, create_params, debug, on_tool_call_ready)
+        try:
+            for chunk in stream:
+                assembler.add(chunk)
+        finally:
+            assembler.close()
+        return assembler.build()
+
+    async def aconsume_stream(  # pylint: disable=too-many-arguments
+            self, stream, agent, create_params, debug,
+            on_tool_call_ready=None):
+        """Async counterpart of consume_stream for litellm.acompletion."""
+        assembler = _StreamAssembler(
+            agent, create_params, debug, on_tool_call_ready)
+        try:
+            async for chunk in stream:
+                assembler.add(chunk)
+        finally:
+            assembler.close()
+        return assembler.build()
 
     def print_timeout_error_message(self):
         print("\033[31mThis is likely due to network connectivity issues or the host cannot be reached.\033[0m")
@@ -633,7 +1150,301 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                     debug_print(debug, error_message, brief=self.brief)
                     raise TypeError(error_message) from e
 
-    def handle_tool_calls(  # pylint: disable=too-many-arguments,too-many-locals,too-many-statements  # noqa: E501
+    def parse_tool_call(self, tool_call, function_map, context_variables,
+                        debug):
+        """
+        Parse and validate the arguments of a tool call.
+
+        Args:
+            tool_call (ChatCompletionMessageToolCall): Tool call
+                requested by the AI agent
+            function_map (dict): Available functions by name
+            context_variables (dict): Context variables to pass
+                to functions
+            debug (bool): Flag to enable debug logging
+
+        Returns:
+            tuple: (args, error) where args is the dict of keyword
+                arguments for the function and error is the tool
+                message content to report instead, if any
+        """
+        name = tool_call.function.name
+        # handle missing tool case
+        if name not in function_map:
+            debug_print(
+                debug,
+                f"Tool {name} not found in function map.",
+                brief=self.brief)
+            return None, f"Error: Tool {name} not found."
+        try:
+            args = json.loads(tool_call.function.arguments)
+            # Handle potential nested 'fields' format from some models (e.g., Gemini)
+            # This function recursively flattens nested fields structures of any depth
+            if isinstance(args, dict):
+                transformed_args = flatten_gemini_fields(args)
+                if transformed_args != args:
+                    debug_print(
+                        debug,
+                        f"Transformed Gemini nested args: {args} -> {transformed_args}",
+                        brief=self.brief
+                    )
+                    args = transformed_args
+        except json.JSONDecodeError:
+            debug_print(
+                debug,
+                f"Invalid JSON in tool arguments: {
+                    tool_call.function.arguments}",
+                brief=self.brief)
+            return None, "Error: Invalid JSON in tool arguments."
+        debug_print(
+            debug,
+            "Processing tool call",
+            name,
+            "with arguments",
+            args,
+            brief=self.brief)
+
+        func = function_map[name]
+
+        # # NOTE: this becomes cumbersome to follow
+        # if "transfer" in name or "handoff" in name:
+        #     visualize_agent_graph(func())
+
+        # pass context_variables to agent functions
+        if __CTX_VARS_NAME__ in func.__code__.co_varnames:
+            args[__CTX_VARS_NAME__] = context_variables
+        if self.ctf and self.ctf_inside:
+            args["ctf"] = self.ctf
+        return args, None
+
+    def execute_tool_call(self, name, args, function_map):
+        """
+        Execute a parsed tool call with logging.
+
+        Args:
+            name (str): The name of the tool to execute
+            args (dict): Keyword arguments returned by parse_tool_call
+            function_map (dict): Available functions by name
+
+        Returns:
+            The raw result of the tool function
+        """
+        @exploit_logger.log_tool()
+        def execute_tool(tool_name, **tool_args):
+            """Execute a tool function with logging.
+
+            Args:
+                tool_name (str): The name of the tool to execute
+                **tool_args: Variable keyword arguments to pass
+                    to the tool function
+
+            Returns:
+                The result from executing the tool function with
+                    the given arguments
+            """
+            try:
+                raw_result = function_map[tool_name](**tool_args)
+                if inspect.isawaitable(raw_result):  # async tools
+                    raw_result = _run_sync(raw_result)
+            except KeyboardInterrupt:
+                print("\nCtrl+C pressed")
+                raw_result = ("\n\nCOMMAND INTERRUPTED by user, "
+                              "probably cause you are bad")
+                return raw_result
+            except TypeError as e:
+                if "unexpected keyword argument" in str(
+                        e):  # Usual Error when open source model try do a handoff # noqa: E501
+                    print(f"Warning: {e}. Executing tool {
+                          tool_name} without arguments.")
+                    raw_result = function_map[tool_name]()
+                else:
+                    print(f"Error executing tool {tool_name}: {e}")
+                    raise e
+            except Exception as e:
+                print(f"Error executing tool {tool_name}: {e}")
+                raise e
+            return raw_result
+
+        return execute_tool(name, **args)
+
+    def dispatch_tool_call(self, tool_call, functions, context_variables,  # pylint: disable=too-many-arguments # noqa: E501
+                           debug, parallel=False):
+        """
+        Start executing a tool call in the background.
+
+        Used while a completion is still streaming and for agents
+        with parallel_tool_calls: the result is picked up by
+        handle_tool_calls when it reaches the tool call with the same
+        id. Tool calls that fail to parse are not dispatched and are
+        reported by handle_tool_calls as usual.
+
+        Args:
+            parallel: Run on the bounded worker pool
+                (CAI_PARALLEL_TOOL_WORKERS) instead of the single
+                sequential worker
+        """
+        function_map = {f.__name__: f for f in functions}
+        args, error = self.parse_tool_call(
+            tool_call, function_map, context_variables, debug)
+        if error:
+            return
+        timing = {}
+
+        def run():
+            timing["start"] = time.monotonic()
+            try:
+                return self.execute_tool_call(
+                    tool_call.function.name, args, function_map)
+            finally:
+                timing["end"] = time.monotonic()
+
+        def submit():
+            timing["executor"] = self._get_tool_executor(parallel)
+            return timing["executor"].submit(run)
+
+        timing["submit"] = submit
+        self._tool_timings = [t for t in self._tool_timings
+                              if "end" not in t]
+        self._tool_timings.append(timing)
+        self._pending_tool_calls[tool_call.id] = (args, submit(), timing)
+
+    def _get_tool_executor(self, parallel):
+        """The worker pool for tool calls, created on first use."""
+        if parallel:
+            if self._parallel_tool_executor is None:
+                self._parallel_tool_executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.max_parallel_tools),
+                    thread_name_prefix="cai-tool-parallel")
+            return self._parallel_tool_executor
+        if self._tool_executor is None:
+            # a single worker keeps tools running in the order the
+            # model emitted them
+            self._tool_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="cai-tool")
+        return self._tool_executor
+
+    def _retire_tool_executor(self, executor):
+        """
+        Stop using a pool with a worker stuck on a timed out tool.
+
+        The calls still queued on it are cancelled; their waiters
+        submit them again to a new pool (see await_tool_result).
+        """
+        if self._tool_executor is executor:
+            self._tool_executor = None
+        if self._parallel_tool_executor is executor:
+            self._parallel_tool_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _stuck(self, executor):
+        """Whether a worker of executor runs a tool past the timeout."""
+        now = time.monotonic()
+        return any(t.get("executor") is executor and "start" in t
+                   and "end" not in t
+                   and now - t["start"] > self.tool_timeout
+                   for t in self._tool_timings)
+
+    async def await_tool_result(self, name, future, timing):
+        """
+        Wait for a dispatched tool call, honouring CAI_TOOL_TIMEOUT.
+
+        The timeout counts from the moment the tool starts running,
+        so calls queued behind a busy worker pool are not penalised.
+        A tool that times out keeps running in its worker (threads
+        cannot be killed); its result is discarded and its pool is
+        replaced, so the calls queued behind it still get to run.
+        Waiting takes no thread.
+
+        Returns:
+            The raw result of the tool function, or an error message
+            if the tool timed out
+        """
+        waited = wrapped = None
+        while True:
+            start = timing.get("start")
+            if start is None:
+                # queued: the workers may all be stuck on tools that
+                # timed out
+                if self._stuck(timing["executor"]):
+                    self._retire_tool_executor(timing["executor"])
+                if future.cancelled():
+                    future = timing["submit"]()
+                remaining = min(self.tool_timeout, 1.0)
+            else:
+                remaining = self.tool_timeout - (time.monotonic() - start)
+                if remaining <= 0 and not future.done():
+                    self._retire_tool_executor(timing["executor"])
+                    return (f"Error: Tool {name} timed out after "
+                            f"{self.tool_timeout:g} seconds.")
+            if future is not waited:
+                waited, wrapped = future, asyncio.wrap_future(future)
+            # then re-check against the actual start time
+            await asyncio.wait({wrapped}, timeout=max(remaining, 0))
+            if wrapped.done() and not wrapped.cancelled():
+                return wrapped.result()
+
+    def record_tool_result(  # pylint: disable=too-many-arguments
+            self, partial_response, tool_call, args, raw_result, agent,
+            debug):
+        """
+        Turn the raw result of a tool call into a tool message,
+        print it and accumulate it (plus any context variables or
+        handoff) into partial_response.
+        """
+        name = tool_call.function.name
+        # print result if not in debug mode so that at least
+        # something is visible in the terminal
+        if not debug:
+            if isinstance(raw_result, str):
+                print("\033[32m" + raw_result + "\033[0m")
+            elif isinstance(raw_result, Agent):  # handoffs
+                print("\033[33m" + raw_result.name + "\033[0m")
+
+        result: Result = self.handle_function_result(raw_result, debug)
+        # drop terminal noise (ANSI codes, progress bars, repeated
+        # lines, padding) that would cost tokens on every turn
+        result.value, savings = normalizer.normalize(result.value)
+        if savings:
+            debug_print(debug, f"Normalized output of {name}: "
+                        f"{format_savings(savings)}", brief=self.brief)
+        # shorten tool output if it exceeds the max_chars_per_message:
+        # the first half from the beginning and the second half from
+        # the end, with the full output spilled to disk for
+        # read_tool_output, whose own pages (bounded by
+        # spill.MAX_READ) are returned whole instead of spilled again
+        if (len(result.value) > self.max_chars_per_message and
+                name != read_tool_output.__name__):
+            result.value = spill_store.preview(
+                result.value, self.max_chars_per_message)
+
+        partial_response.messages.append(
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "tool_name": name,
+                "content": result.value,
+            }
+        )
+        cli_print_tool_call(
+            tool_name=name,
+            tool_args=args,
+            tool_output=result.value,
+            interaction_input_tokens=self.interaction_input_tokens,
+            interaction_output_tokens=self.interaction_output_tokens,
+            interaction_reasoning_tokens=self.interaction_reasoning_tokens,
+            total_input_tokens=self.total_input_tokens,
+            total_output_tokens=self.total_output_tokens,
+            total_reasoning_tokens=self.total_reasoning_tokens,
+            model=agent.model,
+            debug=debug,
+            interaction_cost=self.interaction_cost,
+            total_cost=self.total_cost)
+
+        partial_response.context_variables.update(result.context_variables)
+        if result.agent:
+            partial_response.agent = result.agent
+
+    def handle_tool_calls(  # pylint: disable=too-many-arguments
         self,
         tool_calls: List[ChatCompletionMessageToolCall],
         functions: List[AgentFunction],
@@ -676,6 +1487,82 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                 into a single Response.
             Context variables are updated iteratively as
                 functions are called.
+
+        Synchronous wrapper around ahandle_tool_calls; synchronous
+        tools run on the calling thread, or on the worker pool with
+        Agent.parallel_tool_calls.
+        """
+        return _run_sync(self.ahandle_tool_calls(
+            tool_calls, functions, context_variables, debug, agent,
+            n_turn, message=message, offload_tools=False))
+
+    async def aexecute_tool_call(self, name, args, function_map,
+                                 offload=True):
+        """
+        Async counterpart of execute_tool_call.
+
+        Coroutine tools (e.g. built on arun_command) are awaited on
+        the event loop. Synchronous tools run in a worker thread when
+        offload is set, so other work on the loop is not blocked, or
+        inline otherwise.
+        """
+        if not inspect.iscoroutinefunction(function_map[name]):
+            if offload:
+                return await asyncio.to_thread(
+                    self.execute_tool_call, name, args, function_map)
+            return self.execute_tool_call(name, args, function_map)
+
+        @exploit_logger.log_tool()
+        async def execute_tool(tool_name, **tool_args):
+            """Await a coroutine tool function with logging."""
+            try:
+                raw_result = await function_map[tool_name](**tool_args)
+            except KeyboardInterrupt:
+                print("\nCtrl+C pressed")
+                raw_result = ("\n\nCOMMAND INTERRUPTED by user, "
+                              "probably cause you are bad")
+                return raw_result
+            except TypeError as e:
+                if "unexpected keyword argument" in str(
+                        e):  # Usual Error when open source model try do a handoff # noqa: E501
+                    print(f"Warning: {e}. Executing tool {
+                          tool_name} without arguments.")
+                    raw_result = await function_map[tool_name]()
+                else:
+                    print(f"Error executing tool {tool_name}: {e}")
+                    raise e
+            except Exception as e:
+                print(f"Error executing tool {tool_name}: {e}")
+                raise e
+            return raw_result
+
+        return await execute_tool(name, **args)
+
+    async def ahandle_tool_calls(  # pylint: disable=too-many-arguments,too-many-locals  # noqa: E501
+        self,
+        tool_calls: List[ChatCompletionMessageToolCall],
+        functions: List[AgentFunction],
+        context_variables: dict,
+        debug: bool,
+        agent: Agent,
+        n_turn: int = 0,
+        message: str = "",
+        offload_tools: bool = True
+    ) -> Response:
+        """
+        Execute and handle tool calls made by the AI agent, see
+        handle_tool_calls.
+
+        With parallel_tool_calls, independent calls run concurrently
+        (at most CAI_PARALLEL_TOOL_WORKERS at a time, each bounded by
+        CAI_TOOL_TIMEOUT): synchronous tools on the tool worker pool
+        (see dispatch_tool_call and await_tool_result), coroutine
+        tools on the event loop. Results are recorded in the original
+        order either way, so the last handoff wins.
+
+        Args:
+            offload_tools: Run synchronous tools in worker threads
+                instead of inline on the event loop
         """
         function_map = {f.__name__: f for f in functions}
         partial_response = Response(
@@ -684,151 +1571,68 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         cli_print_agent_messages(agent.name, message,
                                  n_turn, agent.model, debug)
 
-        for tool_call in tool_calls:
+        parallel = (agent.parallel_tool_calls and len(tool_calls) > 1 and
+                    len({t.id for t in tool_calls}) == len(tool_calls))
+        semaphore = asyncio.Semaphore(max(1, self.max_parallel_tools))
+        if parallel:
+            # threads cannot be cancelled: synchronous tools go to the
+            # worker pool, which is replaced when stuck on a timed out
+            # tool, rather than to the loop's default executor
+            for tool_call in tool_calls:
+                if (tool_call.id not in self._pending_tool_calls and
+                        not inspect.iscoroutinefunction(
+                            function_map.get(tool_call.function.name))):
+                    self.dispatch_tool_call(
+                        tool_call, functions, context_variables, debug,
+                        parallel=True)
+
+        async def run_tool_call(tool_call):
             name = tool_call.function.name
-            # handle missing tool case, skip to next tool
-            if name not in function_map:
-                debug_print(
-                    debug,
-                    f"Tool {name} not found in function map.",
-                    brief=self.brief)
-                partial_response.messages.append(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "tool_name": name,
-                        "content": f"Error: Tool {name} not found.",
-                    }
-                )
-                continue
-            try:
-                args = json.loads(tool_call.function.arguments)
-                # Handle potential nested 'fields' format from some models (e.g., Gemini)
-                # This function recursively flattens nested fields structures of any depth
-                if isinstance(args, dict):
-                    transformed_args = flatten_gemini_fields(args)
-                    if transformed_args != args:
-                        debug_print(
-                            debug,
-                            f"Transformed Gemini nested args: {args} -> {transformed_args}",
-                            brief=self.brief
-                        )
-                        args = transformed_args
-            except json.JSONDecodeError:
-                debug_print(
-                    debug,
-                    f"Invalid JSON in tool arguments: {
-                        tool_call.function.arguments}",
-                    brief=self.brief)
+            pending = self._pending_tool_calls.pop(tool_call.id, None)
+            if pending:
+                # already dispatched while streaming or in parallel
+                args, future, timing = pending
+                raw_result = await self.await_tool_result(
+                    name, future, timing)
+                return args, raw_result, None
+            args, error = self.parse_tool_call(
+                tool_call, function_map, context_variables, debug)
+            if error:
+                return args, None, error
+            if not parallel:
+                raw_result = await self.aexecute_tool_call(
+                    name, args, function_map, offload=offload_tools)
+                return args, raw_result, None
+            async with semaphore:  # coroutine tools
+                try:
+                    raw_result = await asyncio.wait_for(
+                        self.aexecute_tool_call(name, args, function_map),
+                        timeout=self.tool_timeout)
+                except asyncio.TimeoutError:
+                    raw_result = (f"Error: Tool {name} timed out after "
+                                  f"{self.tool_timeout:g} seconds.")
+            return args, raw_result, None
+
+        outcomes = None
+        if parallel:
+            outcomes = await asyncio.gather(
+                *(run_tool_call(tool_call) for tool_call in tool_calls))
+
+        for i, tool_call in enumerate(tool_calls):
+            args, raw_result, error = (outcomes[i] if outcomes
+                                       else await run_tool_call(tool_call))
+            if error:
                 partial_response.messages.append(
                     {
                         "role": "tool",
                         "tool_call_id": tool_call.id,
-                        "tool_name": name,
-                        "content": "Error: Invalid JSON in tool arguments.",
+                        "tool_name": tool_call.function.name,
+                        "content": error,
                     }
                 )
-
                 continue
-            debug_print(
-                debug,
-                "Processing tool call",
-                name,
-                "with arguments",
-                args,
-                brief=self.brief)
-
-            func = function_map[name]
-
-            # # NOTE: this becomes cumbersome to follow
-            # if "transfer" in name or "handoff" in name:
-            #     visualize_agent_graph(func())
-
-            # pass context_variables to agent functions
-            if __CTX_VARS_NAME__ in func.__code__.co_varnames:
-                args[__CTX_VARS_NAME__] = context_variables
-            if self.ctf and self.ctf_inside:
-                args["ctf"] = self.ctf
-
-            @exploit_logger.log_tool()
-            def execute_tool(tool_name, **tool_args):
-                """Execute a tool function with logging.
-
-                Args:
-                    tool_name (str): The name of the tool to execute
-                    **tool_args: Variable keyword arguments to pass
-                        to the tool function
-
-                Returns:
-                    The result from executing the tool function with
-                        the given arguments
-                """
-                try:
-                    raw_result = function_map[tool_name](**tool_args)
-                except KeyboardInterrupt:
-                    print("\nCtrl+C pressed")
-                    raw_result = ("\n\nCOMMAND INTERRUPTED by user, "
-                                  "probably cause you are bad")
-                    return raw_result
-                except TypeError as e:
-                    if "unexpected keyword argument" in str(
-                            e):  # Usual Error when open source model try do a handoff # noqa: E501
-                        print(f"Warning: {e}. Executing tool {
-                              tool_name} without arguments.")
-                        raw_result = function_map[tool_name]()
-                    else:
-                        print(f"Error executing tool {tool_name}: {e}")
-                        raise e
-                except Exception as e:
-                    print(f"Error executing tool {tool_name}: {e}")
-                    raise e
-                return raw_result
-
-            raw_result = execute_tool(name, **args)
-
-            # print result if not in debug mode so that at least
-            # something is visible in the terminal
-            if not debug:
-                if isinstance(raw_result, str):
-                    print("\033[32m" + raw_result + "\033[0m")
-                elif isinstance(raw_result, Agent):  # handoffs
-                    print("\033[33m" + raw_result.name + "\033[0m")
-
-            result: Result = self.handle_function_result(raw_result, debug)
-            # truncate tool output if it exceeds the max_chars_per_message
-            if len(result.value) > self.max_chars_per_message:
-                # pick the first half from the beginning and the second half
-                # from the end
-                half_len = self.max_chars_per_message // 2
-                result.value = (result.value[:half_len] +
-                                result.value[-half_len:])
-
-            partial_response.messages.append(
-                {
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "tool_name": name,
-                    "content": result.value,
-                }
-            )
-            cli_print_tool_call(
-                tool_name=name,
-                tool_args=args,
-                tool_output=result.value,
-                interaction_input_tokens=self.interaction_input_tokens,
-                interaction_output_tokens=self.interaction_output_tokens,
-                interaction_reasoning_tokens=self.interaction_reasoning_tokens,
-                total_input_tokens=self.total_input_tokens,
-                total_output_tokens=self.total_output_tokens,
-                total_reasoning_tokens=self.total_reasoning_tokens,
-                model=agent.model,
-                debug=debug,
-                interaction_cost=self.interaction_cost,
-                total_cost=self.total_cost)
-
-            partial_response.context_variables.update(result.context_variables)
-            if result.agent:
-                partial_response.agent = result.agent
+            self.record_tool_result(
+                partial_response, tool_call, args, raw_result, agent, debug)
 
         return partial_response
 
@@ -924,46 +1728,53 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         # For now, return the same CodeAgent
         return active_agent
 
-    @exploit_logger.log_agent()
-    def process_interaction(self, active_agent, history, context_variables,  # pylint: disable=too-many-arguments,too-many-locals,too-many-statements,too-many-branches # noqa: E501
-                            model_override, stream, debug,
-                            execute_tools, n_turn) -> Tuple[Agent, None]:
+    def _tool_call_dispatcher(self, active_agent, context_variables,  # pylint: disable=too-many-arguments # noqa: E501
+                              stream, execute_tools, debug, dispatched):
         """
-        Process an interaction with the AI agent.
+        Return the on_tool_call_ready callback for a completion.
 
-        Args:
-            active_agent: The agent to interact with
-            history: List of previous messages
-            context_variables: Dictionary of context variables
-            model_override: Override the model specified in the agent
-            stream: Whether to stream the response
-            debug: Debug level
-            execute_tools: Whether to execute tools
-            n_turn: Current turn number
-
-        Returns:
-            Agent or None: Returns a new agent if there's a handoff,
-                          or None if the turn is complete
+        When streaming, tools whose arguments are complete start
+        running before the rest of the completion arrives; they are
+        added to dispatched.
         """
-        # Special handling for CodeAgent
-        if isinstance(active_agent, CodeAgent):
-            return self.process_interaction_codeagent(
-                active_agent, history, context_variables, debug, n_turn)
-
-        # Regular agent processing (existing code)
-        # get completion with current history, agent
-        completion = self.get_chat_completion(
-            agent=active_agent,
-            history=history,
-            context_variables=context_variables,
-            model_override=model_override,
-            stream=stream,
-            debug=debug,
-        )
-
-        if completion is None:
+        if not (stream and execute_tools):
             return None
 
+        def on_tool_call_ready(tool_call):
+            self.dispatch_tool_call(
+                tool_call, self.agent_functions(active_agent),
+                context_variables, debug,
+                parallel=active_agent.parallel_tool_calls)
+            if tool_call.id in self._pending_tool_calls:
+                dispatched.append(tool_call)
+        return on_tool_call_ready
+
+    @staticmethod
+    def _dispatched_completion(agent, dispatched):
+        """
+        Completion standing for a stream that failed after some of its
+        tool calls were dispatched, so that they and their results are
+        recorded instead of being asked for (and run) again.
+        """
+        return litellm.ModelResponse(
+            model=agent.model,
+            choices=[litellm.Choices(
+                index=0,
+                finish_reason="tool_calls",
+                message=litellm.Message(
+                    role="assistant", content=None,
+                    tool_calls=[t.model_dump() for t in dispatched]),
+            )])
+
+    def _cancel_pending_tool_calls(self):
+        """Drop dispatched tool calls that no completion asked for;
+        those that have not started yet do not run."""
+        for _, future, _ in self._pending_tool_calls.values():
+            future.cancel()
+        self._pending_tool_calls = {}
+
+    def _accept_completion(self, active_agent, completion, history, debug):
+        """Append the message of a completion to history and return it."""
         message = completion.choices[0].message
 
         if active_agent.name == "Reasoner Agent":
@@ -976,61 +1787,58 @@ class CAI:  # pylint: disable=too-many-instance-attributes
             brief=self.brief)
 
         message.sender = active_agent.name
-        history.append(
-            json.loads(message.model_dump_json())
-        )  # to avoid OpenAI types (?)
+        history.append(MessageRecord.of(message))  # no OpenAI types
+        return message
+
+    def _end_interaction(self, active_agent, message, history, n_turn,  # pylint: disable=too-many-arguments # noqa: E501
+                         debug):
+        """Print a message without tool calls and register it."""
+        if not isinstance(active_agent, StateAgent):
+            cli_print_agent_messages(active_agent.name,
+                                     message.content,
+                                     n_turn,
+                                     active_agent.model,
+                                     debug,
+                                     interaction_input_tokens=self.interaction_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     interaction_output_tokens=self.interaction_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     interaction_reasoning_tokens=self.interaction_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     total_input_tokens=self.total_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     total_output_tokens=self.total_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     total_reasoning_tokens=self.total_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                                     interaction_cost=self.interaction_cost,  # noqa
+                                     total_cost=self.total_cost)
+        else:
+            cli_print_state(active_agent.name,
+                            message.content,
+                            n_turn,
+                            active_agent.model,
+                            debug,
+                            interaction_input_tokens=self.interaction_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            interaction_output_tokens=self.interaction_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            interaction_reasoning_tokens=self.interaction_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            total_input_tokens=self.total_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            total_output_tokens=self.total_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            total_reasoning_tokens=self.total_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
+                            interaction_cost=self.interaction_cost,
+                            total_cost=self.total_cost)
+        debug_print(debug, "Ending turn.", brief=self.brief)
 
-        if not message.tool_calls or not execute_tools:
-        
-            if not isinstance(active_agent, StateAgent):
-                cli_print_agent_messages(active_agent.name,
-                                         message.content,
-                                         n_turn,
-                                         active_agent.model,
-                                         debug,
-                                         interaction_input_tokens=self.interaction_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         interaction_output_tokens=self.interaction_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         interaction_reasoning_tokens=self.interaction_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         total_input_tokens=self.total_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         total_output_tokens=self.total_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         total_reasoning_tokens=self.total_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                         interaction_cost=self.interaction_cost,  # noqa
-                                         total_cost=self.total_cost)
-            else:
-                cli_print_state(active_agent.name,
-                                message.content,
-                                n_turn,
-                                active_agent.model,
-                                debug,
-                                interaction_input_tokens=self.interaction_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                interaction_output_tokens=self.interaction_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                interaction_reasoning_tokens=self.interaction_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                total_input_tokens=self.total_input_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                total_output_tokens=self.total_output_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                total_reasoning_tokens=self.total_reasoning_tokens,  # noqa: E501  # pylint: disable=line-too-long
-                                interaction_cost=self.interaction_cost,
-                                total_cost=self.total_cost)
-            debug_print(debug, "Ending turn.", brief=self.brief)
-
-            # Register in the graph
-            self._graph.add_to_graph(graph.Node(
-                name=active_agent.name,
-                agent=active_agent,
-                turn=n_turn,
-                message=message,
-                history=history
-            ))
-            return None  # returning None to indicate
-            # the turn is complete
-
-        # handle function calls, updating context_variables, and switching
-        # agents
-        partial_response = self.handle_tool_calls(
-            message.tool_calls, active_agent.functions,
-            context_variables, debug, active_agent, n_turn,
-            message=message.content
-        )
+        # Register in the graph
+        self._graph.add_to_graph(graph.Node(
+            name=active_agent.name,
+            agent=active_agent,
+            turn=n_turn,
+            message=message,
+            history=history
+        ))
+
+    def _apply_tool_results(self, active_agent, message, history,  # pylint: disable=too-many-arguments # noqa: E501
+                            context_variables, partial_response, n_turn):
+        """Fold the results of the tool calls of message into history.
 
+        Returns:
+            Agent: the agent handed off to, or active_agent
+        """
         history.extend(partial_response.messages)
 
         # Register in the graph
@@ -1048,6 +1856,80 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                 if partial_response.agent
                 else active_agent)
 
+    @exploit_logger.log_agent()
+    async def aprocess_interaction(self, active_agent, history, context_variables,  # pylint: disable=too-many-arguments # noqa: E501
+                                   model_override, stream, debug,
+                                   execute_tools, n_turn,
+                                   offload_tools=True) -> Tuple[Agent, None]:
+        """
+        Process an interaction with the AI agent.
+
+        Args:
+            active_agent: The agent to interact with
+            history: List of previous messages
+            context_variables: Dictionary of context variables
+            model_override: Override the model specified in the agent
+            stream: Whether to stream the response
+            debug: Debug level
+            execute_tools: Whether to execute tools
+            n_turn: Current turn number
+            offload_tools: Run synchronous tools (and CodeAgent
+                interactions) in worker threads instead of inline on
+                the event loop
+
+        Returns:
+            Agent or None: Returns a new agent if there's a handoff,
+                          or None if the turn is complete
+        """
+        if isinstance(active_agent, CodeAgent):
+            if offload_tools:
+                return await asyncio.to_thread(
+                    self.process_interaction_codeagent,
+                    active_agent, history, context_variables, debug,
+                    n_turn)
+            return self.process_interaction_codeagent(
+                active_agent, history, context_variables, debug, n_turn)
+
+        dispatched = []
+        try:
+            completion = await self.aget_chat_completion(
+                agent=active_agent,
+                history=history,
+                context_variables=context_variables,
+                model_override=model_override,
+                stream=stream,
+                debug=debug,
+                on_tool_call_ready=self._tool_call_dispatcher(
+                    active_agent, context_variables, stream,
+                    execute_tools, debug, dispatched),
+            )
+
+            if completion is None:
+                if not dispatched:
+                    return None
+                # the stream failed after these tool calls started
+                completion = self._dispatched_completion(
+                    active_agent, dispatched)
+
+            message = self._accept_completion(
+                active_agent, completion, history, debug)
+
+            if not message.tool_calls or not execute_tools:
+                self._end_interaction(
+                    active_agent, message, history, n_turn, debug)
+                return None
+
+            partial_response = await self.ahandle_tool_calls(
+                message.tool_calls, self.agent_functions(active_agent),
+                context_variables, debug, active_agent, n_turn,
+                message=message.content, offload_tools=offload_tools
+            )
+            return self._apply_tool_results(
+                active_agent, message, history, context_variables,
+                partial_response, n_turn)
+        finally:
+            self._cancel_pending_tool_calls()
+
     def _get_turn_name(self):  # pylint disable=inconsistent-return-statements
         """Get the turn name based on the source."""
         return (
@@ -1061,13 +1943,14 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         if (self.rec_training_data and 
             self.interaction_count > 0 and 
             self.interaction_count % self.INTERMEDIATE_LOG_INTERVAL == 0):
+            self.rec_training_data.flush()
             process_intermediate_metrics(
                 self.rec_training_data.filename,
                 self.session_id
             )
 
     @exploit_logger.log_response(_get_turn_name)
-    def run(  # pylint: disable=too-many-arguments,dangerous-default-value,too-many-locals,too-many-statements,too-many-branches # noqa: E501
+    async def arun(  # pylint: disable=too-many-arguments,dangerous-default-value,too-many-locals,too-many-statements,too-many-branches # noqa: E501
         self,
         agent: Agent,
         messages: List,
@@ -1078,6 +1961,7 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         max_turns: int = float("inf"),
         execute_tools: bool = True,
         brief: bool = False,
+        offload_tools: bool = True,
     ) -> Response:
         """
         Run the cai and return the final response along
@@ -1089,6 +1973,12 @@ class CAI:  # pylint: disable=too-many-instance-attributes
         - "turn": a single interaction with CAI
         - "interaction": a single interaction with the LLM, with
             its corresponding tool calls and responses.
+
+        Completions go through litellm.acompletion, so several
+        sessions can share one event loop and its connection pool.
+        With offload_tools, synchronous tools run in worker threads
+        and never block the loop; run() disables it to keep tools on
+        the calling thread.
         """
         # No need to initialize timer here since ya se hizo en __init__
         start_time = time.time()
@@ -1121,7 +2011,10 @@ class CAI:  # pylint: disable=too-many-instance-attributes
 
         active_agent = agent
         context_variables = copy.deepcopy(context_variables)
-        history = copy.deepcopy(messages)
+        # Messages are immutable records, so the turn works on a fork
+        # of the caller's messages instead of a deep copy
+        history = (messages.fork() if isinstance(messages, ConversationLog)
+                   else ConversationLog(messages))
         n_turn = 0
 
         start_active_time()
@@ -1134,13 +2027,13 @@ class CAI:  # pylint: disable=too-many-instance-attributes
             # Check if we should upload intermediate logs
             self.upload_intermediate_logs(debug)
 
-            # "agent_interaction" wraps the process_interaction method
+            # "agent_interaction" wraps the aprocess_interaction method
             # so that different agents can be invoked in a
             # simplified manner.
             #
             # NOTE: Needs to be inside while loop to avoid using
             # the same function for all iterations
-            def agent_interaction(
+            async def agent_interaction(
                 agent,
                 model_override=model_override,
                 stream=stream,
@@ -1148,7 +2041,7 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                 execute_tools=execute_tools,
                 n_turn=n_turn
             ) -> Tuple[Agent, None]:
-                result = self.process_interaction(
+                result = await self.aprocess_interaction(
                     agent,
                     history,
                     context_variables,
@@ -1156,7 +2049,8 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                     stream,
                     debug,
                     execute_tools,
-                    n_turn
+                    n_turn,
+                    offload_tools=offload_tools
                 )
                 return result
 
@@ -1172,20 +2066,20 @@ class CAI:  # pylint: disable=too-many-instance-attributes
 
                     prev_agent = active_agent
                     active_agent = self.episodic_builder
-                    agent_interaction(active_agent)
+                    await agent_interaction(active_agent)
                     active_agent = prev_agent
 
                 # --------------------------------
                 # Standard agent iteration
                 # --------------------------------
-                active_agent = agent_interaction(active_agent)
+                active_agent = await agent_interaction(active_agent)
 
                 if (self.semantic_rag and
                         (n_turn != 0 and n_turn % self.rag_interval == 0)
                         and self.rag_online):
                     prev_agent = active_agent
                     active_agent = self.semantic_builder
-                    agent_interaction(active_agent)
+                    await agent_interaction(active_agent)
                     active_agent = prev_agent
 
                 # --------------------------------
@@ -1199,7 +2093,7 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                             >= self.STATE_INTERACTIONS_INTERVAL):
                         prev_agent = active_agent
                         active_agent = transfer_to_state_agent()
-                        agent_interaction(active_agent)
+                        await agent_interaction(active_agent)
                         active_agent = prev_agent
                         self.state_interactions_count = 0
 
@@ -1220,7 +2114,7 @@ class CAI:  # pylint: disable=too-many-instance-attributes
                         name="Reasoner Agent",
                         model=os.getenv("CAI_SUPPORT_MODEL")
                     )
-                    agent_interaction(
+                    await agent_interaction(
                         active_agent,
                         model_override=active_agent.model
                     )
@@ -1230,6 +2124,13 @@ class CAI:  # pylint: disable=too-many-instance-attributes
             except KeyboardInterrupt:
                 print("\nCtrl+C pressed")
                 break
+            except asyncio.CancelledError as e:
+                # Ctrl+C while run() waits on the event loop
+                if e.args != (_SYNC_INTERRUPT,):
+                    raise
+                asyncio.current_task().uncancel()
+                print("\nCtrl+C pressed")
+                break
 
             # Check if the flag is found in the last tool output
             # Accountability
@@ -1273,3 +2174,36 @@ class CAI:  # pylint: disable=too-many-instance-attributes
             context_variables=context_variables,
             time=execution_time
         )
+
+    def run(  # pylint: disable=too-many-arguments,dangerous-default-value # noqa: E501
+        self,
+        agent: Agent,
+        messages: List,
+        context_variables: dict = {},
+        model_override: str = None,
+        stream: bool = False,
+        debug: int = 0,
+        max_turns: int = float("inf"),
+        execute_tools: bool = True,
+        brief: bool = False,
+    ) -> Response:
+        """
+        Run the cai and return the final response along
+        with execution time in seconds.
+
+        Synchronous wrapper around arun(). Tools run on the calling
+        thread, as they always have, so Ctrl+C interrupts them the
+        same way.
+        """
+        return _run_sync(self.arun(
+            agent,
+            messages,
+            context_variables=context_variables,
+            model_override=model_override,
+            stream=stream,
+            debug=debug,
+            max_turns=max_turns,
+            execute_tools=execute_tools,
+            brief=brief,
+            offload_tools=False,
+        ))
@@ -1,8 +1,53 @@
 """
 Data recorder
+
+Logs are JSONL files with a request record (the completion params)
+followed by a completion record per LLM call. Two layouts exist:
+
+- v1: every request record holds all its messages and tools, so the
+  log grows quadratically with the length of the session.
+- v2 (default, CAI_LOG_FORMAT=2): a header record first, then each
+  distinct message and tool schema is written once as a "message" or
+  "tool" record keyed by a content hash, and request records list
+  the ids of their messages and tools. A request keeps the first
+  "prefix" messages of the previous request and appends the
+  "messages" ids it lists.
+
+Readers go through iter_jsonl_records, which yields v1 records for
+both layouts; convert_jsonl converts logs between them.
+
+Next to each log, <log>.idx holds one entry per record with its byte
+offset and length, type, message count, usage, cost and timing (see
+index_entry). load_history_from_jsonl seeks to and parses only the
+records it needs and get_token_stats reads only the index; both scan
+the log when the index is missing or stale (index_jsonl rebuilds it).
+
+Long sessions can rotate their log into segments, once the current
+segment reaches CAI_LOG_ROTATE_SIZE bytes (k/m/g suffixes allowed) or
+CAI_LOG_ROTATE_SECONDS seconds (both unset by default). Closed
+segments are compressed with CAI_LOG_COMPRESSION (zstd, the default
+if the zstandard package is installed, or gzip) into
+<log>.<n>.jsonl.zst/.gz and listed in order, with their size, usage
+and cost, in <log>.manifest.json; <log> itself holds the current
+segment. The last segment is compressed when the recorder is closed.
+The readers below take the path of the log (or of its manifest, or a
+single compressed file) and read all its segments as one log.
+
+Records are written by a background thread (see _LogWriter), so
+recording an interaction does not block the agent on serialization
+and disk I/O. Call DataRecorder.flush() before reading a live log.
 """
 
+import atexit
+import gzip
+import hashlib
+import io
+import ipaddress
 import os  # pylint: disable=import-error
+import queue
+import shutil
+import threading
+import time
 from datetime import datetime
 import json
 import socket
@@ -14,6 +59,514 @@ import pytz  # pylint: disable=import-error
 import uuid  # Add uuid import
 from cai.util import get_active_time, get_idle_time
 
+try:
+    import orjson  # pylint: disable=import-error
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard  # pylint: disable=import-error
+except ImportError:
+    zstandard = None
+
+LOG_FORMAT = "cai-jsonl"
+
+
+def _dump_line(record):
+    """Serialize a record as one JSONL line (bytes)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, default=str,
+                                option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:  # e.g. non-str keys, let json handle them
+            pass
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+def _content_id(value):
+    """Content hash used as the id of messages and tools in v2 logs."""
+    return hashlib.sha256(json.dumps(
+        value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class _DeltaEncoder:  # pylint: disable=too-few-public-methods
+    """Turns v1 request records into v2 records, see the module
+    docstring."""
+
+    def __init__(self):
+        self.started = False
+        self.messages = []  # messages of the previous request
+        self.message_ids = []
+        self.tools = None  # tools of the previous request
+        self.tool_ids = []
+        self.written = set()
+
+    def _define(self, kind, value, records):
+        record_id = _content_id(value)
+        if record_id not in self.written:
+            self.written.add(record_id)
+            records.append({"type": kind, "id": record_id, kind: value})
+        return record_id
+
+    def encode(self, request):
+        """
+        Returns:
+            list: the records to write for request, in order
+        """
+        records = []
+        if not self.started:
+            self.started = True
+            records.append({"type": "header", "format": LOG_FORMAT,
+                            "version": 2})
+        messages = request["messages"]
+        prefix = 0
+        for old, new in zip(self.messages, messages):
+            if old != new:
+                break
+            prefix += 1
+        new_ids = [self._define("message", msg, records)
+                   for msg in messages[prefix:]]
+        self.message_ids = self.message_ids[:prefix] + new_ids
+        self.messages = list(messages)
+
+        encoded = {"type": "request", "prefix": prefix,
+                   "messages": new_ids}
+        encoded.update((k, v) for k, v in request.items()
+                       if k not in ("messages", "tools"))
+        if "tools" in request:
+            if request["tools"] != self.tools:
+                self.tools = request["tools"]
+                self.tool_ids = [self._define("tool", tool, records)
+                                 for tool in self.tools]
+            encoded["tools"] = self.tool_ids
+        records.append(encoded)
+        return records
+
+
+INDEX_SUFFIX = ".idx"
+
+
+def index_entry(record, offset, length):
+    """
+    Entry of the sidecar index (<log>.idx) for a log record.
+
+    Index files are JSONL too, with one entry per log record: its byte
+    offset and length, its type and what the readers need without
+    parsing the record, i.e. the number of messages of requests and
+    the model, usage, cost and timing of completions.
+    """
+    entry = {"offset": offset, "length": length}
+    kind = record.get("type")
+    if kind in ("header", "message", "tool"):
+        entry["type"] = kind
+        if "id" in record:
+            entry["id"] = record["id"]
+        return entry
+    if "choices" in record:
+        entry["type"] = "completion"
+    elif isinstance(record.get("messages"), list):
+        entry["type"] = "request"
+        entry["messages"] = record.get("prefix", 0) + len(record["messages"])
+    else:
+        entry["type"] = "other"
+    if isinstance(record.get("usage"), dict):
+        entry["usage"] = [record["usage"].get("prompt_tokens") or 0,
+                          record["usage"].get("completion_tokens") or 0]
+    if isinstance(record.get("cost"), dict):
+        entry["cost"] = record["cost"].get("total_cost", 0.0)
+    elif "cost" in record:
+        entry["cost"] = float(record["cost"])
+    if isinstance(record.get("timing"), dict):
+        entry["timing"] = [record["timing"].get("active_seconds", 0.0),
+                           record["timing"].get("idle_seconds", 0.0)]
+    if "model" in record:
+        entry["model"] = record["model"]
+    return entry
+
+
+def _add_to_summary(summary, entry):
+    """Fold an index entry, or the summary of a segment, into the
+    usage, cost, timing and model of a summary."""
+    if "usage" in entry:
+        usage = summary.get("usage", [0, 0])
+        summary["usage"] = [usage[0] + entry["usage"][0],
+                            usage[1] + entry["usage"][1]]
+    for key in ("cost", "timing", "model"):
+        if key in entry:
+            summary[key] = entry[key]
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+COMPRESSIONS = {"zstd": ".zst", "gzip": ".gz"}
+ZSTD_LEVEL = 9
+
+
+def _parse_size(value):
+    """Bytes in a size such as "512k" or "64M" (0 if unset)."""
+    value = (value or "0").strip().lower()
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+def _log_path(file_path):
+    """Path of a log given the path of the log or of its manifest."""
+    file_path = os.fspath(file_path)
+    if file_path.endswith(MANIFEST_SUFFIX):
+        return file_path[:-len(MANIFEST_SUFFIX)]
+    return file_path
+
+
+def read_manifest(file_path):
+    """
+    Manifest of a segmented log (see the module docstring).
+
+    Returns:
+        dict or None: {"format", "compression", "segments": [{"file",
+            "records", "bytes", "stored", "opened", "closed", "usage",
+            "cost", "timing", "model"}, ...]}, None if the log was
+            never rotated
+    """
+    try:
+        with open(_log_path(file_path) + MANIFEST_SUFFIX,
+                  encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def log_files(file_path):
+    """Files holding the records of a log, in order: its closed
+    segments, then the current one (if any)."""
+    file_path = _log_path(file_path)
+    manifest = read_manifest(file_path)
+    if manifest is None:
+        return [file_path]
+    directory = os.path.dirname(file_path)
+    files = [os.path.join(directory, segment["file"])
+             for segment in manifest["segments"]]
+    if os.path.exists(file_path):
+        files.append(file_path)
+    return files
+
+
+def _open_text(path, mode="r"):
+    """Open a log file in text mode, compressed if path ends in .zst
+    or .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise OSError(f"{path} is zstd compressed, install the "
+                          "zstandard package to read it")
+        raw = open(path, mode + "b")  # pylint: disable=consider-using-with
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            stream = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL).stream_writer(raw)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _compress(src, dst, compression):
+    """Compress src into dst (atomically) and remove src."""
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        if compression == "zstd":
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(fin, fout)
+        else:
+            with gzip.GzipFile(fileobj=fout, mode="wb",
+                               filename=os.path.basename(src)) as gz:
+                shutil.copyfileobj(fin, gz)
+    os.replace(tmp, dst)
+    os.remove(src)
+
+
+class _LogWriter:
+    """
+    Background writer of the records of one log file.
+
+    Records are queued by write() and written in batches by a daemon
+    thread that keeps the file open, together with the sidecar index
+    of the file (see index_entry). The files are flushed every
+    FLUSH_INTERVAL seconds, on flush() and on close(), which also
+    runs at exit. The queue is bounded: if the thread falls behind,
+    write() blocks instead of dropping records.
+
+    If rotate_size or rotate_seconds is set, the thread also closes
+    the current segment of the log once it is that large or old,
+    compresses it and lists it in the manifest of the log.
+    """
+
+    FLUSH_INTERVAL = 1.0  # seconds
+    QUEUE_SIZE = 1024
+
+    def __init__(self, filename, encode=None,  # pylint: disable=too-many-arguments  # noqa: E501
+                 rotate_size=0, rotate_seconds=0, compression="gzip"):
+        self.filename = filename
+        # callable: queued record -> list of records to write
+        self.encode = encode
+        self.rotate_size = rotate_size
+        self.rotate_seconds = rotate_seconds
+        self.compression = compression
+        # records, size, start time and summary of the current segment
+        self._segment = None
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.error = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="cai-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def write(self, *records):
+        """Queue records for writing."""
+        if self._closed:
+            raise ValueError(f"log writer of {self.filename} is closed")
+        if self._thread is None:
+            self._start()
+        self._queue.put(("records", records))
+
+    def flush(self, timeout=None):
+        """Write and flush everything queued so far."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flush and stop the thread; further writes raise."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(("close", None))
+            self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def _open(self):
+        """Open the current segment and its index, or (None, None)."""
+        try:
+            f = open(self.filename, "ab")  # pylint: disable=consider-using-with
+            index = open(self.filename + INDEX_SUFFIX, "ab")  # pylint: disable=consider-using-with  # noqa: E501
+        except OSError as e:
+            # keep consuming the queue so that writers never block
+            self.error = e
+            print(f"Error opening log {self.filename}: {e}")
+            return None, None
+        self._segment = {"records": 0, "opened": time.time(), "summary": {}}
+        return f, index
+
+    def _should_rotate(self, f):
+        if self._segment is None or not self._segment["records"]:
+            return False
+        return bool(
+            (self.rotate_size and f.tell() >= self.rotate_size) or
+            (self.rotate_seconds and
+             time.time() - self._segment["opened"] >= self.rotate_seconds))
+
+    def _rotate(self, f, index):
+        """Close the current segment, compress it and add it to the
+        manifest."""
+        f.close()
+        index.close()
+        manifest = read_manifest(self.filename) or {
+            "format": LOG_FORMAT, "compression": self.compression,
+            "segments": []}
+        base = (self.filename[:-len(".jsonl")]
+                if self.filename.endswith(".jsonl") else self.filename)
+        segment_file = (f"{base}.{len(manifest['segments']) + 1:05d}.jsonl"
+                        f"{COMPRESSIONS[self.compression]}")
+        try:
+            size = os.path.getsize(self.filename)
+            _compress(self.filename, segment_file, self.compression)
+            manifest["segments"].append({
+                "file": os.path.basename(segment_file),
+                "records": self._segment["records"],
+                "bytes": size,
+                "stored": os.path.getsize(segment_file),
+                "opened": self._segment["opened"],
+                "closed": time.time(),
+                **self._segment["summary"]})
+            tmp = f"{self.filename}{MANIFEST_SUFFIX}.tmp"
+            with open(tmp, "w", encoding="utf-8") as out:
+                json.dump(manifest, out, indent=1)
+            os.replace(tmp, self.filename + MANIFEST_SUFFIX)
+            os.remove(self.filename + INDEX_SUFFIX)
+        except OSError as e:
+            # the segment stays uncompressed, appended to
+            self.error = e
+            print(f"Error rotating log {self.filename}: {e}")
+
+    def _run(self):  # pylint: disable=too-many-branches
+        f, index = self._open()
+        rotated = False  # the next segment is opened with its records
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+            items = [item] if item else []
+            while True:  # batch whatever else is queued
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            waiters = []
+            for kind, payload in items:
+                if kind == "records":
+                    for record in payload:
+                        if rotated:
+                            f, index = self._open()
+                            rotated = False
+                        if f is None:
+                            continue
+                        self._write_records(f, index, (record,))
+                        if self._should_rotate(f):
+                            self._rotate(f, index)
+                            f, index, rotated = None, None, True
+                elif kind == "flush":
+                    waiters.append(payload)
+                else:
+                    stop = True
+            now = time.monotonic()
+            if f is not None and (waiters or stop or
+                                  now - last_flush >= self.FLUSH_INTERVAL):
+                f.flush()
+                index.flush()
+                last_flush = now
+            if f is not None and (
+                    self._should_rotate(f) or
+                    (stop and self._segment["records"] and
+                     (self.rotate_size or self.rotate_seconds))):
+                self._rotate(f, index)
+                f, index, rotated = None, None, True
+            for done in waiters:
+                done.set()
+            if stop:
+                if f is not None:
+                    f.close()
+                    index.close()
+                return
+
+    def _write_records(self, f, index, payload):
+        try:
+            for record in payload:
+                for out in (self.encode(record) if self.encode
+                            else [record]):
+                    line = _dump_line(out)
+                    entry = index_entry(out, f.tell(), len(line))
+                    f.write(line)
+                    index.write(_dump_line(entry))
+                    self._segment["records"] += 1
+                    _add_to_summary(self._segment["summary"], entry)
+        except Exception as e:  # pylint: disable=broad-except
+            # keep the thread alive for the next records
+            self.error = e
+            print(f"Error writing log {self.filename}: {e}")
+
+
+_PUBLIC_IP = {"value": None, "expires": 0.0, "lookup": None, "loaded": False}
+# Seconds before retrying a failed lookup
+PUBLIC_IP_RETRY = 300
+_PUBLIC_IP_LOCK = threading.Lock()
+PUBLIC_IP_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "cai",
+                               "public_ip.json")
+
+
+def _lookup_public_ip():
+    """Ask a public service for the IP of this host, or None."""
+    # Check internet connection and get public IP
+    try:
+        # Quick connection check with minimal traffic
+        socket.create_connection(("1.1.1.1", 53), timeout=1).close()
+    except (OSError, socket.timeout, socket.gaierror):
+        # No internet connection
+        return None
+    for service in ("https://api.ipify.org", "https://ifconfig.me"):
+        try:
+            with urllib.request.urlopen(service, timeout=2) as response:  # nosec: B310  # noqa: E501
+                return str(ipaddress.ip_address(
+                    response.read().decode('utf-8').strip()))
+        except (URLError, socket.timeout, ValueError, OSError):
+            # Fallback to the next service
+            continue
+    return None
+
+
+def _refresh_public_ip(ttl):
+    ip_addr = _lookup_public_ip()
+    with _PUBLIC_IP_LOCK:
+        _PUBLIC_IP["lookup"] = None
+        if ip_addr is None:
+            _PUBLIC_IP["expires"] = time.time() + min(ttl, PUBLIC_IP_RETRY)
+            return
+        _PUBLIC_IP["value"] = ip_addr
+        _PUBLIC_IP["expires"] = time.time() + ttl
+    try:
+        try:
+            with open(PUBLIC_IP_CACHE, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[socket.gethostname()] = {"ip": ip_addr, "time": time.time()}
+        os.makedirs(os.path.dirname(PUBLIC_IP_CACHE), exist_ok=True)
+        with open(PUBLIC_IP_CACHE, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+
+def public_ip():
+    """
+    Public IP of this host for log names, without waiting on the
+    network.
+
+    The IP is cached per host in ~/.cache/cai/public_ip.json for
+    CAI_PUBLIC_IP_TTL seconds (default 86400). When it is unknown or
+    stale, a background lookup is started and the cached value, or
+    127.0.0.1, is returned meanwhile. CAI_PUBLIC_IP=false disables
+    the lookup and any other value than "auto" (the default) is used
+    as the IP.
+
+    Returns:
+        str: the IP address
+    """
+    setting = os.getenv("CAI_PUBLIC_IP", "auto").strip()
+    if setting.lower() in ("false", "off", "none", "0"):
+        return "127.0.0.1"
+    if setting.lower() != "auto":
+        return setting
+    ttl = float(os.getenv("CAI_PUBLIC_IP_TTL", "86400"))
+    now = time.time()
+    with _PUBLIC_IP_LOCK:
+        if not _PUBLIC_IP["loaded"]:
+            _PUBLIC_IP["loaded"] = True
+            try:
+                with open(PUBLIC_IP_CACHE, encoding="utf-8") as f:
+                    cached = json.load(f)[socket.gethostname()]
+                _PUBLIC_IP["value"] = str(ipaddress.ip_address(cached["ip"]))
+                _PUBLIC_IP["expires"] = cached["time"] + ttl
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if now >= _PUBLIC_IP["expires"] and _PUBLIC_IP["lookup"] is None:
+            _PUBLIC_IP["lookup"] = threading.Thread(
+                target=_refresh_public_ip, args=(ttl,),
+                name="cai-public-ip", daemon=True)
+            _PUBLIC_IP["lookup"].start()
+        return _PUBLIC_IP["value"] or "127.0.0.1"
+
 
 class DataRecorder:  # pylint: disable=too-few-public-methods
     """
@@ -33,6 +586,18 @@ class DataRecorder:  # pylint: disable=too-few-public-methods
         """
         # Generate a session ID that will be used for the entire session
         self.session_id = str(uuid.uuid4())
+        # Log layout, see the module docstring
+        self.log_format = int(os.getenv("CAI_LOG_FORMAT", "2"))
+        self._encoder = _DeltaEncoder()
+        # Segment rotation, see the module docstring
+        self.rotate_size = _parse_size(os.getenv("CAI_LOG_ROTATE_SIZE"))
+        self.rotate_seconds = float(
+            os.getenv("CAI_LOG_ROTATE_SECONDS") or 0)
+        self.compression = os.getenv(
+            "CAI_LOG_COMPRESSION", "zstd" if zstandard else "gzip").lower()
+        if self.compression not in COMPRESSIONS or (
+                self.compression == "zstd" and zstandard is None):
+            self.compression = "gzip"
         
         log_dir = 'logs'
         os.makedirs(log_dir, exist_ok=True)
@@ -51,50 +616,36 @@ class DataRecorder:  # pylint: disable=too-few-public-methods
         except Exception:  # pylint: disable=broad-except
             os_info = "unknown_os"
 
-        # Check internet connection and get public IP
-        public_ip = "127.0.0.1"
-        try:
-            # Quick connection check with minimal traffic
-            socket.create_connection(("1.1.1.1", 53), timeout=1)
-
-            # If connected, try to get public IP
-            try:
-                # Using a simple and lightweight service
-                with urllib.request.urlopen(  # nosec: B310
-                    "https://api.ipify.org",
-                    timeout=2
-                ) as response:
-                    public_ip = response.read().decode('utf-8')
-            except (URLError, socket.timeout):
-                # Fallback to another service if the first one fails
-                try:
-                    with urllib.request.urlopen(  # nosec: B310
-                        "https://ifconfig.me",
-                        timeout=2
-                    ) as response:
-                        public_ip = response.read().decode('utf-8')
-                except (URLError, socket.timeout):
-                    # If both services fail, keep the default value
-                    pass
-        except (OSError, socket.timeout, socket.gaierror):
-            # No internet connection, keep the default value
-            pass
-
-        # Create filename with username, OS info, and IP
+        # Create filename with username, OS info, and IP. The public IP
+        # is looked up in the background (see public_ip), so the name
+        # is only settled when the log is first used
         timestamp = datetime.now().astimezone(
             pytz.timezone("Europe/Madrid")).strftime("%Y%m%d_%H%M%S")
-        base_filename = f'cai_{self.session_id}_{timestamp}_{username}_{os_info}_{public_ip.replace(".", "_")}.jsonl'
-
-        if workspace_name:
-            self.filename = os.path.join(
-                log_dir, f'{workspace_name}_{base_filename}'
-            )
-        else:
-            self.filename = os.path.join(log_dir, base_filename)
+        self._name_prefix = os.path.join(
+            log_dir,
+            (f'{workspace_name}_' if workspace_name else '') +
+            f'cai_{self.session_id}_{timestamp}_{username}_{os_info}')
+        self._filename = None
+        self._writer = None
+        public_ip()  # start the lookup
 
         # Inicializar el coste total acumulado
         self.total_cost = 0.0
 
+    @property
+    def filename(self):
+        """Path of the log file, fixed on first use."""
+        if self._filename is None:
+            ip_addr = public_ip()
+            self._filename = f'{self._name_prefix}_{ip_addr.replace(".", "_")}.jsonl'  # noqa: E501  # pylint: disable=line-too-long
+        return self._filename
+
+    def _encode(self, record):
+        """Records to write for record, run by the writer thread."""
+        if self.log_format >= 2 and "choices" not in record:
+            return self._encoder.encode(record)
+        return [record]
+
     def rec_training_data(self, create_params, msg, total_cost=None) -> None:
         """
         Records a single training data entry to the JSONL file
@@ -106,7 +657,8 @@ class DataRecorder:  # pylint: disable=too-few-public-methods
         """
         request_data = {
             "model": create_params["model"],
-            "messages": create_params["messages"],
+            # the writer serializes it later, the list may change
+            "messages": list(create_params["messages"]),
             "stream": create_params["stream"]
         }
         if "tools" in create_params:
@@ -187,12 +739,215 @@ class DataRecorder:  # pylint: disable=too-few-public-methods
                 pytz.timezone("Europe/Madrid")).isoformat()
         }
 
-        # Append both request and completion to the instance's jsonl file
-        with open(self.filename, 'a', encoding='utf-8') as f:
-            json.dump(request_data, f)
-            f.write('\n')
-            json.dump(completion_data, f)
-            f.write('\n')
+        # Append both request and completion to the instance's jsonl
+        # file, from the writer thread
+        if self._writer is None:
+            self._writer = _LogWriter(
+                self.filename, encode=self._encode,
+                rotate_size=self.rotate_size,
+                rotate_seconds=self.rotate_seconds,
+                compression=self.compression)
+        self._writer.write(request_data, completion_data)
+
+    def flush(self):
+        """Write all the recorded interactions to the log file."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Flush the log file and stop its writer thread."""
+        if self._writer is not None:
+            self._writer.close()
+
+
+def iter_jsonl_records(file_path):
+    """
+    Read the records of a JSONL log of either layout.
+
+    v2 logs are decoded as they are read: message and tool records
+    are resolved and request records are yielded with their full
+    messages and tools, as in v1 logs.
+
+    Segmented logs are read segment by segment, as one log.
+
+    Args:
+        file_path (str): Path to the JSONL file
+
+    Yields:
+        dict: request and completion records, in v1 layout
+    """
+    messages = {}
+    tools = {}
+    message_ids = []
+    for line in _iter_lines(file_path):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except Exception:  # pylint: disable=broad-except
+            print(f"Error loading line: {line}")
+            continue
+        kind = record.get("type") if isinstance(record, dict) else None
+        if kind == "header":
+            continue
+        if kind == "message":
+            messages[record["id"]] = record["message"]
+            continue
+        if kind == "tool":
+            tools[record["id"]] = record["tool"]
+            continue
+        if kind == "request":
+            message_ids = (message_ids[:record["prefix"]] +
+                           record["messages"])
+            request = {k: v for k, v in record.items()
+                       if k not in ("type", "prefix")}
+            request["messages"] = [messages[i] for i in message_ids]
+            if "tools" in record:
+                request["tools"] = [tools[i] for i in record["tools"]]
+            yield request
+            continue
+        yield record
+
+
+def _iter_lines(file_path):
+    """Lines of all the segments of a log."""
+    for path in log_files(file_path):
+        with _open_text(path) as file:
+            yield from file
+
+
+def convert_jsonl(src, dst, version=2):
+    """
+    Convert a JSONL log to the given layout version (1 or 2), and
+    index the result. dst is compressed if it ends in .zst or .gz.
+
+    Returns:
+        int: number of requests converted
+    """
+    encoder = _DeltaEncoder()
+    requests = 0
+    dst = os.fspath(dst)
+    with _open_text(dst, 'w') as f:
+        for record in iter_jsonl_records(src):
+            is_request = (isinstance(record, dict) and "choices" not in record
+                          and isinstance(record.get("messages"), list))
+            if is_request:
+                requests += 1
+            records = (encoder.encode(record) if is_request and version >= 2
+                       else [record])
+            for out in records:
+                json.dump(out, f)
+                f.write('\n')
+    if not dst.endswith(tuple(COMPRESSIONS.values())):
+        index_jsonl(dst)
+    return requests
+
+
+def index_jsonl(file_path):
+    """
+    Write the sidecar index of an existing log (e.g. one recorded
+    before indexes existed, or converted with convert_jsonl).
+
+    Returns:
+        int: number of records indexed
+    """
+    count = 0
+    file_path = _log_path(file_path)
+    if file_path.endswith(tuple(COMPRESSIONS.values())):
+        raise ValueError(f"{file_path} is compressed, offsets into it "
+                         "cannot be indexed")
+    with open(file_path, "rb") as f, \
+            open(file_path + INDEX_SUFFIX, "wb") as index:
+        offset = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                index.write(_dump_line(index_entry(record, offset,
+                                                   len(line))))
+            else:  # blank or broken lines are indexed but skipped
+                index.write(_dump_line({"offset": offset,
+                                        "length": len(line),
+                                        "type": "other"}))
+            offset += len(line)
+            count += 1
+    return count
+
+
+def read_jsonl_index(file_path):
+    """
+    Entries of the sidecar index of a log (see index_entry).
+
+    Returns:
+        list or None: None if there is no index or it does not cover
+            the whole log (e.g. the log was appended to without it),
+            in which case readers scan the log itself
+    """
+    file_path = _log_path(file_path)
+    if file_path.endswith(tuple(COMPRESSIONS.values())):
+        return None
+    try:
+        with open(file_path + INDEX_SUFFIX, "rb") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        size = os.path.getsize(file_path)
+    except (OSError, ValueError):
+        return None
+    end = entries[-1]["offset"] + entries[-1]["length"] if entries else 0
+    return entries if end == size else None
+
+
+def _index_summary(file_path):
+    """Usage, cost, timing and model of a log from its manifest and
+    index, or None if the log must be scanned."""
+    file_path = _log_path(file_path)
+    manifest = read_manifest(file_path)
+    summary = {}
+    for segment in manifest["segments"] if manifest else []:
+        _add_to_summary(summary, segment)
+    if manifest is None or os.path.exists(file_path):
+        entries = read_jsonl_index(file_path)
+        if entries is None:
+            return None
+        for entry in entries:
+            _add_to_summary(summary, entry)
+    return summary
+
+
+def _read_records(f, entries):
+    records = []
+    for entry in entries:
+        f.seek(entry["offset"])
+        records.append(json.loads(f.read(entry["length"])))
+    return records
+
+
+def _load_history_from_index(file_path, entries):
+    requests = [e for e in entries if e["type"] == "request"]
+    if not requests:
+        return []
+    # the first request with the most messages, like the full scan
+    target = max(range(len(requests)),
+                 key=lambda i: (requests[i]["messages"], -i))
+    if requests[target]["messages"] == 0:
+        return []
+    with open(_log_path(file_path), "rb") as f:
+        if not any(e["type"] == "header" for e in entries[:1]):  # v1
+            return _read_records(f, [requests[target]])[0]["messages"]
+        # v2: follow the (small) request records up to the target and
+        # read only the message records it refers to
+        message_ids = []
+        for record in _read_records(f, requests[:target + 1]):
+            message_ids = (message_ids[:record["prefix"]] +
+                           record["messages"])
+        message_entries = {e["id"]: e for e in entries
+                           if e["type"] == "message"}
+        messages = {record["id"]: record["message"]
+                    for record in _read_records(
+                        f, [message_entries[i] for i in set(message_ids)])}
+        return [messages[i] for i in message_ids]
 
 
 def load_history_from_jsonl(file_path):
@@ -200,6 +955,10 @@ def load_history_from_jsonl(file_path):
     Load conversation history from a JSONL file and
     return it as a list of messages.
 
+    Uses the sidecar index of the log when there is one (and the log
+    is not segmented), so that only the records of the longest history
+    are parsed.
+
     Args:
         file_path (str): The path to the JSONL file.
             NOTE: file_path assumes it's either relative to the
@@ -208,24 +967,22 @@ def load_history_from_jsonl(file_path):
     Returns:
         list: A list of messages extracted from the JSONL file.
     """
+    entries = (read_jsonl_index(file_path)
+               if read_manifest(file_path) is None else None)
+    if entries is not None:
+        try:
+            return _load_history_from_index(file_path, entries)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading the index of {file_path}: {e}")
     history = []
     max_length = 0
-    with open(file_path, encoding='utf-8') as file:
-        for line in file:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                record = json.loads(line)
-            except Exception:  # pylint: disable=broad-except
-                print(f"Error loading line: {line}")
-                continue
-            if isinstance(record, dict) and "messages" \
-                in record and isinstance(
-                    record["messages"], list):
-                if len(record["messages"]) > max_length:
-                    max_length = len(record["messages"])
-                    history = record["messages"]
+    for record in iter_jsonl_records(file_path):
+        if isinstance(record, dict) and "messages" \
+            in record and isinstance(
+                record["messages"], list):
+            if len(record["messages"]) > max_length:
+                max_length = len(record["messages"])
+                history = record["messages"]
     return history
 
 
@@ -233,6 +990,9 @@ def get_token_stats(file_path):
     """
     Get token usage statistics from a JSONL file.
 
+    Only the sidecar index of the log (and the manifest of segmented
+    logs) is read when there is one.
+
     Args:
         file_path (str): Path to the JSONL file
 
@@ -248,36 +1008,38 @@ def get_token_stats(file_path):
     last_active_time = 0.0
     last_idle_time = 0.0
 
-    with open(file_path, encoding='utf-8') as file:
-        for line in file:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                record = json.loads(line)
-                if "usage" in record:
-                    total_prompt_tokens += record["usage"]["prompt_tokens"]
-                    total_completion_tokens += (
-                        record["usage"]["completion_tokens"]
-                    )
-                if "cost" in record:
-                    if isinstance(record["cost"], dict):
-                        # Si cost es un diccionario, obtener total_cost
-                        last_total_cost = record["cost"].get("total_cost", 0.0)
-                    else:
-                        # Si cost es un valor directo
-                        last_total_cost = float(record["cost"])
-                if "timing" in record:
-                    if isinstance(record["timing"], dict):
-                        last_active_time = record["timing"].get(
-                            "active_seconds", 0.0)
-                        last_idle_time = record["timing"].get(
-                            "idle_seconds", 0.0)
-                if "model" in record:
-                    model_name = record["model"]
-            except Exception as e:  # pylint: disable=broad-except
-                print(f"Error loading line: {line}: {e}")
-                continue
+    summary = _index_summary(file_path)
+    if summary is not None:
+        usage = summary.get("usage", [0, 0])
+        timing = summary.get("timing", [0.0, 0.0])
+        return (summary.get("model"), usage[0], usage[1],
+                summary.get("cost", 0.0), timing[0], timing[1])
+
+    for record in iter_jsonl_records(file_path):
+        try:
+            if "usage" in record:
+                total_prompt_tokens += record["usage"]["prompt_tokens"]
+                total_completion_tokens += (
+                    record["usage"]["completion_tokens"]
+                )
+            if "cost" in record:
+                if isinstance(record["cost"], dict):
+                    # Si cost es un diccionario, obtener total_cost
+                    last_total_cost = record["cost"].get("total_cost", 0.0)
+                else:
+                    # Si cost es un valor directo
+                    last_total_cost = float(record["cost"])
+            if "timing" in record:
+                if isinstance(record["timing"], dict):
+                    last_active_time = record["timing"].get(
+                        "active_seconds", 0.0)
+                    last_idle_time = record["timing"].get(
+                        "idle_seconds", 0.0)
+            if "model" in record:
+                model_name = record["model"]
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error loading record: {record}: {e}")
+            continue
 
     # Usar el último total_cost encontrado como el total
     total_cost = last_total_cost
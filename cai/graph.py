@@ -4,18 +4,24 @@ This module contains the graph class for the CAI library.
 This is a graph that stores the Agent and its history
 at each step and allows reflecting on both, the reasoning
 and the execution approach.
+
+Histories are not copied into each node: the graph keeps one
+append-only log of messages and each node references its history as
+ranges of that log (see HistoryView), so consecutive nodes share the
+messages they have in common.
 """
 # Standard library imports
+import bisect
+import itertools
 import json
 import logging
+from collections.abc import Sequence
 from typing import List  # pylint: disable=import-error
 
 # Third party imports
 from litellm.types.utils import Message  # pylint: disable=import-error
 import networkx as nx  # pylint: disable=import-error
-from pydantic import BaseModel  # pylint: disable=import-error
-import requests  # pylint: disable=import-error
-import urllib3  # pylint: disable=import-error
+from pydantic import BaseModel, PrivateAttr  # pylint: disable=import-error
 
 # Local imports
 from cai.state.pydantic import state_agent
@@ -25,21 +31,100 @@ from .types import (
 )
 
 
+class HistoryView(Sequence):
+    """
+    Read-only history of a node: ranges (start, end) of the shared
+    message log of a graph, read as one list when indexed.
+    """
+
+    def __init__(self, log, ranges=(), length=0):
+        self._log = log
+        self.ranges = tuple(ranges)
+        self._length = length
+        # history index at which each range starts
+        self._starts = list(itertools.accumulate(
+            (end - start for start, end in self.ranges[:-1]), initial=0))
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("history index out of range")
+        i = bisect.bisect_right(self._starts, index) - 1
+        return self._log[self.ranges[i][0] + index - self._starts[i]]
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            yield from itertools.islice(self._log, start, end)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Sequence, HistoryView)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def truncated(self, length):
+        """Ranges of the first length messages."""
+        ranges = []
+        for (start, end), offset in zip(self.ranges, self._starts):
+            if offset >= length:
+                break
+            ranges.append((start, min(end, start + length - offset)))
+        return ranges
+
+
+_NODE_IDS = itertools.count()
+
+
 class Node(BaseModel):  # pylint: disable=too-few-public-methods
     """
     Represents a node in the graph.
+
+    history (a list of messages) is read when the node is added to a
+    graph, which then keeps it in its shared message log; only the
+    first history_length messages are used, if given. node.history
+    reads it back from the log.
     """
     name: str = "Node"
     agent: Agent = None
     turn: int = 0
     message: Message = None
-    history: List = []
     strout: str = None
+    # cached id used to hash the node, unique per process
+    _id: int = PrivateAttr(default_factory=lambda: next(_NODE_IDS))
+    # (messages, length) until the node is added to a graph
+    _pending: tuple = PrivateAttr(default=None)
+    _history: HistoryView = PrivateAttr(default=None)
+
+    def __init__(self, history=None, history_length=None, **data):
+        super().__init__(**data)
+        if history is not None:
+            self._pending = (history, len(history) if history_length is None
+                             else history_length)
+
+    @property
+    def history(self):
+        """Messages of the conversation up to this node."""
+        if self._history is not None:
+            return self._history
+        if self._pending is not None:
+            history, length = self._pending
+            return list(history[:length])
+        return []
 
     def __hash__(self):
-        # Convert history list to tuple for hashing
-        history_tuple = tuple(str(h) for h in self.history)
-        return hash((self.name, self.agent.name, self.turn, history_tuple))
+        return hash(self._id)
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self._id == other._id
 
     def __str__(self):
         """
@@ -96,6 +181,23 @@ class Node(BaseModel):  # pylint: disable=too-few-public-methods
             return f"{self.name}\n\n{self.strout}"
 
 
+def _same(message, other):
+    return message is other or message == other
+
+
+def _action_label(action):
+    """Readable label of a list of tool calls."""
+    action_labels = []
+    for tool_call in action:
+        try:
+            args_dict = json.loads(tool_call.function.arguments)
+            args_str = ", ".join(f"{k}={v}" for k, v in args_dict.items())
+        except (TypeError, ValueError, AttributeError):
+            args_str = str(tool_call.function.arguments)
+        action_labels.append(f"{tool_call.function.name}({args_str})")
+    return "\n".join(action_labels)
+
+
 class Graph(nx.DiGraph):
     """
     A graph storing every discrete step in the exploitation flow.
@@ -108,10 +210,15 @@ class Graph(nx.DiGraph):
 
     def __init__(self):
         super().__init__()
-        self._name_op_map = {}
+        self._name_op_map = {}  # node name -> node
+        self._name_counters = {}  # base name -> last suffix used
         self._trainable_variables_collection = {}
         self.reward = 0  # Initialize reward attribute
         self.previous_node = None
+        self._ascii_renderer = None
+        # messages of the histories of all nodes, see HistoryView
+        self._history_log = []
+        self._history_tip = HistoryView(self._history_log)
 
         # state, NOTE: each agent is stateless, and so is the default CAI
         # instance
@@ -159,17 +266,62 @@ class Graph(nx.DiGraph):
         NOTE: it does not set the name of the node,
         it just returns a unique name
         """
-        original_name = node.name
-        unique_name = original_name
-        index = 0
-        while unique_name in self._name_op_map.keys():  # pylint: disable=consider-iterating-dictionary # noqa
+        return self._unique_name(node.name)[0]
+        #
+        # return node.name  # NOTE: avoid re-naming the node
+
+    def _unique_name(self, name):
+        """(unique name, base name, suffix) for name; suffixes continue
+        from the last one used for the base name."""
+        if name not in self._name_op_map:
+            return name, None, None
+        base_name = name.split("_")[0]
+        index = self._name_counters.get(base_name, 0) + 1
+        while f"{base_name}_{index}" in self._name_op_map:
             index += 1
-            base_name = unique_name.split("_")[0]
-            unique_name = f"{base_name}_{index}"
-        return unique_name
+        return f"{base_name}_{index}", base_name, index
         #
         # return node.name  # NOTE: avoid re-naming the node
 
+    def share_history(self, history, length=None):
+        """
+        Store a history in the message log of the graph.
+
+        Only the messages after the prefix shared with the history of
+        the previous node are appended, so the usual history that
+        grows by a few messages per node costs that many messages.
+        Messages are compared by identity first (CAI histories hold
+        immutable records), then by value. A last message equal to the
+        tip only by value says nothing about the messages before it,
+        so only identity takes the shortcut.
+
+        Returns:
+            HistoryView: the history, read from the log
+        """
+        length = len(history) if length is None else length
+        tip = self._history_tip
+        if length >= len(tip) and (not tip or history[len(tip) - 1]
+                                   is tip[-1]):
+            shared = len(tip)  # the common case: the history grew
+        else:
+            shared = 0
+            for message, previous in zip(itertools.islice(history, length),
+                                         tip):
+                if not _same(message, previous):
+                    break
+                shared += 1
+        ranges = tip.truncated(shared)
+        start = len(self._history_log)
+        self._history_log.extend(itertools.islice(history, shared, length))
+        end = len(self._history_log)
+        if end > start:
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        self._history_tip = HistoryView(self._history_log, ranges, length)
+        return self._history_tip
+
     def calculate_node_strout(self, history, node_name):
         """
         Calculates the strout for the given node
@@ -219,29 +371,29 @@ class Graph(nx.DiGraph):
         Returns:
             None
         """
-        unique_name = self.get_unique_name(node)
+        unique_name, base_name, index = self._unique_name(node.name)
         node.name = unique_name
+        if base_name is not None:
+            self._name_counters[base_name] = index
+
+        # reference the history of the node in the shared log
+        if node._pending is not None:  # pylint: disable=protected-access
+            node._history = self.share_history(*node._pending)  # pylint: disable=protected-access  # noqa: E501
+            node._pending = None  # pylint: disable=protected-access
 
         # calculate strout via state agent inference
         # node.strout = self.calculate_node_strout(node.history, node.name)
 
         # map and add the node to the graph
-        self._name_op_map[str(node)] = node
+        self._name_op_map[node.name] = node
         self.add_node(node)
 
-        # edge
-        action_label = None
-        if action:
-            # Convert list of tool calls to readable format
-            action_labels = []
-            for tool_call in action:
-                args_dict = json.loads(tool_call.function.arguments)
-                args_str = ", ".join(f"{k}={v}" for k, v in args_dict.items())
-                action_labels.append(f"{tool_call.function.name}({args_str})")
-            action_label = "\n".join(action_labels)
-
+        # edge, labelled with the action when the graph is exported
         if self.previous_node:
-            self.add_edge(self.previous_node, node, label=action_label)
+            if action:
+                self.add_edge(self.previous_node, node, action=action)
+            else:
+                self.add_edge(self.previous_node, node, label=None)
 
         # update previous node
         self.previous_node = node
@@ -250,10 +402,20 @@ class Graph(nx.DiGraph):
         """Adds a reward to the graph"""
         self.reward += reward
 
+    def label_edges(self):
+        """
+        Turns the actions (tool calls) of the edges added since the
+        last export into edge labels
+        """
+        for _, _, data in self.edges(data=True):
+            if "action" in data:
+                data["label"] = _action_label(data.pop("action"))
+
     def to_pydot(self):
         """
         Converts the graph to a pydot object
         """
+        self.label_edges()
         dot = nx.nx_pydot.to_pydot(self)
         return dot
 
@@ -261,56 +423,188 @@ class Graph(nx.DiGraph):
         """
         Exports the graph to a dot file
 
-        NOTE: simple ASCII art visualizations can be
-        made with https://dot-to-ascii.ggerganov.com/
+        NOTE: see ascii() for a plain text drawing
         """
+        self.label_edges()
         nx.nx_pydot.write_dot(self, dotfile_path)
 
     def ascii(self) -> str:
         """
         Exports the graph to an ASCII art string
 
-        NOTE: uses https://github.com/ggerganov/dot-to-ascii
+        The graph is drawn locally (see _AsciiRenderer): top to bottom,
+        one row of boxes per layer, with the tool calls on the edges.
+        Only the nodes added since the last call are laid out, and only
+        the rows that changed are drawn again.
         """
-        # Disable warnings for unverified HTTPS requests
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-        dot = self.to_pydot()
-
-        # Configure the graph attributes for better formatting
-        dot.set_rankdir('TB')  # Top to bottom layout
-        dot.set_nodesep(0.75)  # Increased node separation
-        dot.set_ranksep(0.75)  # Increased rank separation
-
-        # Configure node attributes
-        for node in dot.get_nodes():
-            node.set_shape('box')
-            node.set_fontname('monospace')
-            node.set_margin('0.3,0.2')  # Increased margins
-            # Left-align text in nodes
-            label = node.get_label()
-            if label:
-                # Strip quotes that may be present
-                label = label.strip('"')
-                # Add left alignment and padding
-                node.set_label(f'"{{\\l{label}\\l}}"')
-
-        # Configure edge attributes
-        for edge in dot.get_edges():
-            edge.set_arrowsize('0.5')
-            # Left-align edge labels
-            label = edge.get_label()
-            edge.set_label(label)
-
-        return requests.get(
-            "https://dot-to-ascii.ggerganov.com/dot-to-ascii.php",
-            params={
-                "boxart": 1,  # 0 for not fancy
-                "src": str(dot),
-            },
-            verify=False,  # nosec B501
-            timeout=30  # nosec B113
-        ).text
+        if self._ascii_renderer is None:
+            self._ascii_renderer = _AsciiRenderer()
+        self.label_edges()
+        return self._ascii_renderer.render(self)
+
+
+class _Canvas:  # pylint: disable=too-few-public-methods
+    """Grid of characters drawn by the ASCII renderer."""
+
+    # (drawn, already there) -> junction
+    _JUNCTIONS = {("│", "─"): "┼", ("─", "│"): "┼",
+                  ("│", "└"): "├", ("│", "┌"): "├",
+                  ("│", "┘"): "┤", ("│", "┐"): "┤",
+                  ("│", "├"): "├", ("│", "┤"): "┤", ("│", "┼"): "┼"}
+
+    def __init__(self, height):
+        self.rows = [[] for _ in range(height)]
+
+    def put(self, row, col, text, merge=False):
+        """Write text at (row, col); with merge, lines drawn over other
+        lines become junctions."""
+        line = self.rows[row]
+        if len(line) < col + len(text):
+            line.extend(" " * (col + len(text) - len(line)))
+        for i, char in enumerate(text):
+            if merge:
+                char = self._JUNCTIONS.get((char, line[col + i]), char)
+            line[col + i] = char
+
+    def lines(self):
+        """The rows, as strings."""
+        return ["".join(row).rstrip() for row in self.rows]
+
+
+class _AsciiRenderer:
+    """
+    Layered, top to bottom, box drawing of a Graph.
+
+    Nodes are placed in layers by the longest path from a root, in
+    the order they were added, and each layer is drawn as a row of
+    boxes labelled with str(node). Edges between consecutive layers
+    are drawn as arrows, labelled with the edge label; the others
+    (e.g. back edges) are listed below the drawing. Layers and the
+    drawing of each row are cached, so rendering again after adding
+    a node only lays out and draws that node and its parent row.
+    """
+
+    GAP = 3  # columns between boxes
+    MAX_WIDTH = 78  # of a box line
+
+    def __init__(self):
+        self.layers = {}  # node -> layer
+        self.rows = []  # layer -> nodes
+        self._boxes = {}  # box key -> box lines
+        self._blocks = {}  # block key -> lines
+
+    def _layout(self, graph):
+        """Place the nodes added since the last layout."""
+        new = [node for node in graph.nodes if node not in self.layers]
+        if len(self.layers) + len(new) > len(graph):
+            # nodes were removed, start over
+            self.layers, self.rows = {}, []
+            new = list(graph.nodes)
+        for node in new:
+            layer = max((self.layers[p] + 1 for p in graph.predecessors(node)
+                         if p in self.layers), default=0)
+            self.layers[node] = layer
+            while len(self.rows) <= layer:
+                self.rows.append([])
+            self.rows[layer].append(node)
+
+    def _box(self, node):
+        key = (node._id, node.name, node.strout)  # pylint: disable=protected-access  # noqa: E501
+        if key not in self._boxes:
+            text = [line if len(line) <= self.MAX_WIDTH
+                    else line[:self.MAX_WIDTH - 1] + "…"
+                    for line in str(node).split("\n")]
+            width = max(len(line) for line in text)
+            self._boxes[key] = (
+                ["┌" + "─" * (width + 2) + "┐"] +
+                [f"│ {line.ljust(width)} │" for line in text] +
+                ["└" + "─" * (width + 2) + "┘"])
+        return key, self._boxes[key]
+
+    def _row(self, nodes):
+        """Lines of a row of boxes and the column of each node's
+        connector."""
+        boxes = [self._box(node)[1] for node in nodes]
+        height = max(len(box) for box in boxes)
+        canvas = _Canvas(height)
+        columns = {}
+        col = 0
+        for node, box in zip(nodes, boxes):
+            for i, line in enumerate(box):
+                canvas.put(i, col, line)
+            columns[node] = col + 2
+            col += len(box[0]) + self.GAP
+        return canvas.lines(), columns
+
+    def _edges(self, edges, sources, targets):
+        """Lines of the arrows from a row (columns sources) to the next
+        one (columns targets)."""
+        bends = [e for e in edges if sources[e[0]] != targets[e[1]]]
+        labels = [(e, line) for e in edges
+                  for line in (e[2] or "").split("\n") if line]
+        canvas = _Canvas(len(bends) + len(labels) + 1)
+        bend_rows = {e: i for i, e in enumerate(bends)}
+        for e in edges:
+            src, dst = sources[e[0]], targets[e[1]]
+            turn = bend_rows.get(e, -1)
+            if turn >= 0:
+                left, right = sorted((src, dst))
+                canvas.put(turn, left, "─" * (right - left + 1), merge=True)
+                canvas.put(turn, src, "┘" if src > dst else "└")
+                canvas.put(turn, dst, "┌" if src > dst else "┐")
+        row = len(bends)
+        verticals = sorted({targets[e[1]] for e in edges} |
+                           {sources[e[0]] for e in bends})
+        for e, line in labels:
+            # right of the target arrow, clear of the other arrows
+            col = targets[e[1]] + 2
+            for vertical in verticals:
+                if col - 2 < vertical < col + len(line):
+                    col = vertical + 2
+            canvas.put(row, col, line)
+            row += 1
+        for e in edges:  # vertical lines on top of the labels
+            src, dst = sources[e[0]], targets[e[1]]
+            turn = bend_rows.get(e, -1)
+            for i in range(turn):
+                canvas.put(i, src, "│", merge=True)
+            for i in range(turn + 1, len(canvas.rows) - 1):
+                canvas.put(i, dst, "│", merge=True)
+            canvas.put(len(canvas.rows) - 1, dst, "▼")
+        return canvas.lines()
+
+    def render(self, graph):
+        """ASCII drawing of graph."""
+        self._layout(graph)
+        if not self.rows:
+            return ""
+        lines, others, blocks = [], [], {}
+        for layer, nodes in enumerate(self.rows):
+            following = (self.rows[layer + 1]
+                         if layer + 1 < len(self.rows) else [])
+            edges = []
+            for node in nodes:
+                for _, target, data in graph.out_edges(node, data=True):
+                    if self.layers.get(target) == layer + 1:
+                        edges.append((node, target, data.get("label")))
+                    else:
+                        others.append((node, target, data.get("label")))
+            key = (tuple(self._box(node)[0] for node in nodes),
+                   tuple(self._box(node)[0] for node in following),
+                   tuple((u._id, v._id, label) for u, v, label in edges))  # pylint: disable=protected-access  # noqa: E501
+            if key not in self._blocks:
+                row, sources = self._row(nodes)
+                if edges:
+                    targets = self._row(following)[1]
+                    row = row + self._edges(edges, sources, targets)
+                self._blocks[key] = row
+            blocks[key] = self._blocks[key]
+            lines += self._blocks[key]
+        self._blocks = blocks  # forget the rows that changed
+        for source, target, label in others:
+            lines.append(f"{source.name} ──▶ {target.name}"
+                         + (f"  [{label}]" if label else ""))
+        return "\n".join(lines)
 
 
 if "DEFAULT_GRAPH" not in globals():
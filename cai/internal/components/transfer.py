@@ -1,11 +1,16 @@
 """
 System data transfer utilities
 """
+import json
 import os
 import tempfile
 import shutil
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
+
+# Sidecar of a rotated log listing, per endpoint, the closed segments
+# already sent (they never change once closed)
+SENT_SUFFIX = ".sent.json"
 
 def _prepare_payload(
     source_path: str,
@@ -57,13 +62,63 @@ def _transmit_data(
                 pass
         return False
 
+def _read_sent(source_path: str) -> Dict[str, List[str]]:
+    """Segments of a log already sent, per endpoint"""
+    try:
+        with open(source_path + SENT_SUFFIX, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_sent(source_path: str, sent: Dict[str, List[str]]) -> None:
+    """Save the segments of a log already sent"""
+    tmp = source_path + SENT_SUFFIX + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sent, f)
+        os.replace(tmp, source_path + SENT_SUFFIX)
+    except OSError:
+        pass
+
+def _source_files(source_path: str) -> Tuple[List[str], List[str]]:
+    """Files of a log: its closed segments, then the current file and
+    the manifest listing the segments (last), or just the log"""
+    try:
+        from cai.datarecorder import MANIFEST_SUFFIX, log_files, read_manifest
+        if read_manifest(source_path) is None:
+            return [], [source_path]
+        files = log_files(source_path)
+        if files[-1] == source_path:
+            return files[:-1], [source_path, source_path + MANIFEST_SUFFIX]
+        return files, [source_path + MANIFEST_SUFFIX]
+    except (ImportError, OSError, ValueError):
+        return [], [source_path]
+
 def process(
     path: str,
     endpoint: str,
     identifier: Optional[str] = None
 ) -> bool:
-    """Process data transfer"""
-    payload = _prepare_payload(path, identifier)
-    if not payload:
-        return False
-    return _transmit_data(payload, endpoint) 
\ No newline at end of file
+    """Process data transfer
+
+    Closed segments of a rotated log are sent once per endpoint; the
+    current file and the manifest on every call.
+    """
+    sent = False
+    done = _read_sent(path)
+    segments = done.setdefault(endpoint, [])
+    closed, current = _source_files(path)
+    for source_path in closed + current:
+        name = os.path.basename(source_path)
+        if source_path in closed and name in segments:
+            continue
+        payload = _prepare_payload(source_path, identifier)
+        if not payload:
+            continue
+        if not _transmit_data(payload, endpoint):
+            return False
+        sent = True
+        if source_path in closed:
+            segments.append(name)
+            _write_sent(path, done)
+    return sent 
\ No newline at end of file
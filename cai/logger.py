@@ -9,6 +9,7 @@ import importlib
 import json
 import os
 import sys
+from contextlib import contextmanager
 from functools import wraps
 from openinference.instrumentation.openai import OpenAIInstrumentor  # pylint: disable=import-error  # noqa: E501
 
@@ -115,6 +116,8 @@ class ExploitLogger:
     def log_response(self, chain_element_name):
         """Decorator to log the response of a function call.
 
+        Works on both regular functions and coroutine functions.
+
         Args:
             chain_element_name (str or callable):
                 The name of the chain element.
@@ -125,143 +128,188 @@ class ExploitLogger:
             Callable: The decorated function.
         """
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.tracing:
+                        return await func(*args, **kwargs)
+                    with self._response_span(
+                            chain_element_name, args) as span:
+                        response = await func(*args, **kwargs)
+                        self._set_response_output(span, response)
+                        return response
+                return async_wrapper
+
             @wraps(func)
             def wrapper(*args, **kwargs):
                 if not self.tracing:
                     return func(*args, **kwargs)
-
-                # Get the actual chain element name
-                if callable(chain_element_name):
-                    # If it's a callable, call it with the
-                    # instance (first arg)
-                    actual_name = chain_element_name(args[0])
-                else:
-                    actual_name = chain_element_name
-
-                parent_context = context.get_current()
-
-                with self.tracer.start_as_current_span(
-                    actual_name, context=parent_context
-                ) as span:
-                    current_span.set(span)
-                    span.set_attribute(
-                        SpanAttributes.OPENINFERENCE_SPAN_KIND, "CHAIN")
-                    span.set_attribute("chain.name", actual_name)
-
-                    try:
-                        response = func(*args, **kwargs)
-
-                        # Log output only if flow returned from
-                        # the decorator
-                        if response:
-                            # Get last message if there are any messages
-                            last_message = (response.messages[-1]
-                                            if response.messages else None)
-
-                            markdown_content = (
-                                f"## Response Summary\n\n"
-                                f"#### Last Message\n"
-                                f"```json\n{
-                                    json.dumps(
-                                        last_message,
-                                        indent=2)}\n```\n\n"
-                                f"#### Agent\n"
-                                f"Name: {
-                                    response.agent.name if response.agent else 'No agent'}\n\n"  # noqa: E501  # pylint: disable=line-too-long
-                                f"#### Context Variables\n"
-                                f"```json\n{
-                                    json.dumps(
-                                        response.context_variables,
-                                        indent=2)}\n```\n\n"
-                                f"#### Execution Time\n"
-                                f"{response.time:.2f} seconds\n"
-                            )
-                            span.set_attribute(
-                                SpanAttributes.OUTPUT_VALUE, markdown_content
-                            )
-                            span.set_attribute(
-                                SpanAttributes.OUTPUT_MIME_TYPE, "text/plain"
-                            )
-
-                        span.set_status(Status(StatusCode.OK))
-                        return response
-                    except Exception as e:
-                        span.set_status(Status(StatusCode.ERROR, str(e)))
-                        raise
-                    finally:
-                        current_span.set(None)
+                with self._response_span(chain_element_name, args) as span:
+                    response = func(*args, **kwargs)
+                    self._set_response_output(span, response)
+                    return response
             return wrapper
         return decorator
 
+    @contextmanager
+    def _response_span(self, chain_element_name, args):
+        """Open the chain span used by log_response."""
+        # Get the actual chain element name
+        if callable(chain_element_name):
+            # If it's a callable, call it with the
+            # instance (first arg)
+            actual_name = chain_element_name(args[0])
+        else:
+            actual_name = chain_element_name
+
+        parent_context = context.get_current()
+
+        with self.tracer.start_as_current_span(
+            actual_name, context=parent_context
+        ) as span:
+            current_span.set(span)
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND, "CHAIN")
+            span.set_attribute("chain.name", actual_name)
+
+            try:
+                yield span
+                span.set_status(Status(StatusCode.OK))
+            except Exception as e:
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                raise
+            finally:
+                current_span.set(None)
+
+    @staticmethod
+    def _set_response_output(span, response):
+        """Attach a summary of a Response to the span."""
+        # Log output only if flow returned from
+        # the decorator
+        if not response:
+            return
+        # Get last message if there are any messages
+        last_message = (response.messages[-1]
+                        if response.messages else None)
+
+        markdown_content = (
+            f"## Response Summary\n\n"
+            f"#### Last Message\n"
+            f"```json\n{
+                json.dumps(
+                    last_message,
+                    indent=2)}\n```\n\n"
+            f"#### Agent\n"
+            f"Name: {
+                response.agent.name if response.agent else 'No agent'}\n\n"  # noqa: E501  # pylint: disable=line-too-long
+            f"#### Context Variables\n"
+            f"```json\n{
+                json.dumps(
+                    response.context_variables,
+                    indent=2)}\n```\n\n"
+            f"#### Execution Time\n"
+            f"{response.time:.2f} seconds\n"
+        )
+        span.set_attribute(
+            SpanAttributes.OUTPUT_VALUE, markdown_content
+        )
+        span.set_attribute(
+            SpanAttributes.OUTPUT_MIME_TYPE, "text/plain"
+        )
+
     def log_agent(self):
         """Decorator to log the agent.
 
+        Works on both regular functions and coroutine functions.
+
         Returns:
             Callable: The decorated function.
         """
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(cai, active_agent, *args, **kwargs):
+                    if not self.tracing or not active_agent:
+                        return await func(cai, active_agent, *args, **kwargs)
+                    with self._agent_span(active_agent) as outcome:
+                        outcome["agent"] = await func(
+                            cai, active_agent, *args, **kwargs)
+                        return outcome["agent"]
+                return async_wrapper
+
             @wraps(func)
             def wrapper(cai, active_agent, *args, **kwargs):
-                if not self.tracing:
+                if not self.tracing or not active_agent:
                     return func(cai, active_agent, *args, **kwargs)
-
-                if not active_agent:
-                    return func(cai, active_agent, *args, **kwargs)
-
-                # Check if we need a new span
-                needs_new_span = (
-                    not self.active_agent_name or
-                    active_agent.name != self.active_agent_name
-                )
-
-                if needs_new_span:
-                    agent_name = f"Agent: {active_agent.name}"
-                    # Create new span
-                    with self.tracer.start_as_current_span(
-                        agent_name,
-                        context=context.get_current()
-                    ) as span:
-                        self.active_agent_name = active_agent.name
-                        current_span.set(span)
-                        current_agent_span.set(span)
-                        span.set_attribute(
-                            SpanAttributes.OPENINFERENCE_SPAN_KIND, "CHAIN")
-                        span.set_attribute("chain.name", active_agent.name)
-
-                        new_active_agent = None
-                        try:
-                            new_active_agent = func(
-                                cai, active_agent, *args, **kwargs)
-                            span.set_status(Status(StatusCode.OK))
-                            return new_active_agent
-                        except Exception as e:
-                            span.set_status(Status(StatusCode.ERROR, str(e)))
-                            raise
-                        finally:
-                            if new_active_agent:
-                                agent_changed = (
-                                    not new_active_agent or
-                                    new_active_agent.name != active_agent.name
-                                )
-                                if agent_changed:
-                                    current_span.set(None)
-                                    current_agent_span.set(None)
-                                    self.active_agent_name = None
-                else:
-                    # Reuse existing span
-                    existing_span = current_agent_span.get()
-                    if not existing_span:
-                        return func(cai, active_agent, *args, **kwargs)
-
-                    token = context.attach(
-                        trace.set_span_in_context(existing_span))
-                    try:
-                        return func(cai, active_agent, *args, **kwargs)
-                    finally:
-                        context.detach(token)
+                with self._agent_span(active_agent) as outcome:
+                    outcome["agent"] = func(
+                        cai, active_agent, *args, **kwargs)
+                    return outcome["agent"]
             return wrapper
         return decorator
 
+    @contextmanager
+    def _agent_span(self, active_agent):
+        """Open (or re-enter) the span of active_agent.
+
+        Yields a dict in which the caller stores the agent returned
+        by the wrapped call under "agent", so that the span is
+        released on handoffs.
+        """
+        outcome = {}
+
+        # Check if we need a new span
+        needs_new_span = (
+            not self.active_agent_name or
+            active_agent.name != self.active_agent_name
+        )
+
+        if needs_new_span:
+            agent_name = f"Agent: {active_agent.name}"
+            # Create new span
+            with self.tracer.start_as_current_span(
+                agent_name,
+                context=context.get_current()
+            ) as span:
+                self.active_agent_name = active_agent.name
+                current_span.set(span)
+                current_agent_span.set(span)
+                span.set_attribute(
+                    SpanAttributes.OPENINFERENCE_SPAN_KIND, "CHAIN")
+                span.set_attribute("chain.name", active_agent.name)
+
+                try:
+                    yield outcome
+                    span.set_status(Status(StatusCode.OK))
+                except Exception as e:
+                    span.set_status(Status(StatusCode.ERROR, str(e)))
+                    raise
+                finally:
+                    new_active_agent = outcome.get("agent")
+                    if new_active_agent:
+                        agent_changed = (
+                            not new_active_agent or
+                            new_active_agent.name != active_agent.name
+                        )
+                        if agent_changed:
+                            current_span.set(None)
+                            current_agent_span.set(None)
+                            self.active_agent_name = None
+            return
+
+        # Reuse existing span
+        existing_span = current_agent_span.get()
+        if not existing_span:
+            yield outcome
+            return
+
+        token = context.attach(
+            trace.set_span_in_context(existing_span))
+        try:
+            yield outcome
+        finally:
+            context.detach(token)
+
     def _find_function_docstring(self, tool_name: str) -> str:
         """Find the docstring for a given tool name by
         searching through the tools package."""
@@ -294,61 +342,83 @@ class ExploitLogger:
         return "No documentation found"
 
     def log_tool(self):
-        """Decorator to log the tool."""
+        """Decorator to log the tool.
+
+        Works on both regular functions and coroutine functions.
+        """
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(tool_name, *args, **kwargs):
+                    if not self.tracing:
+                        return await func(tool_name, *args, **kwargs)
+                    with self._tool_span(tool_name) as span:
+                        result = await func(tool_name, *args, **kwargs)
+                        self._set_tool_output(span, tool_name, kwargs, result)
+                        return result
+                return async_wrapper
+
             @wraps(func)
             def wrapper(tool_name, *args, **kwargs):
                 if not self.tracing:
                     return func(tool_name, *args, **kwargs)
-
-                parent_context = context.get_current()
-
-                with self.tracer.start_as_current_span(
-                    tool_name, context=parent_context
-                ) as span:
-                    current_span.set(span)
-                    span.set_attribute(
-                        SpanAttributes.OPENINFERENCE_SPAN_KIND, "TOOL")
-                    try:
-                        result = func(tool_name, *args, **kwargs)
-                        span.set_attribute("tool.name", str(tool_name))
-
-                        # Get the function's docstring
-                        docstring = self._find_function_docstring(tool_name)
-                        span.set_attribute("tool.docstring", docstring)
-
-                        for key, value in kwargs.items():
-                            if key != "ctf":
-                                span.set_attribute(
-                                    f"tool.kwargs.{key}", str(value))
-
-                        span.set_attribute("tool.description", str(docstring))
-                        json_result = {
-                            "tool": tool_name,
-                            "docstring": docstring,
-                            "args": {k: str(v) for k, v in kwargs.items() if k != "ctf"},  # noqa: E501  # pylint: disable=line-too-long
-                            "output": str(result),
-                        }
-
-                        span.set_attribute(
-                            "tool.json_schema", json.dumps(
-                                json_result, indent=4)
-                        )
-                        span.set_attribute(
-                            "tool.parameters", json.dumps(
-                                json_result, indent=4)
-                        )
-
-                        return result
-                    except Exception as e:
-                        span.set_status(Status(StatusCode.ERROR, str(e)))
-                        raise
-                    finally:
-                        current_span.set(None)
+                with self._tool_span(tool_name) as span:
+                    result = func(tool_name, *args, **kwargs)
+                    self._set_tool_output(span, tool_name, kwargs, result)
+                    return result
 
             return wrapper
         return decorator
 
+    @contextmanager
+    def _tool_span(self, tool_name):
+        """Open the tool span used by log_tool."""
+        parent_context = context.get_current()
+
+        with self.tracer.start_as_current_span(
+            tool_name, context=parent_context
+        ) as span:
+            current_span.set(span)
+            span.set_attribute(
+                SpanAttributes.OPENINFERENCE_SPAN_KIND, "TOOL")
+            try:
+                yield span
+            except Exception as e:
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                raise
+            finally:
+                current_span.set(None)
+
+    def _set_tool_output(self, span, tool_name, kwargs, result):
+        """Attach the tool call and its result to the span."""
+        span.set_attribute("tool.name", str(tool_name))
+
+        # Get the function's docstring
+        docstring = self._find_function_docstring(tool_name)
+        span.set_attribute("tool.docstring", docstring)
+
+        for key, value in kwargs.items():
+            if key != "ctf":
+                span.set_attribute(
+                    f"tool.kwargs.{key}", str(value))
+
+        span.set_attribute("tool.description", str(docstring))
+        json_result = {
+            "tool": tool_name,
+            "docstring": docstring,
+            "args": {k: str(v) for k, v in kwargs.items() if k != "ctf"},  # noqa: E501  # pylint: disable=line-too-long
+            "output": str(result),
+        }
+
+        span.set_attribute(
+            "tool.json_schema", json.dumps(
+                json_result, indent=4)
+        )
+        span.set_attribute(
+            "tool.parameters", json.dumps(
+                json_result, indent=4)
+        )
+
 
 # Create a global instance of ExploitLogger
 exploit_logger = ExploitLogger(
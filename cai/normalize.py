@@ -0,0 +1,171 @@
+"""
+This module contains the tool output normalization pipeline of the
+CAI library.
+
+Tool outputs (run_command and friends) are meant for a terminal:
+ANSI colour codes, progress bars redrawn with carriage returns (wget,
+gobuster...), long runs of identical lines and whitespace padding.
+None of that helps the model, but all of it costs prompt tokens on
+every following turn. CAI.record_tool_result runs each output through
+the stages below before it is truncated and added to the history:
+
+    ansi: strip ANSI escape sequences
+    cr: keep only the final text of carriage-return overwritten lines
+    rle: replace runs of identical lines by one line and a count
+    blank: drop trailing whitespace, repeated and edge blank lines
+
+CAI_TOOL_OUTPUT_NORMALIZE selects the stages, as a comma separated
+list in the order above (default: all of them; "none" disables the
+pipeline). Savings per stage, in bytes and estimated tokens, are kept
+in normalizer.stats.
+"""
+# Standard library imports
+import os
+import re
+import threading
+
+# Third party imports
+import litellm  # pylint: disable=import-error
+
+
+_ANSI = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]"         # CSI: colours, cursor moves
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"  # OSC: window titles, links
+    r"|\x1b[@-Z\\-_]")                 # other two-byte sequences
+
+# Identical consecutive lines kept before the rest of the run is
+# replaced by a count
+RLE_MIN_RUN = 3
+
+
+def strip_ansi(text):
+    """Remove ANSI escape sequences."""
+    return _ANSI.sub("", text) if "\x1b" in text else text
+
+
+def collapse_cr(text):
+    """
+    Keep what a terminal would show for lines redrawn with carriage
+    returns (progress bars): the last non-empty segment.
+    """
+    if "\r" not in text:
+        return text
+    lines = text.replace("\r\n", "\n").split("\n")
+    for i, line in enumerate(lines):
+        if "\r" in line:
+            segments = [s for s in line.split("\r") if s]
+            lines[i] = segments[-1] if segments else ""
+    return "\n".join(lines)
+
+
+def rle_lines(text):
+    """Replace runs of RLE_MIN_RUN or more identical lines by the line
+    and a note with the number of repetitions."""
+    lines = text.split("\n")
+    out = []
+    i = 0
+    while i < len(lines):
+        j = i + 1
+        while j < len(lines) and lines[j] == lines[i]:
+            j += 1
+        if j - i >= RLE_MIN_RUN and lines[i].strip():
+            out += [lines[i], f"[previous line repeated {j - i - 1} "
+                              "more times]"]
+        else:
+            out += lines[i:j]
+        i = j
+    return "\n".join(out)
+
+
+def strip_padding(text):
+    """Drop trailing whitespace, repeated blank lines and blank lines
+    at the start and end."""
+    out = []
+    for line in text.split("\n"):
+        line = line.rstrip()
+        if line or (out and out[-1]):
+            out.append(line)
+    while out and not out[-1]:
+        out.pop()
+    return "\n".join(out)
+
+
+STAGES = {
+    "ansi": strip_ansi,
+    "cr": collapse_cr,
+    "rle": rle_lines,
+    "blank": strip_padding,
+}
+
+
+def _estimate_tokens(text):
+    try:
+        return litellm.token_counter(text=text)
+    except Exception:  # pylint: disable=broad-except
+        return len(text) // 4
+
+
+class OutputNormalizer:
+    """
+    Runs the normalization stages over tool outputs and keeps the
+    savings of each stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # stage -> [outputs changed, bytes saved, tokens saved]
+        self.stats = {name: [0, 0, 0] for name in STAGES}
+
+    @staticmethod
+    def stages():
+        """Names of the enabled stages (CAI_TOOL_OUTPUT_NORMALIZE)."""
+        setting = os.getenv("CAI_TOOL_OUTPUT_NORMALIZE", "all").lower()
+        if setting in ("all", "true", ""):
+            return list(STAGES)
+        if setting in ("none", "false"):
+            return []
+        return [name.strip() for name in setting.split(",")
+                if name.strip() in STAGES]
+
+    def normalize(self, text, stages=None):
+        """
+        Normalize a tool output.
+
+        Args:
+            text: The tool output
+            stages: Stage names to run, default stages()
+
+        Returns:
+            tuple: (normalized text, {stage: (bytes, tokens) saved}
+                for the stages that changed it)
+        """
+        savings = {}
+        tokens = None
+        for name in self.stages() if stages is None else stages:
+            result = STAGES[name](text)
+            if result == text:
+                continue
+            if tokens is None:
+                tokens = _estimate_tokens(text)
+            result_tokens = _estimate_tokens(result)
+            savings[name] = (len(text.encode("utf-8", errors="replace")) -
+                             len(result.encode("utf-8", errors="replace")),
+                             tokens - result_tokens)
+            text, tokens = result, result_tokens
+        with self._lock:
+            for name, (saved_bytes, saved_tokens) in savings.items():
+                self.stats[name][0] += 1
+                self.stats[name][1] += saved_bytes
+                self.stats[name][2] += saved_tokens
+        return text, savings
+
+
+def format_savings(savings):
+    """One line summary of the savings returned by normalize()."""
+    return ", ".join(f"{name} -{saved_bytes}B/-{saved_tokens}tok"
+                     for name, (saved_bytes, saved_tokens)
+                     in savings.items())
+
+
+# Create a global instance of OutputNormalizer
+normalizer = OutputNormalizer()
@@ -0,0 +1,301 @@
+"""
+This module contains the rate-limit scheduler of the CAI library.
+
+All completions of the process go through a single RateLimiter,
+which keeps per-provider token buckets for requests per minute
+(RPM) and tokens per minute (TPM), and a shared backoff window that
+is opened when a provider answers with a rate-limit error. Callers
+reserve capacity up front, so concurrent sessions or parallel tool
+flows queue behind each other instead of all hitting the API and
+then sleeping blindly.
+
+Limits are configured per provider through environment variables
+(0 or unset means unlimited):
+
+    CAI_RATE_LIMIT_RPM, CAI_RATE_LIMIT_TPM: defaults for all providers
+    CAI_RATE_LIMIT_RPM_<PROVIDER>, CAI_RATE_LIMIT_TPM_<PROVIDER>:
+        per-provider overrides, e.g. CAI_RATE_LIMIT_TPM_ANTHROPIC
+"""
+# Standard library imports
+import asyncio
+import email.utils
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+
+# Third party imports
+import litellm  # pylint: disable=import-error
+
+
+@lru_cache(maxsize=256)
+def provider_of(model):
+    """Return the litellm provider name of a model (e.g. "openai")."""
+    try:
+        return litellm.get_llm_provider(model)[1]
+    except Exception:  # pylint: disable=broad-except
+        return model.split("/")[0] if "/" in model else model
+
+
+def _parse_duration(value):
+    """Parse "20", "1.5s", "250ms" or "6m0s" style durations."""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)\s*(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked to wait before retrying, if any.
+
+    Looks at the Retry-After (and retry-after-ms or
+    x-ratelimit-reset-*) headers of the response and at the RetryInfo
+    detail in Vertex AI errors.
+
+    Returns:
+        float or None
+    """
+    headers = {}
+    for source in (getattr(error, "litellm_response_headers", None),
+                   getattr(getattr(error, "response", None),
+                           "headers", None)):
+        try:
+            headers.update({k.lower(): v for k, v in source.items()})
+        except Exception:  # pylint: disable=broad-except
+            continue
+
+    if "retry-after-ms" in headers:
+        delay = _parse_duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    if "retry-after" in headers:
+        delay = _parse_duration(headers["retry-after"])
+        if delay is not None:
+            return delay
+        try:  # HTTP-date
+            when = email.utils.parsedate_to_datetime(headers["retry-after"])
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    resets = [_parse_duration(headers[k])
+              for k in ("x-ratelimit-reset-requests",
+                        "x-ratelimit-reset-tokens") if k in headers]
+    resets = [r for r in resets if r is not None]
+    if resets:
+        return max(resets)
+
+    try:
+        json_str = str(error.message).split('VertexAIException - ')[-1]
+        error_details = json.loads(json_str)
+        retry_info = next(
+            (detail for detail in error_details.get('error', {}).get('details', [])  # noqa: E501  # pylint: disable=line-too-long
+             if detail.get('@type') == 'type.googleapis.com/google.rpc.RetryInfo'),  # noqa: E501  # pylint: disable=line-too-long
+            None
+        )
+        if retry_info and 'retryDelay' in retry_info:
+            return _parse_duration(retry_info['retryDelay'])
+    except Exception:  # pylint: disable=broad-except
+        pass
+    return None
+
+
+class _Bucket:  # pylint: disable=too-few-public-methods
+    """
+    Token bucket refilled continuously at capacity per minute.
+
+    Reservations may take the level below zero; the caller then waits
+    until the bucket would have refilled to cover it, which queues
+    callers in the order they reserved.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def reserve(self, amount, now):
+        """Take amount from the bucket and return the wait in seconds."""
+        self.level = min(self.capacity,
+                         self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+class _ProviderState:  # pylint: disable=too-few-public-methods
+    """Buckets, backoff and caller counts of one provider."""
+
+    def __init__(self, provider):
+        rpm = _limit("RPM", provider)
+        tpm = _limit("TPM", provider)
+        self.requests = _Bucket(rpm) if rpm else None
+        self.tokens = _Bucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.waiting = 0
+        self.in_flight = 0
+
+
+def _limit(kind, provider):
+    key = re.sub(r"\W", "_", provider).upper()
+    return float(os.getenv(f"CAI_RATE_LIMIT_{kind}_{key}",
+                           os.getenv(f"CAI_RATE_LIMIT_{kind}", "0")) or 0)
+
+
+class RateLimiter:
+    """
+    Process-wide, provider-aware scheduler for completion requests.
+
+    Use slot() (or aslot() from async code) around each request,
+    on_rate_limited() when the provider rejects one, and
+    record_usage() once the real token usage is known.
+    """
+
+    BACKOFF_BASE = 2.0  # seconds, doubled on each consecutive failure
+    BACKOFF_MAX = 60.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers = {}
+
+    def _state(self, model):
+        provider = provider_of(model)
+        state = self._providers.get(provider)
+        if state is None:
+            state = self._providers[provider] = _ProviderState(provider)
+        return state
+
+    def reserve(self, model, tokens=0):
+        """
+        Reserve capacity for one request of about tokens tokens.
+
+        Returns:
+            float: seconds to wait before sending it
+        """
+        with self._lock:
+            state = self._state(model)
+            now = time.monotonic()
+            wait = max(0.0, state.blocked_until - now)
+            if state.requests:
+                wait = max(wait, state.requests.reserve(1, now))
+            if state.tokens and tokens:
+                wait = max(wait, state.tokens.reserve(tokens, now))
+            return wait
+
+    def _notify_wait(self, model, state, wait):
+        if wait >= 1:
+            queued = state.waiting - 1
+            print(f"\033[33mRate limit: waiting {wait:.1f}s for "
+                  f"{provider_of(model)}"
+                  + (f" ({queued} more requests queued)" if queued else "")
+                  + "\033[0m")
+
+    @contextmanager
+    def slot(self, model, tokens=0):
+        """Wait (blocking this thread only) for capacity, then run the
+        request inside the block."""
+        state = self._begin(model)
+        admitted = False
+        try:
+            wait = self.reserve(model, tokens)
+            self._notify_wait(model, state, wait)
+            while wait > 0:
+                time.sleep(wait)
+                # a rate-limit error meanwhile may extend the wait
+                wait = max(0.0, state.blocked_until - time.monotonic())
+            admitted = self._admit(state)
+            yield
+        finally:
+            self._finish(state, admitted)
+
+    @asynccontextmanager
+    async def aslot(self, model, tokens=0):
+        """Async counterpart of slot() that waits without blocking the
+        event loop."""
+        state = self._begin(model)
+        admitted = False
+        try:
+            wait = self.reserve(model, tokens)
+            self._notify_wait(model, state, wait)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = max(0.0, state.blocked_until - time.monotonic())
+            admitted = self._admit(state)
+            yield
+        finally:
+            self._finish(state, admitted)
+
+    def _begin(self, model):
+        with self._lock:
+            state = self._state(model)
+            state.waiting += 1
+            return state
+
+    def _admit(self, state):
+        with self._lock:
+            state.waiting -= 1
+            state.in_flight += 1
+        return True
+
+    def _finish(self, state, admitted):
+        with self._lock:
+            if admitted:
+                state.in_flight -= 1
+            else:
+                state.waiting -= 1
+
+    def on_rate_limited(self, model, error):
+        """
+        Open a backoff window for the provider of model.
+
+        Uses the delay requested by the provider when there is one,
+        otherwise exponential backoff with jitter. Every caller of
+        the provider waits for the window, not just this one.
+
+        Returns:
+            float: seconds until the window closes
+        """
+        delay = retry_after(error)
+        with self._lock:
+            state = self._state(model)
+            state.failures += 1
+            if delay is None:
+                delay = min(self.BACKOFF_MAX,
+                            self.BACKOFF_BASE * 2 ** (state.failures - 1))
+                delay *= random.uniform(0.5, 1.0)  # nosec B311
+            state.blocked_until = max(state.blocked_until,
+                                      time.monotonic() + delay)
+            return state.blocked_until - time.monotonic()
+
+    def record_usage(self, model, tokens):
+        """
+        Account for tokens that were not reserved up front (e.g. the
+        completion tokens of the reply) and reset the backoff.
+        """
+        with self._lock:
+            state = self._state(model)
+            state.failures = 0
+            if state.tokens and tokens > 0:
+                state.tokens.reserve(tokens, time.monotonic())
+
+    def stats(self, model):
+        """Return (waiting, in_flight) callers for the provider of model."""
+        with self._lock:
+            state = self._state(model)
+            return state.waiting, state.in_flight
+
+
+# Create a global instance of RateLimiter
+rate_limiter = RateLimiter()
@@ -2072,6 +2072,7 @@ class WorkspaceCommand(Command):
                 new_recorder.total_cost = old_total_cost
 
                 # Replace the old recorder instance in the client
+                repl.client.rec_training_data.close()
                 repl.client.rec_training_data = new_recorder
                 new_filename = new_recorder.filename  # Get the path of the new log file
 
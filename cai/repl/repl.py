@@ -567,6 +567,8 @@ def run_cai_cli(  # pylint: disable=too-many-arguments,too-many-locals,too-many-
                 create_report(report_data, template)
 
             # Display session statistics
+            if client.rec_training_data:
+                client.rec_training_data.flush()
             display_execution_time(
                 logging_path=client.rec_training_data.filename)
 
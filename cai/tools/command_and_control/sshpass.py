@@ -12,6 +12,10 @@ It handles privilege escalation very well and is autonomous regarding SSH passwo
 something that hasn't been seen in other cybersecurity frameworks yet (Feb 2025)
 """  # noqa: E501
 
+import os
+import subprocess  # nosec B404
+
+from cai.tools.common import get_ssh_transport  # pylint: disable=E0401
 from cai.tools.misc.cli_utils import execute_cli_command  # pylint: disable=E0401 # noqa: E501
 
 def run_ssh_command_with_credentials(
@@ -33,6 +37,24 @@ def run_ssh_command_with_credentials(
     Returns:
         str: Output from the remote command execution
     """
+    # On the host, reuse a pooled connection to the target (see
+    # cai.tools.common._SshTransport); in a container or over SSH,
+    # run sshpass there as before
+    on_host = not os.getenv("CAI_ACTIVE_CONTAINER") and not (
+        os.getenv("SSH_USER") and os.getenv("SSH_HOST"))
+    transport = on_host and get_ssh_transport(
+        username, host, port, password,
+        options=["-o", "StrictHostKeyChecking=no"])
+    if transport:
+        try:
+            result = transport.run(command)
+        except subprocess.TimeoutExpired as e:
+            return f"Timeout executing SSH command: {e}"
+        except FileNotFoundError:
+            return "'sshpass' or 'ssh' command not found. " \
+                "Ensure they are installed and in PATH."
+        return (result.stdout if result.stdout else result.stderr).strip()
+
     # Escape special characters in password and command to prevent shell injection
     escaped_password = password.replace("'", "'\\''")
     escaped_command = command.replace("'", "'\\''")
@@ -2,11 +2,20 @@
 Basic utilities for executing tools
 inside or outside of virtual containers.
 """
+import asyncio
+import atexit
+import codecs
+import hashlib
+import itertools
+import json
+import selectors
 import subprocess  # nosec B404
 import threading
 import os
 import pty
 import signal
+import stat
+import tempfile
 import time
 import uuid
 from wasabi import color  # pylint: disable=import-error
@@ -90,6 +99,191 @@ def _get_container_workspace_path() -> str:
         return "/"
 
 
+class OutputRing:
+    """
+    Byte-capped buffer of the output of a session.
+
+    Every byte written gets an offset that keeps increasing for the
+    life of the session. Only the last `limit` bytes are kept: reading
+    from an offset that was dropped returns what is left and how many
+    bytes were lost, so readers can resume from where they stopped.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit or int(
+            os.getenv("CAI_SESSION_OUTPUT_LIMIT", str(1 << 20)))
+        self._data = bytearray()
+        self.start = 0  # offset of the first byte kept
+        self._lock = threading.Lock()
+
+    @property
+    def end(self):
+        """Offset of the next byte written."""
+        return self.start + len(self._data)
+
+    def write(self, text):
+        """Append text; returns the offset after it."""
+        with self._lock:
+            self._data += text.encode("utf-8", errors="replace")
+            excess = len(self._data) - self.limit
+            if excess > 0:
+                # do not keep half a multibyte character
+                while (excess < len(self._data) and
+                       self._data[excess] & 0xC0 == 0x80):
+                    excess += 1
+                del self._data[:excess]
+                self.start += excess
+            return self.start + len(self._data)
+
+    def write_line(self, text):
+        """Append text as a line of its own (status messages)."""
+        with self._lock:
+            newline = bool(self._data) and self._data[-1:] != b"\n"
+        return self.write(("\n" if newline else "") + text + "\n")
+
+    def read(self, offset=0):
+        """
+        Output written from offset on.
+
+        Returns:
+            tuple: (text, offset after it, bytes dropped before it)
+        """
+        with self._lock:
+            dropped = max(0, self.start - offset)
+            data = bytes(self._data[max(0, offset - self.start):])
+            return (data.decode("utf-8", errors="replace"),
+                    self.start + len(self._data), dropped)
+
+
+class _PtyReactor:
+    """
+    Single thread reading the PTY masters of all shell sessions.
+
+    The masters are multiplexed with selectors (epoll on Linux), so
+    output is read in large chunks as soon as it is available, without
+    a thread and a polling delay per session. Once a session is added,
+    the reactor owns its master: it closes it on EOF (the process
+    exited) or when the session is removed.
+
+    A session whose output cannot be handled is closed as if its
+    process had exited. Should the thread itself fail, its sessions
+    are handed to the next thread, started by the next add or remove.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []  # (add or remove, session)
+        self._thread = None
+        self._selector = None
+        self._wakeup = None  # pipe interrupting select() for _pending
+
+    def add(self, session):
+        """Start reading the output of session."""
+        self._submit("add", session)
+
+    def remove(self, session):
+        """Stop reading the output of session and close its master."""
+        self._submit("remove", session)
+
+    def _submit(self, op, session):
+        with self._lock:
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = os.pipe()
+                os.set_blocking(self._wakeup[0], False)
+                self._selector.register(self._wakeup[0],
+                                        selectors.EVENT_READ)
+                self._thread = threading.Thread(
+                    target=self._run, name="cai-pty-reactor", daemon=True)
+                self._thread.start()
+            self._pending.append((op, session))
+            os.write(self._wakeup[1], b"\0")
+
+    def _apply_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for op, session in pending:
+            fd = session.master
+            if fd is None:
+                continue
+            if op == "add":
+                try:
+                    self._selector.register(fd, selectors.EVENT_READ,
+                                            session)
+                except (KeyError, ValueError, OSError) as e:
+                    self._fail(session, e)
+            else:
+                self._close(session)
+
+    def _close(self, session):
+        fd, session.master = session.master, None
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    def _fail(self, session, error):
+        """Close a session whose output could not be handled."""
+        print(f"Error reading session {session.session_id}: {error}")
+        self._close(session)
+        try:
+            session._on_eof()  # pylint: disable=protected-access
+        except Exception:  # pylint: disable=broad-except
+            session.is_running = False
+
+    def _read(self, key):
+        try:
+            data = os.read(key.fd, self.READ_SIZE)
+        except OSError:  # EIO once the process closed the PTY
+            data = b""
+        if data:
+            key.data._on_output(data)  # pylint: disable=protected-access
+        else:
+            self._close(key.data)
+            key.data._on_eof()  # pylint: disable=protected-access
+
+    def _run(self):
+        try:
+            while True:
+                for key, _ in self._selector.select():
+                    if key.data is None:  # wakeup
+                        try:
+                            while os.read(key.fd, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    try:
+                        self._read(key)
+                    except Exception as e:  # pylint: disable=broad-except
+                        self._fail(key.data, e)
+                self._apply_pending()
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error in the shell session reader: {e}")
+        finally:
+            self._reset()
+
+    def _reset(self):
+        """Hand the sessions of a failed thread to the next one."""
+        with self._lock:
+            sessions = [key.data for key in self._selector.get_map().values()
+                        if key.data is not None]
+            self._selector.close()
+            for fd in self._wakeup:
+                os.close(fd)
+            self._pending[:0] = [("add", session) for session in sessions]
+            self._thread = None
+
+
+_reactor = _PtyReactor()
+
+
 class ShellSession:  # pylint: disable=too-many-instance-attributes
     """Class to manage interactive shell sessions"""
 
@@ -111,9 +305,16 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
         self.process = None
         self.master = None
         self.slave = None
-        self.output_buffer = []
+        self.output = OutputRing()
+        # offset up to which get_output() returned the output
+        self.read_offset = 0
         self.is_running = False
         self.last_activity = time.time()
+        # set when output arrives, see wait_for_output
+        self.output_event = threading.Event()
+        # multibyte characters may be split across reads
+        self._decoder = codecs.getincrementaldecoder("utf-8")(
+            errors="replace")
 
         # Prepare the command based on context
         self.command = self._prepare_command(command)
@@ -155,27 +356,27 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
                     universal_newlines=True
                 )
                 self.is_running = True
-                self.output_buffer.append(
+                self.output.write_line(
                     f"[Session {self.session_id}] Started in container {self.container_id[:12]}: "
                     f"{start_message_cmd} in {self.workspace_dir}")
-                threading.Thread(target=self._read_output, daemon=True).start()
+                self._read_output()
             except Exception as e:
-                self.output_buffer.append(f"Error starting container session: {str(e)}")
+                self.output.write_line(f"Error starting container session: {str(e)}")
                 self.is_running = False
             return
 
         # --- Start in CTF ---
         if self.ctf:
             self.is_running = True
-            self.output_buffer.append(
+            self.output.write_line(
                 f"[Session {self.session_id}] Started CTF command: "
                 f"{start_message_cmd} in {self.workspace_dir}")
             try:
                 # Execute the prepared command (includes cd prefix)
                 output = self.ctf.get_shell(self.command)
-                self.output_buffer.append(output)
+                self.output.write_line(output)
             except Exception as e:  # pylint: disable=broad-except
-                self.output_buffer.append(f"Error executing CTF command: {str(e)}")
+                self.output.write_line(f"Error executing CTF command: {str(e)}")
             self.is_running = False # CTF get_shell is typically blocking
             return
 
@@ -193,62 +394,54 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
                 universal_newlines=True
             )
             self.is_running = True
-            self.output_buffer.append(
+            self.output.write_line(
                 f"[Session {self.session_id}] Started locally: "
                 f"{start_message_cmd} in {self.workspace_dir}")
-            threading.Thread(target=self._read_output, daemon=True).start()
+            self._read_output()
         except Exception as e:  # pylint: disable=broad-except
-            self.output_buffer.append(f"Error starting local session: {str(e)}")
+            self.output.write_line(f"Error starting local session: {str(e)}")
             self.is_running = False
 
     def _read_output(self):
         """Read output from the process (works for local and container)"""
-        try:
-            while self.is_running and self.master is not None:
-                try:
-                    # Check if process has exited before reading
-                    if self.process and self.process.poll() is not None:
-                        self.is_running = False
-                        break
-                    output = os.read(self.master, 1024).decode()
-                    if output:
-                        self.output_buffer.append(output)
-                        self.last_activity = time.time()
-                    else: # End of file usually means process terminated
-                        self.is_running = False
-                        break
-                except OSError: # E.g., EIO when PTY closes
-                    self.is_running = False
-                    break
-                except Exception as read_err: # Catch other potential errors
-                     self.output_buffer.append(f"Error reading output buffer: {str(read_err)}")
-                     self.is_running = False
-                     break
-                # Add a small sleep to prevent busy-waiting if no output
-                if self.is_running:
-                     time.sleep(0.05)
-
-        except Exception as e: # Catch errors in the loop setup itself
-            self.output_buffer.append(f"Error in read_output loop: {str(e)}")
-            self.is_running = False
-        finally:
-             # Ensure PTYs are closed if master exists
-             if self.master:
-                 try:
-                     os.close(self.master)
-                 except OSError: pass # Ignore errors if already closed
-                 self.master = None
-             if self.slave:
-                 try:
-                     os.close(self.slave)
-                 except OSError: pass # Ignore errors if already closed
-                 self.slave = None
-             # Mark as not running definitively
-             self.is_running = False
-             # Add final status message if process exited unexpectedly
-             if self.process and self.process.poll() is not None:
-                 self.output_buffer.append(f"[Session {self.session_id}] Process terminated.")
+        # Only the child keeps the slave end open, so that the reactor
+        # gets EOF on the master when the process exits
+        if self.slave is not None:
+            try:
+                os.close(self.slave)
+            except OSError:
+                pass
+            self.slave = None
+        _reactor.add(self)
+
+    def _on_output(self, data):
+        """Called by the reactor with output of the process."""
+        text = self._decoder.decode(data)
+        if text:
+            self.output.write(text)
+            self.last_activity = time.time()
+            self.output_event.set()
+
+    def _on_eof(self):
+        """Called by the reactor once the process closed the PTY."""
+        text = self._decoder.decode(b"", final=True)
+        if text:
+            self.output.write(text)
+        if self.process and self.is_running:
+            self.output.write_line(
+                f"[Session {self.session_id}] Process terminated.")
+        self.is_running = False
+        self.output_event.set()
+
+    def wait_for_output(self, timeout=None):
+        """
+        Wait until the process writes output (or exits), at most
+        timeout seconds.
 
+        Returns:
+            bool: whether there is output not read by get_output()
+        """
+        return self.output_event.wait(timeout)
 
     def is_process_running(self):
         """Check if the process is still running"""
@@ -274,7 +467,7 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
             # --- Send to CTF ---
             if self.ctf:
                 output = self.ctf.get_shell(input_data)
-                self.output_buffer.append(output)
+                self.output.write_line(output)
                 return "Input sent to CTF session"
 
             # --- Send to Local or Container PTY ---
@@ -283,7 +476,7 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
                 bytes_written = os.write(self.master, input_data_bytes)
                 if bytes_written != len(input_data_bytes):
                      # Handle potential short writes (less likely with os.write)
-                     self.output_buffer.append("[Session {self.session_id}] Warning: Partial input write.")
+                     self.output.write_line(f"[Session {self.session_id}] Warning: Partial input write.")
                 self.last_activity = time.time()
                 return "Input sent to session"
             else:
@@ -291,21 +484,37 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
 
         except OSError as e:
              # Handle cases where the PTY might have closed unexpectedly
-             self.output_buffer.append(f"Error sending input (OSError): {str(e)}")
+             self.output.write_line(f"Error sending input (OSError): {str(e)}")
              self.is_running = False # Mark session as dead
              return f"Error sending input: {str(e)}"
         except Exception as e:  # pylint: disable=broad-except
-            self.output_buffer.append(f"Error sending input: {str(e)}")
+            self.output.write_line(f"Error sending input: {str(e)}")
             return f"Error sending input: {str(e)}"
 
+    def read_output(self, offset=0):
+        """
+        Output of the session from offset on, see OutputRing.read.
+
+        Returns:
+            tuple: (text, offset to read from next, bytes dropped)
+        """
+        return self.output.read(offset)
+
     def get_output(self, clear=True):
-        """Get and optionally clear the output buffer"""
-        # Give a very brief moment for any final output to be read
-        # time.sleep(0.05)
-        output = "\n".join(self.output_buffer) # Join without extra newlines
+        """
+        Get the output not read yet; with clear, mark it as read.
+
+        Output dropped because it overflowed the buffer
+        (CAI_SESSION_OUTPUT_LIMIT) is replaced by a note with its size.
+        """
         if clear:
-            self.output_buffer = []
-        return output
+            self.output_event.clear()
+        text, offset, dropped = self.output.read(self.read_offset)
+        if clear:
+            self.read_offset = offset
+        if dropped:
+            text = f"[... {dropped} bytes dropped ...]\n{text}"
+        return text
 
     def terminate(self):
         """Terminate the session (local or container)"""
@@ -362,11 +571,10 @@ class ShellSession:  # pylint: disable=too-many-instance-attributes
                      termination_message += " (Warning: Process may still be running)"
 
 
-            # Clean up PTY resources if they exist
-            if self.master:
-                try: os.close(self.master)
-                except OSError: pass
-                self.master = None
+            # Clean up PTY resources if they exist (the reactor owns
+            # the master)
+            if self.master is not None:
+                _reactor.remove(self)
             if self.slave:
                 try: os.close(self.slave)
                 except OSError: pass
@@ -471,6 +679,205 @@ def terminate_session(session_id):
     return result
 
 
+def _output_limits():
+    """
+    Output limits of commands (CAI_COMMAND_OUTPUT_LIMIT and
+    CAI_COMMAND_OUTPUT_CAP).
+
+    Returns:
+        tuple: (bytes kept per stream, bytes read before the command
+            is killed or 0 for no cap)
+    """
+    return (int(os.getenv("CAI_COMMAND_OUTPUT_LIMIT", str(1 << 20))),
+            int(os.getenv("CAI_COMMAND_OUTPUT_CAP", str(64 << 20))))
+
+
+def _join_output(head, tail, omitted):
+    """Head and tail of an output, with a note for the bytes between."""
+    if not omitted:
+        return head + tail
+    return f"{head}\n[... {omitted} bytes omitted ...]\n{tail}"
+
+
+class OutputCapture:
+    """
+    Bounded capture of one output stream of a command.
+
+    The first and the last limit/2 bytes are kept and the bytes in
+    between only counted, so memory stays flat however much the
+    command prints.
+    """
+
+    def __init__(self, limit=None):
+        self.keep = max(1, (limit or _output_limits()[0]) // 2)
+        self.head = bytearray()
+        self._tail = bytearray()
+        self.size = 0  # bytes written
+
+    def write(self, data):
+        """Add a chunk of output."""
+        self.size += len(data)
+        room = max(0, self.keep - len(self.head))
+        self.head += data[:room]
+        self._tail += data[room:]
+        if len(self._tail) > 2 * self.keep:  # trim once in a while
+            del self._tail[:-self.keep]
+
+    def text(self):
+        """The output, with a note in place of the bytes not kept."""
+        tail = bytes(self._tail[-self.keep:])
+        omitted = self.size - len(self.head) - len(tail)
+        if not omitted:
+            return (bytes(self.head) + tail).decode("utf-8", errors="replace")
+        # drop the characters cut in half at either end
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        head = decoder.decode(bytes(self.head))
+        cut = 0
+        while cut < min(3, len(tail)) and tail[cut] & 0xC0 == 0x80:
+            cut += 1
+        omitted += len(decoder.getstate()[0]) + cut
+        return _join_output(head, tail[cut:].decode("utf-8", errors="replace"),
+                            omitted)
+
+
+def _cap_note(cap):
+    return f"\n[Output cap of {cap} bytes reached: command killed]"
+
+
+class CommandResult:
+    """Outcome of stream_command: the captured output and its stats."""
+
+    def __init__(self, returncode, captures, elapsed, capped=0):
+        self.returncode = returncode
+        self.stdout = captures["stdout"]
+        self.stderr = captures["stderr"]
+        self.elapsed = elapsed  # seconds
+        self.capped = capped  # the cap, if the command was killed for it
+
+    def text(self, stream):
+        """Output of stream ("stdout" or "stderr"), noting the cap."""
+        text = getattr(self, stream).text()
+        return text + _cap_note(self.capped) if self.capped else text
+
+    @property
+    def output(self):
+        """stdout, or stderr if there is no stdout (as run_command)."""
+        return self.text("stdout" if self.stdout.size else "stderr")
+
+    @property
+    def stats(self):
+        """One line summary of the run."""
+        return (f"exit {self.returncode}, {self.stdout.size} bytes stdout, "
+                f"{self.stderr.size} bytes stderr, {self.elapsed:.1f}s"
+                + (", killed at the output cap" if self.capped else ""))
+
+
+def stream_command(command, on_output=None, timeout=100, cwd=None,  # pylint: disable=too-many-arguments,too-many-locals # noqa: E501
+                   limit=None, cap=None):
+    """
+    Run command, handing its output over as it is produced.
+
+    Both pipes are read in chunks as soon as data is available; only
+    the head and tail of each are kept (see OutputCapture), and the
+    command is killed once it has printed cap bytes, so a runaway
+    output neither fills the memory nor runs until the timeout.
+
+    Args:
+        command: Shell command string, or argument list
+        on_output: Called as on_output(stream, text) for each chunk,
+            with stream "stdout" or "stderr"
+        timeout: Seconds before the command is killed
+        cwd: Working directory
+        limit: Bytes kept per stream (default CAI_COMMAND_OUTPUT_LIMIT)
+        cap: Bytes read before the command is killed, 0 for no cap
+            (default CAI_COMMAND_OUTPUT_CAP)
+
+    Returns:
+        CommandResult
+
+    Raises:
+        subprocess.TimeoutExpired: if the command timed out, with the
+            output read so far
+    """
+    default_limit, default_cap = _output_limits()
+    cap = default_cap if cap is None else cap
+    args = ["/bin/sh", "-c", command] if isinstance(command, str) else command
+    captures = {"stdout": OutputCapture(limit or default_limit),
+                "stderr": OutputCapture(limit or default_limit)}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")("replace")
+                for name in captures}
+    start = time.time()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+    selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+    capped = 0
+    try:
+        while selector.get_map() and not capped:
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(
+                    command, timeout, output=captures["stdout"].text(),
+                    stderr=captures["stderr"].text())
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                captures[key.data].write(data)
+                text = decoders[key.data].decode(data)
+                if on_output and text:
+                    on_output(key.data, text)
+            if cap and sum(c.size for c in captures.values()) >= cap:
+                capped = cap
+                process.kill()
+        try:
+            returncode = process.wait(max(0, start + timeout - time.time()))
+        except subprocess.TimeoutExpired as e:
+            raise subprocess.TimeoutExpired(
+                command, timeout, output=captures["stdout"].text(),
+                stderr=captures["stderr"].text()) from e
+    finally:
+        selector.close()
+        # writers left in a pipeline die of SIGPIPE
+        process.stdout.close()
+        process.stderr.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return CommandResult(returncode, captures, time.time() - start, capped)
+
+
+def _live_output(command):
+    """
+    Live display of the output of command in the CLI (CAI_DEBUG=2).
+
+    Returns:
+        tuple: (display to stop, on_output callback), or (None, None)
+            if there is no display
+    """
+    if os.getenv("CAI_DEBUG", "1") != "2":
+        return None, None
+    # imported on use: cai.util loads the CLI stack (rich, the graph)
+    from cai.util import (  # pylint: disable=import-outside-toplevel
+        cli_command_display,
+        cli_update_command_display,
+    )
+    live = cli_command_display(command)
+    if live is None:
+        return None, None
+    shown = [""]
+    last_update = [0.0]
+
+    def on_output(_, text):
+        shown[0] = (shown[0] + text)[-4096:]
+        if time.time() - last_update[0] >= 0.1:
+            last_update[0] = time.time()
+            cli_update_command_display(live, command, shown[0])
+    return live, on_output
+
+
 def _run_ctf(ctf, command, stdout=False, timeout=100, workspace_dir=None):
     """Runs command in CTF env, changing to workspace_dir first."""
     target_dir = workspace_dir or _get_workspace_dir()
@@ -488,6 +895,201 @@ def _run_ctf(ctf, command, stdout=False, timeout=100, workspace_dir=None):
         return error_msg
 
 
+# Directory of the ControlMaster sockets (kept short: socket paths are
+# limited to ~100 characters)
+SSH_CONTROL_DIR = os.path.join(tempfile.gettempdir(), f"cai-ssh-{os.getuid()}")
+# Seconds between keepalives of the master connections
+SSH_KEEPALIVE = 30
+# Seconds before trying again to start a master that failed
+SSH_MASTER_RETRY = 60
+# Most seconds given to a master to start (out of the timeout of the
+# command that starts it)
+SSH_MASTER_TIMEOUT = 10
+# ssh errors of a command that did not get a session on the master
+SSH_MUX_ERRORS = ("mux_client_hello_exchange", "mux_client_request_session")
+_SSH_PRIVATE_DIR = []  # per-process fallback for SSH_CONTROL_DIR
+
+
+def _ssh_control_dir():
+    """
+    SSH_CONTROL_DIR, created private to the user.
+
+    As the path is predictable, another user may create it first and
+    plant sockets that would take over the sessions: unless it is a
+    directory owned by the user and closed to others, a per-process
+    directory is used instead.
+    """
+    try:
+        os.mkdir(SSH_CONTROL_DIR, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return _ssh_private_dir()
+    info = os.lstat(SSH_CONTROL_DIR)
+    if (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+            and not info.st_mode & 0o077):
+        return SSH_CONTROL_DIR
+    return _ssh_private_dir()
+
+
+def _ssh_private_dir():
+    if not _SSH_PRIVATE_DIR:
+        _SSH_PRIVATE_DIR.append(tempfile.mkdtemp(prefix="cai-ssh-"))
+    return _SSH_PRIVATE_DIR[0]
+
+
+class _SshTransport:
+    """
+    Persistent SSH connection to user@host:port, shared by commands.
+
+    The first command starts an OpenSSH ControlMaster in the background;
+    the next ones open a channel on it instead of going through a new
+    TCP connection, key exchange and authentication. The master sends
+    keepalives and exits after CAI_SSH_CONTROL_PERSIST idle seconds. A
+    dead master is restarted, and a command that could not open its
+    session on it is retried (a command that started is never run
+    again); if it cannot be started, commands connect directly as
+    before. At most
+    CAI_SSH_MAX_SESSIONS commands run at once per host (sshd refuses
+    channels above its MaxSessions, 10 by default).
+    """
+
+    def __init__(self, user, host, port=None, password=None, options=()):
+        self.target = f"{user}@{host}"
+        self.port = port
+        self.password = password
+        self.options = list(options)
+        digest = hashlib.sha1(f"{self.target}:{port}".encode()).hexdigest()
+        self.control_path = os.path.join(_ssh_control_dir(), digest[:16])
+        self.channels = threading.BoundedSemaphore(
+            int(os.getenv("CAI_SSH_MAX_SESSIONS", "10")))
+        self._lock = threading.Lock()
+        self._failed_at = 0
+
+    def _ssh(self, *args):
+        """ssh (through sshpass with a password) to the target"""
+        command = ["sshpass", "-p", self.password] if self.password else []
+        command += ["ssh", *self.options, "-o",
+                    f"ControlPath={self.control_path}"]
+        if self.port:
+            command += ["-p", str(self.port)]
+        return command + [*args, self.target]
+
+    def _control(self, operation):
+        """Send a control command ("check", "exit") to the master."""
+        return subprocess.run(self._ssh("-O", operation),
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL,
+                              check=False, timeout=10).returncode == 0
+
+    def _start_master(self, timeout):
+        """Start the master in the background; whether it runs."""
+        persist = os.getenv("CAI_SSH_CONTROL_PERSIST", "600")
+        try:
+            # no pipes: the backgrounded master would hold them open
+            result = subprocess.run(
+                self._ssh("-M", "-N", "-f",
+                          "-o", f"ControlPersist={persist}",
+                          "-o", f"ServerAliveInterval={SSH_KEEPALIVE}",
+                          "-o", "ServerAliveCountMax=3"),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, check=False, timeout=timeout)
+            started = result.returncode == 0
+        except subprocess.TimeoutExpired:
+            started = False
+        if not started:
+            self._failed_at = time.time()
+        return started
+
+    def _connect(self, timeout, restart=False):
+        """Make sure the master runs (unless it failed recently)."""
+        with self._lock:
+            if restart:
+                self._control("exit")
+                if os.path.exists(self.control_path):
+                    os.remove(self.control_path)
+            elif os.path.exists(self.control_path):
+                return True
+            if time.time() - self._failed_at < SSH_MASTER_RETRY:
+                return False
+            return self._start_master(timeout)
+
+    def run(self, command, timeout=100):
+        """
+        Run command on the target.
+
+        Returns:
+            subprocess.CompletedProcess: with text stdout and stderr
+
+        Raises:
+            subprocess.TimeoutExpired: if the command timed out
+        """
+        with self.channels:
+            deadline = time.time() + timeout
+            multiplexed = self._connect(min(timeout, SSH_MASTER_TIMEOUT))
+            result = subprocess.run(
+                self._ssh() + [command], capture_output=True, text=True,
+                check=False, timeout=max(1, deadline - time.time()))
+            if multiplexed and "Control socket connect" in result.stderr:
+                # stale socket, ssh connected directly: restart next time
+                with self._lock:
+                    if os.path.exists(self.control_path):
+                        os.remove(self.control_path)
+            # the master died before the session of the command opened:
+            # nothing ran, try again on a new master
+            if multiplexed and result.returncode == 255 \
+                    and not result.stdout \
+                    and any(e in result.stderr for e in SSH_MUX_ERRORS) \
+                    and not self._control("check") \
+                    and self._connect(
+                        min(max(1, deadline - time.time()),
+                            SSH_MASTER_TIMEOUT), restart=True):
+                result = subprocess.run(
+                    self._ssh() + [command], capture_output=True, text=True,
+                    check=False, timeout=max(1, deadline - time.time()))
+            return result
+
+    def close(self):
+        """Stop the master connection."""
+        if os.path.exists(self.control_path):
+            self._control("exit")
+
+
+_SSH_TRANSPORTS = {}  # (user, host, port) -> _SshTransport
+_SSH_TRANSPORTS_LOCK = threading.Lock()
+
+
+def get_ssh_transport(user, host, port=None, password=None, options=()):
+    """
+    Pooled transport to user@host:port; None if multiplexing is disabled
+    (CAI_SSH_MULTIPLEX=false).
+    """
+    if os.getenv("CAI_SSH_MULTIPLEX", "true").lower() == "false":
+        return None
+    with _SSH_TRANSPORTS_LOCK:
+        transport = _SSH_TRANSPORTS.get((user, host, port))
+        if transport is None:
+            transport = _SshTransport(user, host, port, password, options)
+            _SSH_TRANSPORTS[(user, host, port)] = transport
+        transport.password = password
+        transport.options = list(options)
+        return transport
+
+
+@atexit.register
+def close_ssh_transports():
+    """Stop the master connections of all the transports."""
+    with _SSH_TRANSPORTS_LOCK:
+        transports = list(_SSH_TRANSPORTS.values())
+        _SSH_TRANSPORTS.clear()
+    for transport in transports:
+        try:
+            transport.close()
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+
 def _run_ssh(command, stdout=False, timeout=100, workspace_dir=None):
     """Runs command via SSH. Assumes SSH agent or passwordless setup unless sshpass is used externally.""" # noqa E501
     ssh_user = os.environ.get('SSH_USER')
@@ -512,14 +1114,19 @@ def _run_ssh(command, stdout=False, timeout=100, workspace_dir=None):
     ssh_cmd_list.append(remote_command)
 
     try:
-        # Use subprocess.run with list of args for better security than shell=True
-        result = subprocess.run(
-            ssh_cmd_list,
-            capture_output=True,
-            text=True,
-            check=False, # Don't raise exception on non-zero exit code
-            timeout=timeout
-        )
+        transport = get_ssh_transport(ssh_user, ssh_host, password=ssh_pass)
+        if transport is not None:
+            # Reuse the connection of the previous commands
+            result = transport.run(remote_command, timeout)
+        else:
+            # Use subprocess.run with list of args for better security than shell=True
+            result = subprocess.run(
+                ssh_cmd_list,
+                capture_output=True,
+                text=True,
+                check=False, # Don't raise exception on non-zero exit code
+                timeout=timeout
+            )
         output = result.stdout if result.stdout else result.stderr
         if stdout:
             print(f"\033[32m{context_msg} $ {original_cmd_for_msg}\n{output}\033[0m") # noqa E501
@@ -547,20 +1154,13 @@ def _run_local(command, stdout=False, timeout=100, workspace_dir=None):
     target_dir = workspace_dir or _get_workspace_dir()
     original_cmd_for_msg = command # For logging
     context_msg = f"(local:{target_dir})"
+    live, on_output = _live_output(command)
     try:
-        # Use subprocess.run with shell=True carefully for local commands
-        # This allows shell features like pipes, redirection if needed in the command string # noqa E501
+        # Run through the shell, so pipes and redirections work
         # Consider security implications if command string comes from untrusted input.
-        result = subprocess.run(
-            command,
-            shell=True,  # nosec B602
-            capture_output=True,
-            text=True,
-            check=False, # Don't raise exception on non-zero exit
-            timeout=timeout,
-            cwd=target_dir # Set CWD for local process
-        )
-        output = result.stdout if result.stdout else result.stderr
+        result = stream_command(command, on_output, timeout,
+                                cwd=target_dir) # Set CWD for local process
+        output = result.output
         if stdout:
             print(f"\033[32m{context_msg} $ {original_cmd_for_msg}\n{output}\033[0m") # noqa E501
         # Return combined output, potentially including errors
@@ -575,6 +1175,342 @@ def _run_local(command, stdout=False, timeout=100, workspace_dir=None):
         error_msg = f"Error executing local command '{original_cmd_for_msg}' in '{target_dir}': {e}" # noqa E501
         print(color(error_msg, fg="red"))
         return error_msg
+    finally:
+        if live is not None:
+            live.stop()
+
+
+# Server run by _ExecWorker inside the container. Requests and replies
+# are JSON lines tagged with an id, so commands run concurrently.
+_WORKER_SCRIPT = r"""
+import json, os, signal, subprocess, sys, threading
+lock = threading.Lock()
+def kill(p):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+def drain(p, i, req, state):
+    # keep the head and tail of the output, kill the command at the cap
+    keep, stream = req["limit"] // 2, (p.stdout, p.stderr)[i]
+    for chunk in iter(lambda: stream.read1(65536), b""):
+        with state["lock"]:
+            state["sizes"][i] += len(chunk)
+            head, tail = state["bufs"][i]
+            room = max(0, keep - len(head))
+            head += chunk[:room]
+            tail += chunk[room:]
+            if len(tail) > 2 * keep:
+                del tail[:-keep]
+            over = (req["cap"] and not state["capped"]
+                    and sum(state["sizes"]) >= req["cap"])
+            if over:
+                state["capped"] = req["cap"]
+        if over:
+            kill(p)
+def part(i, req, state):
+    with state["lock"]:
+        head, tail = (bytes(b) for b in state["bufs"][i])
+        size = state["sizes"][i]
+    tail = tail[-(req["limit"] // 2):]
+    omitted = size - len(head) - len(tail)
+    while omitted and tail and tail[0] & 0xC0 == 0x80:
+        tail = tail[1:]
+        omitted += 1
+    return [head.decode(errors="ignore" if omitted else "replace"),
+            tail.decode(errors="replace"), omitted]
+def run(req):
+    res = {"id": req["id"]}
+    try:
+        os.makedirs(req["cwd"], exist_ok=True)
+        p = subprocess.Popen(["sh", "-c", req["cmd"]], cwd=req["cwd"],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, start_new_session=True)
+    except Exception as e:
+        res.update(rc=None, error=str(e))
+    else:
+        state = {"lock": threading.Lock(), "sizes": [0, 0], "capped": 0,
+                 "bufs": [[bytearray(), bytearray()] for _ in (0, 1)]}
+        readers = [threading.Thread(target=drain, args=(p, i, req, state),
+                                    daemon=True) for i in (0, 1)]
+        for reader in readers:
+            reader.start()
+        try:
+            p.wait(timeout=req["timeout"])
+        except subprocess.TimeoutExpired:
+            kill(p)
+            p.wait()
+            res["timeout"] = True
+        # children that left the process group (setsid) may keep the
+        # pipes open: answer with what was read
+        for reader in readers:
+            reader.join(1)
+        res.update(rc=p.returncode, out=part(0, req, state),
+                   err=part(1, req, state), capped=state["capped"])
+    with lock:
+        sys.stdout.write(json.dumps(res) + "\n")
+        sys.stdout.flush()
+for line in sys.stdin:
+    threading.Thread(target=run, args=(json.loads(line),), daemon=True).start()
+"""
+
+
+class _WorkerError(Exception):
+    """The exec worker of a container is not available (the command
+    was not started, it can run elsewhere)."""
+
+
+class _WorkerLost(Exception):
+    """The exec worker exited after being sent a command (the command
+    may have run, it must not run again)."""
+
+
+class _WorkerTimeout(subprocess.TimeoutExpired):
+    """A command sent to the exec worker timed out."""
+
+
+class _ExecWorker:
+    """
+    Long-lived `docker exec -i` process running commands in a container.
+
+    Running a command through the worker costs one line written to
+    its stdin, instead of starting a docker CLI process and an exec
+    (twice, with the mkdir of the workspace) per command. The worker
+    needs python3 in the container; if it cannot start or dies, calls
+    raise _WorkerError and run_command falls back to plain docker exec.
+    Once a command was sent, it is never run a second time: a timeout
+    or the end of the worker is reported instead.
+    """
+
+    # Seconds a reply may take after the timeout of its command
+    REPLY_GRACE = 10
+
+    def __init__(self, container_id):
+        self.container_id = container_id
+        self._ids = itertools.count()
+        self._pending = {}  # request id -> callback(reply, error)
+        self._lock = threading.Lock()
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            ["docker", "exec", "-i", container_id,
+             "python3", "-u", "-c", _WORKER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        threading.Thread(target=self._read_replies, daemon=True,
+                         name=f"cai-exec-{container_id[:12]}").start()
+
+    @property
+    def alive(self):
+        """Whether the worker process is running."""
+        return self.process.poll() is None
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            with self._lock:
+                callback = self._pending.pop(reply.get("id"), None)
+            if callback:
+                callback(reply, None)
+        # the worker exited: fail whatever is still waiting
+        self.process.wait()
+        error = _WorkerError(
+            f"exec worker of {self.container_id[:12]} exited: "
+            + self.process.stderr.read().decode(errors="replace").strip())
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for callback in pending.values():
+            callback(None, error)
+
+    def submit(self, command, cwd, timeout, callback):
+        """
+        Send a command; callback(reply, error) gets its result.
+
+        Returns:
+            int: id of the request
+
+        Raises:
+            _WorkerError: if the command could not be sent
+        """
+        request_id = next(self._ids)
+        limit, cap = _output_limits()
+        line = json.dumps({"id": request_id, "cmd": command, "cwd": cwd,
+                           "timeout": timeout, "limit": limit,
+                           "cap": cap}) + "\n"
+        with self._lock:
+            if not self.alive:
+                raise _WorkerError(
+                    f"exec worker of {self.container_id[:12]} is not running")
+            self._pending[request_id] = callback
+            try:
+                self.process.stdin.write(line.encode())
+                self.process.stdin.flush()
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                raise _WorkerError(str(e)) from e
+        return request_id
+
+    def _forget(self, request_id):
+        """Drop a request that is no longer waited for."""
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def run(self, command, cwd, timeout):
+        """
+        Run command in cwd.
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+
+        Raises:
+            _WorkerTimeout: if the command timed out
+            _WorkerError: if the worker is not available
+            _WorkerLost: if the worker exited while running the command
+        """
+        done = threading.Event()
+        result = []
+
+        def callback(reply, error):
+            result.append((reply, error))
+            done.set()
+        request_id = self.submit(command, cwd, timeout, callback)
+        # the worker kills the command on timeout; allow for the reply
+        if not done.wait(timeout + self.REPLY_GRACE):
+            self._forget(request_id)
+            raise _WorkerTimeout(command, timeout)
+        return self._result(command, timeout, *result[0])
+
+    async def arun(self, command, cwd, timeout):
+        """Async counterpart of run."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def callback(reply, error):
+            loop.call_soon_threadsafe(
+                lambda: future.done() or future.set_result((reply, error)))
+        request_id = self.submit(command, cwd, timeout, callback)
+        try:
+            reply, error = await asyncio.wait_for(future, timeout + self.REPLY_GRACE)
+        except asyncio.TimeoutError as e:
+            self._forget(request_id)
+            raise _WorkerTimeout(command, timeout) from e
+        return self._result(command, timeout, reply, error)
+
+    @staticmethod
+    def _result(command, timeout, reply, error):
+        if error is not None:
+            raise _WorkerLost(str(error))
+        if reply.get("rc") is None:  # the command could not be started
+            raise _WorkerError(reply.get("error", "no exit code"))
+        out, err = _join_output(*reply["out"]), _join_output(*reply["err"])
+        if reply.get("timeout"):
+            raise _WorkerTimeout(command, timeout, output=out)
+        if reply.get("capped"):
+            out, err = (text + _cap_note(reply["capped"])
+                        for text in (out, err))
+        return reply["rc"], out, err
+
+    def close(self):
+        """Stop the worker (commands still running are failed)."""
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+
+
+_EXEC_WORKERS = {}  # container id -> _ExecWorker
+_EXEC_WORKERS_LOCK = threading.Lock()
+# Seconds before trying again to start a worker in a container where
+# it failed (e.g. no python3)
+EXEC_WORKER_RETRY = 300
+_EXEC_WORKER_FAILED = {}  # container id -> time of the failure
+
+
+def _get_exec_worker(container_id):
+    """Worker of the container, started on first use; None if workers
+    are disabled (CAI_CONTAINER_WORKER=false) or failed recently."""
+    if os.getenv("CAI_CONTAINER_WORKER", "true").lower() == "false":
+        return None
+    with _EXEC_WORKERS_LOCK:
+        worker = _EXEC_WORKERS.get(container_id)
+        if worker is not None:
+            if worker.alive:
+                return worker
+            del _EXEC_WORKERS[container_id]
+            _EXEC_WORKER_FAILED[container_id] = time.time()
+        if time.time() - _EXEC_WORKER_FAILED.get(container_id, 0) \
+                < EXEC_WORKER_RETRY:
+            return None
+        try:
+            worker = _ExecWorker(container_id)
+        except OSError:
+            _EXEC_WORKER_FAILED[container_id] = time.time()
+            return None
+        _EXEC_WORKERS[container_id] = worker
+        return worker
+
+
+def _exec_worker_failed(container_id, error):
+    """Stop using the worker of a container after error."""
+    with _EXEC_WORKERS_LOCK:
+        worker = _EXEC_WORKERS.pop(container_id, None)
+        _EXEC_WORKER_FAILED[container_id] = time.time()
+    if worker is not None:
+        worker.close()
+    if os.getenv("CAI_DEBUG", "1") == "2":
+        print(color(f"{error}. Using docker exec per command.", fg="yellow"))
+
+
+def _worker_failure(error, command, context_msg, stdout=False):
+    """Message for a command that timed out or was lost in the exec
+    worker (see _ExecWorker)."""
+    if isinstance(error, _WorkerTimeout):
+        if stdout:
+            print(f"\033[33m{context_msg} $ {command}\nTIMEOUT\033[0m") # noqa E501
+        return ("Timeout executing command in container: "
+                f"{error.output or error}")
+    error_msg = f"Error executing command in container: {error}"
+    print(color(f"{context_msg} {error_msg}", fg="red"))
+    return error_msg
+
+
+def _docker_exec(container_id, command, container_workspace, timeout):
+    """
+    Run command in the container workspace, through the exec worker
+    of the container if possible, else with docker exec.
+
+    Returns:
+        tuple: (returncode, stdout, stderr)
+
+    Raises:
+        subprocess.TimeoutExpired: if the command timed out
+        _WorkerTimeout, _WorkerLost: if the command timed out or the
+            worker exited once the command was sent to it
+    """
+    worker = _get_exec_worker(container_id)
+    if worker is not None:
+        try:
+            return worker.run(command, container_workspace, timeout)
+        except _WorkerError as e:
+            _exec_worker_failed(container_id, e)
+        except _WorkerLost as e:
+            _exec_worker_failed(container_id, e)
+            raise
+    # Ensure container workspace exists (best effort)
+    # Consider moving this to workspace set/container activation
+    mkdir_cmd = ["docker", "exec", container_id, "mkdir", "-p", container_workspace] # noqa E501
+    subprocess.run(mkdir_cmd, capture_output=True, text=True, check=False, timeout=10) # noqa E501
+
+    # Construct the docker exec command with workspace context
+    cmd_list = [
+        "docker", "exec",
+        "-w", container_workspace, # Set working directory
+        container_id,
+        "sh", "-c", command # Execute command via shell
+    ]
+    result = stream_command(cmd_list, timeout=timeout)
+    return result.returncode, result.text("stdout"), result.text("stderr")
 
 
 def run_command(command: str, ctf=None, stdout: bool = False,
@@ -630,47 +1566,34 @@ def run_command(command: str, ctf=None, stdout: bool = False,
                  return new_session_id
             if stdout:
                 # Wait a moment for initial output
-                time.sleep(0.2)
+                ACTIVE_SESSIONS[new_session_id].wait_for_output(0.2)
                 output = get_session_output(new_session_id, clear=False)
                 print(f"\033[32m(Started Session {new_session_id} in {context_msg})\n{output}\033[0m") # noqa E501
             return f"Started async session {new_session_id} in container {container_id[:12]}. Use this ID to interact." # noqa E501
 
         # Handle Synchronous Execution in Container
         try:
-            # Ensure container workspace exists (best effort)
-            # Consider moving this to workspace set/container activation
-            mkdir_cmd = ["docker", "exec", container_id, "mkdir", "-p", container_workspace] # noqa E501
-            subprocess.run(mkdir_cmd, capture_output=True, text=True, check=False, timeout=10) # noqa E501
-
-            # Construct the docker exec command with workspace context
-            cmd_list = [
-                "docker", "exec",
-                "-w", container_workspace, # Set working directory
-                container_id,
-                "sh", "-c", command # Execute command via shell
-            ]
-            result = subprocess.run(
-                cmd_list,
-                capture_output=True,
-                text=True,
-                check=False, # Don't raise exception on non-zero exit
-                timeout=timeout
-            )
+            returncode, out, err = _docker_exec(
+                container_id, command, container_workspace, timeout)
 
-            output = result.stdout if result.stdout else result.stderr
+            output = out if out else err
             output = output.strip() # Clean trailing newline
 
             if stdout:
                 print(f"\033[32m{context_msg} $ {command}\n{output}\033[0m") # noqa E501
 
             # Check if command failed specifically because container isn't running
-            if result.returncode != 0 and "is not running" in result.stderr:
+            if returncode != 0 and "is not running" in err:
                 print(color(f"{context_msg} Container is not running. Attempting execution on host instead.", fg="yellow")) # noqa E501
                  # Fallback to local execution, preserving workspace context
                 return _run_local(command, stdout, timeout, _get_workspace_dir()) # noqa E501
 
             return output # Return combined stdout/stderr
 
+        except (_WorkerTimeout, _WorkerLost) as e:
+            # The command was sent to the exec worker: running it again
+            # (on the host) could repeat its side effects
+            return _worker_failure(e, command, context_msg, stdout)
         except subprocess.TimeoutExpired:
             timeout_msg = "Timeout executing command in container."
             if stdout:
@@ -713,7 +1636,8 @@ def run_command(command: str, ctf=None, stdout: bool = False,
         session = ACTIVE_SESSIONS.get(new_session_id)
         actual_workspace = session.workspace_dir if session else "unknown"
         if stdout:
-            time.sleep(0.2) # Allow session buffer to populate
+            if session:  # Allow session buffer to populate
+                session.wait_for_output(0.2)
             output = get_session_output(new_session_id, clear=False)
             print(f"\033[32m(Started Session {new_session_id} in local:{actual_workspace})\n{output}\033[0m") # noqa E501
         return f"Started async session {new_session_id} locally. Use this ID to interact." # noqa E501
@@ -721,6 +1645,191 @@ def run_command(command: str, ctf=None, stdout: bool = False,
     # Handle Synchronous Execution Locally using _run_local default
     return _run_local(command, stdout, timeout)
 
+
+async def _apipe():
+    """
+    Pipe for the output of a subprocess, read through asyncio.
+
+    Returns:
+        tuple: (StreamReader, its transport, write end fd for the child)
+    """
+    read_fd, write_fd = os.pipe()
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(read_fd, "rb", 0))
+    return reader, transport, write_fd
+
+
+async def _arun_subprocess(args, timeout=100, cwd=None, on_output=None):
+    """
+    Run args as a subprocess without blocking the event loop.
+
+    Async counterpart of stream_command: output is handed over to
+    on_output as it is produced, and captured and capped the same way.
+
+    Returns:
+        tuple: (returncode, stdout, stderr) with both streams decoded
+
+    Raises:
+        subprocess.TimeoutExpired: if the process exceeds timeout, with
+            the output read so far; it is killed before raising
+    """
+    limit, cap = _output_limits()
+    captures = {"stdout": OutputCapture(limit), "stderr": OutputCapture(limit)}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")("replace")
+                for name in captures}
+    pipes = {name: await _apipe() for name in captures}
+    capped = []
+    start = time.time()
+    process = None
+
+    def close_pipes():
+        # writers left in a pipeline die of SIGPIPE, and the readers
+        # see the end of the output
+        for _, transport, _ in pipes.values():
+            transport.close()
+
+    async def drain(name):
+        reader, capture = pipes[name][0], captures[name]
+        chunk = await reader.read(65536)
+        while chunk and not capped:
+            capture.write(chunk)
+            text = decoders[name].decode(chunk)
+            if on_output and text:
+                on_output(name, text)
+            if cap and sum(c.size for c in captures.values()) >= cap:
+                capped.append(cap)
+                process.kill()
+                close_pipes()
+            chunk = await reader.read(65536)
+
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=pipes["stdout"][2], stderr=pipes["stderr"][2],
+                cwd=cwd)
+        finally:
+            for _, _, write_fd in pipes.values():
+                os.close(write_fd)
+        await asyncio.wait_for(asyncio.gather(
+            drain("stdout"), drain("stderr"), process.wait()), timeout)
+    except asyncio.TimeoutError as e:
+        raise subprocess.TimeoutExpired(
+            args, timeout, output=captures["stdout"].text(),
+            stderr=captures["stderr"].text()) from e
+    finally:
+        close_pipes()
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+    result = CommandResult(process.returncode, captures, time.time() - start,
+                           capped[0] if capped else 0)
+    return (result.returncode, result.text("stdout"),
+            result.text("stderr"))
+
+
+async def _arun_local(command, stdout=False, timeout=100, workspace_dir=None):
+    """Async counterpart of _run_local."""
+    target_dir = workspace_dir or _get_workspace_dir()
+    context_msg = f"(local:{target_dir})"
+    live, on_output = _live_output(command)
+    try:
+        _, out, err = await _arun_subprocess(
+            ["/bin/sh", "-c", command], timeout, cwd=target_dir,
+            on_output=on_output)
+        output = out if out else err
+        if stdout:
+            print(f"\033[32m{context_msg} $ {command}\n{output}\033[0m") # noqa E501
+        return output.strip()
+    except subprocess.TimeoutExpired as e:
+        error_output = e.stdout if e.stdout else str(e)
+        timeout_msg = f"Timeout executing local command: {error_output}"
+        if stdout:
+            print(f"\033[33m{context_msg} $ {command}\nTIMEOUT\n{error_output}\033[0m") # noqa E501
+        return timeout_msg
+    except Exception as e:  # pylint: disable=broad-except
+        error_msg = f"Error executing local command '{command}' in '{target_dir}': {e}" # noqa E501
+        print(color(error_msg, fg="red"))
+        return error_msg
+    finally:
+        if live is not None:
+            live.stop()
+
+
+async def _arun_docker(container_id, command, stdout=False, timeout=100):
+    """Async counterpart of the container branch of run_command."""
+    container_workspace = _get_container_workspace_path()
+    context_msg = f"(docker:{container_id[:12]}:{container_workspace})"
+    try:
+        worker = _get_exec_worker(container_id)
+        try:
+            if worker is None:
+                raise _WorkerError("no exec worker")
+            returncode, out, err = await worker.arun(
+                command, container_workspace, timeout)
+        except (_WorkerTimeout, _WorkerLost) as e:
+            if isinstance(e, _WorkerLost):
+                _exec_worker_failed(container_id, e)
+            # no fallback: the worker already ran the command
+            return _worker_failure(e, command, context_msg, stdout)
+        except _WorkerError as e:
+            if worker is not None:
+                _exec_worker_failed(container_id, e)
+            # Ensure container workspace exists (best effort)
+            await _arun_subprocess(
+                ["docker", "exec", container_id, "mkdir", "-p",
+                 container_workspace], 10)
+            returncode, out, err = await _arun_subprocess(
+                ["docker", "exec", "-w", container_workspace, container_id,
+                 "sh", "-c", command], timeout)
+        output = (out if out else err).strip()
+
+        if stdout:
+            print(f"\033[32m{context_msg} $ {command}\n{output}\033[0m") # noqa E501
+
+        if returncode != 0 and "is not running" in err:
+            print(color(f"{context_msg} Container is not running. Attempting execution on host instead.", fg="yellow")) # noqa E501
+            return await _arun_local(command, stdout, timeout, _get_workspace_dir()) # noqa E501
+        return output
+
+    except subprocess.TimeoutExpired:
+        if stdout:
+            print(f"\033[33m{context_msg} $ {command}\nTIMEOUT\033[0m") # noqa E501
+            print(color("Attempting execution on host instead.", fg="yellow"))
+        return await _arun_local(command, stdout, timeout, _get_workspace_dir()) # noqa E501
+    except Exception as e:  # pylint: disable=broad-except
+        error_msg = f"Error executing command in container: {str(e)}"
+        print(color(f"{context_msg} {error_msg}", fg="red"))
+        print(color("Attempting execution on host instead.", fg="yellow"))
+        return await _arun_local(command, stdout, timeout, _get_workspace_dir()) # noqa E501
+
+
+async def arun_command(command: str, ctf=None, stdout: bool = False,
+                       async_mode: bool = False,
+                       session_id: Optional[str] = None,
+                       timeout: int = 100) -> str:
+    """
+    Async counterpart of run_command, for tools awaited by CAI.arun.
+
+    Local and container commands run as asyncio subprocesses, so
+    concurrent tool calls do not tie up a thread each. Sessions, CTF
+    and SSH environments (and async_mode) go through run_command in a
+    worker thread.
+
+    Returns:
+        str: Command output, status message, or session ID.
+    """
+    active_container = os.getenv("CAI_ACTIVE_CONTAINER", "")
+    is_ssh_env = all(os.getenv(var) for var in ['SSH_USER', 'SSH_HOST'])
+    if session_id or async_mode or ctf or is_ssh_env:
+        return await asyncio.to_thread(
+            run_command, command, ctf=ctf, stdout=stdout,
+            async_mode=async_mode, session_id=session_id, timeout=timeout)
+    if active_container:
+        return await _arun_docker(active_container, command, stdout, timeout)
+    return await _arun_local(command, stdout, timeout)
+
 # Example Usage (for testing purposes)
 # if __name__ == '__main__':
 #     print("Testing Local Execution:")
@@ -0,0 +1,180 @@
+"""
+Spill store for oversized tool outputs.
+
+Tool outputs longer than CAI.max_chars_per_message do not fit in the
+prompt. Instead of dropping their middle, the full output is written
+to a per-session, content-addressed store under the workspace
+(.cai/spill/<session>/<handle>) and the model gets a head/tail preview
+plus the handle. The read_tool_output tool then pages through, greps
+or reads byte ranges of the spilled output, so the agent does not
+need to re-run expensive commands to see the rest.
+
+Spilling is enabled by default; set CAI_SPILL_TOOL_OUTPUT=false to
+truncate outputs instead.
+"""
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+from cai.tools.common import _get_workspace_dir
+
+# Bytes returned per read_tool_output call at most
+MAX_READ = 16000
+MAX_MATCHES = 200
+
+
+class SpillStore:
+    """Content-addressed store of the tool outputs of one session."""
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.sizes = {}  # handle -> size in bytes
+        self._directory = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Whether oversized outputs are spilled (CAI_SPILL_TOOL_OUTPUT)."""
+        return os.getenv("CAI_SPILL_TOOL_OUTPUT",
+                         "true").lower() != "false"
+
+    @property
+    def directory(self):
+        """Directory of the session, created on first use."""
+        if self._directory is None:
+            workspace = _get_workspace_dir()
+            if workspace == "/":  # CTF_INSIDE
+                workspace = os.getcwd()
+            directory = os.path.join(workspace, ".cai", "spill",
+                                     self.session_id)
+            os.makedirs(directory, exist_ok=True)
+            self._directory = directory
+        return self._directory
+
+    def path(self, handle):
+        """Path of a spilled output, or None for an unknown handle."""
+        if not re.fullmatch(r"[0-9a-f]{16}", handle or ""):
+            return None
+        path = os.path.join(self.directory, handle)
+        return path if os.path.exists(path) else None
+
+    def put(self, output):
+        """
+        Store output and return its handle.
+
+        Identical outputs share one file, so spilling the same output
+        again costs nothing.
+        """
+        data = output.encode("utf-8", errors="replace")
+        handle = hashlib.sha256(data).hexdigest()[:16]
+        with self._lock:
+            if handle not in self.sizes:
+                path = os.path.join(self.directory, handle)
+                if not os.path.exists(path):
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                self.sizes[handle] = len(data)
+        return handle
+
+    def preview(self, output, max_chars):
+        """
+        Shorten output to about max_chars characters for the prompt.
+
+        The head and tail of output are kept. If spilling is enabled
+        (and works), the full output is stored and a note with its
+        handle replaces the middle; otherwise the middle is dropped.
+        """
+        half_len = max_chars // 2
+        head, tail = output[:half_len], output[-half_len:]
+        if not self.enabled:
+            return head + tail
+        try:
+            handle = self.put(output)
+        except OSError:
+            return head + tail
+        omitted = output[half_len:-half_len]
+        return (f"{head}\n\n[... {len(omitted)} characters "
+                f"({omitted.count(chr(10))} lines) omitted. Full output "
+                f"({self.sizes[handle]} bytes) saved as handle "
+                f"'{handle}': call read_tool_output(handle='{handle}', "
+                "...) to page, grep or read byte ranges of it ...]\n\n"
+                f"{tail}")
+
+
+# Create a global instance of SpillStore
+spill_store = SpillStore()
+
+
+def read_tool_output(handle: str, offset: int = 0, length: int = 4000,
+                     page: int = -1, pattern: str = "",
+                     context: int = 0) -> str:
+    """
+    Read a tool output that was too long to show in full.
+
+    Long outputs are replaced by a preview that names a handle. Use
+    this tool with that handle instead of running the command again.
+    Its result is never shortened into another handle: each call
+    returns at most 16000 bytes (a range, or the matching lines of
+    pattern), in full.
+
+    Args:
+        handle: Handle given in the preview of the output
+        offset: Byte offset to start reading at
+        length: Number of bytes to read (max 16000)
+        page: If >= 0, read page number page of length bytes
+            instead of starting at offset
+        pattern: If set, return the lines matching this regular
+            expression (with their line numbers) instead of a range
+        context: Lines of context around each match of pattern
+
+    Returns:
+        str: The requested part of the output, after a header with
+            its position in the full output
+    """
+    path = spill_store.path(handle)
+    if path is None:
+        return f"Error: unknown tool output handle '{handle}'"
+    size = os.path.getsize(path)
+    length = max(1, min(int(length), MAX_READ))
+
+    if pattern:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            return f"Error: invalid pattern '{pattern}': {e}"
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+        matches = [i for i, line in enumerate(lines) if regex.search(line)]
+        shown, out, used = set(), [], 0
+        for i in matches[:MAX_MATCHES]:
+            for j in range(max(0, i - context),
+                           min(len(lines), i + context + 1)):
+                if j in shown:
+                    continue
+                shown.add(j)
+                line = f"{j + 1}:{lines[j]}"
+                used += len(line) + 1
+                if used > MAX_READ:
+                    break
+                out.append(line)
+        header = (f"[{handle}: {len(matches)} lines of {len(lines)} match "
+                  f"'{pattern}'"
+                  + (", output cut" if used > MAX_READ or
+                     len(matches) > MAX_MATCHES else "") + "]")
+        return "\n".join([header, *out])
+
+    if page >= 0:
+        offset = page * length
+    offset = max(0, min(int(offset), size))
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    end = offset + len(data)
+    header = (f"[{handle}: bytes {offset}-{end} of {size}"
+              + (f", next page {end // length}" if end < size and page >= 0
+                 else "") + "]")
+    return header + "\n" + data.decode("utf-8", errors="replace")
@@ -27,6 +27,7 @@ def generic_linux_command(command: str = "",
            → Returns session ID
          - List: generic_linux_command("session", "list")
          - Get output: generic_linux_command("session", "output <id>")
+           → Returns the output since the last "output" call
          - Send input: Use session_id parameter
          - End: generic_linux_command("session", "kill <id>")
 
@@ -79,3 +79,148 @@ class Result(BaseModel):  # pylint: disable=too-few-public-methods
     value: str = ""
     agent: Optional[Agent] = None
     context_variables: dict = {}
+
+
+class ReadOnlyError(TypeError):
+    """Raised on any attempt to modify a FrozenDict or FrozenList."""
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict, e.g. for cached tool schemas and conversation
+    records.
+
+    It is still a dict, so it can be serialized and sent as-is, but
+    any attempt to modify it raises ReadOnlyError. Deep copies are
+    plain, mutable dicts (and lists), for callers that need to modify
+    them.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise ReadOnlyError(f"{type(self).__name__} is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (dict, (thaw(self),))
+
+
+class FrozenList(list):
+    """Read-only list, the list counterpart of FrozenDict."""
+
+    _readonly = FrozenDict._readonly
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = _readonly
+    sort = reverse = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (list, (thaw(self),))
+
+
+def freeze(value):
+    """Recursively turn dicts into FrozenDicts and lists (or tuples)
+    into FrozenLists."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Inverse of freeze: plain, mutable dicts and lists."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+class MessageRecord(FrozenDict):
+    """
+    A message of a ConversationLog.
+
+    Records never change once created, so they are shared (never
+    copied) between logs, forks and Responses, and values derived
+    from them (e.g. token counts) are computed once. Nested values
+    such as tool_calls are frozen too (see freeze), so any attempt to
+    modify a record raises ReadOnlyError. Send deep copies, e.g.
+    thaw(record), to code that rewrites messages.
+    """
+
+    @classmethod
+    def of(cls, message):
+        """
+        Record of message, which may be a dict, a pydantic model
+        (e.g. a litellm Message) or already a record.
+        """
+        if isinstance(message, cls):
+            return message
+        if isinstance(message, BaseModel):
+            # plain JSON types, not OpenAI/litellm objects
+            message = message.model_dump(mode="json")
+        return cls((k, freeze(v)) for k, v in message.items())
+
+    def cached(self, key, compute):
+        """Return compute(self), computed once per key."""
+        derived = self.__dict__.setdefault("_derived", {})
+        if key not in derived:
+            derived[key] = compute(self)
+        return derived[key]
+
+
+class ConversationLog(list):
+    """
+    History of a conversation: a list of MessageRecords.
+
+    Messages are turned into records as they are added, so the log
+    only holds immutable messages and forking it copies pointers,
+    not messages. A fork is isolated from its parent like a deep
+    copy would be: adding, removing or replacing messages in one
+    does not affect the other.
+    """
+
+    def __init__(self, messages=()):
+        super().__init__(MessageRecord.of(m) for m in messages)
+
+    def append(self, message):
+        super().append(MessageRecord.of(message))
+
+    def extend(self, messages):
+        super().extend(MessageRecord.of(m) for m in messages)
+
+    def insert(self, index, message):
+        super().insert(index, MessageRecord.of(message))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [MessageRecord.of(m) for m in value]
+        else:
+            value = MessageRecord.of(value)
+        super().__setitem__(index, value)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def fork(self):
+        """Return an independent log with the same messages."""
+        log = ConversationLog()
+        list.extend(log, self)
+        return log
+
+    copy = __copy__ = fork
@@ -9,15 +9,21 @@ import time
 import json
 import os
 import re
+import threading
+import weakref
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Any, Callable, Type, Literal
 import importlib.resources
 import pathlib
 
 # Third-party imports
+import litellm  # pylint: disable=import-error
 from litellm.types.utils import Message  # pylint: disable=import-error
 from rich.box import ROUNDED  # pylint: disable=import-error
 from rich.console import Console, Group  # pylint: disable=import-error
+from rich.errors import LiveError  # pylint: disable=import-error
+from rich.live import Live  # pylint: disable=import-error
 from rich.panel import Panel  # pylint: disable=import-error
 from rich.pretty import install as install_pretty  # pylint: disable=import-error # noqa: 501
 from rich.text import Text  # pylint: disable=import-error
@@ -30,7 +36,8 @@ from wasabi import color  # pylint: disable=import-error
 from cai.graph import Node, get_default_graph
 from cai.types import (
     Agent,
-    ChatCompletionMessageToolCall
+    ChatCompletionMessageToolCall,
+    freeze
 )
 
 # Global timing variables
@@ -125,7 +132,14 @@ def get_model_input_tokens(model):
     """
     Get the number of input tokens for
     max context window capacity for a given model.
+
+    Uses the limit in litellm's model map when the model is listed
+    there and falls back to a per-family default otherwise.
     """
+    max_input_tokens = litellm.model_cost.get(model, {}).get(
+        "max_input_tokens")
+    if max_input_tokens:
+        return max_input_tokens
     model_tokens = {
         "gpt": 128000,
         "o1": 200000,
@@ -140,6 +154,71 @@ def get_model_input_tokens(model):
     return model_tokens["gpt"]
 
 
+
+def estimate_message_tokens(model, message):
+    """
+    Estimate the prompt tokens taken by a single message.
+
+    Uses litellm's tokenizer for the model (tiktoken unless litellm
+    knows a better one) and falls back to about four characters per
+    token if the message cannot be tokenized.
+    """
+    try:
+        return litellm.token_counter(model=model, messages=[message])
+    except Exception:  # pylint: disable=broad-except
+        return len(json.dumps(message, default=str)) // 4 + 4
+
+
+def fit_messages(messages, token_counts, budget, keep_first=1):
+    """
+    Drop the oldest messages until the prompt fits a token budget.
+
+    The first keep_first messages (e.g. the task) are always kept, and
+    so is the most recent exchange. An assistant message with
+    tool_calls and the tool messages answering it are dropped
+    together, so no tool call is left without its result or vice
+    versa. A short note takes the place of the dropped messages.
+
+    Args:
+        messages: Messages to send, without the system prompt
+        token_counts: Estimated tokens of each message
+        budget: Tokens available for these messages
+        keep_first: Number of leading messages never dropped
+
+    Returns:
+        list: The messages to send; messages itself if nothing was
+            dropped
+    """
+    total = sum(token_counts)
+    if total <= budget:
+        return messages
+
+    # Group each tool call with its results
+    groups = []
+    i = keep_first
+    while i < len(messages):
+        j = i + 1
+        if messages[i].get("tool_calls"):
+            while j < len(messages) and messages[j].get("role") == "tool":
+                j += 1
+        groups.append((i, j))
+        i = j
+
+    start = keep_first
+    for group_start, group_end in groups[:-1]:
+        if total <= budget:
+            break
+        total -= sum(token_counts[group_start:group_end])
+        start = group_end
+    if start == keep_first:
+        return messages
+    note = {
+        "role": "user",
+        "content": (f"[{start - keep_first} earlier messages were "
+                    "omitted to fit the context window]"),
+    }
+    return messages[:keep_first] + [note] + messages[start:]
+
 theme = Theme({
     # Primary colors - Material Design inspired
     "timestamp": "#00BCD4",  # Cyan 500
@@ -1130,24 +1209,126 @@ def debug_print(debug: int, intro: str, *args: Any, brief: bool = False, colours
 def merge_fields(target, source):
     """
     Merge fields from source into target.
+
+    String values are concatenated (missing keys start empty) and
+    nested dicts are merged recursively. None values are ignored.
     """
     for key, value in source.items():
         if isinstance(value, str):
-            target[key] += value
+            target[key] = target.get(key, "") + value
         elif value is not None and isinstance(value, dict):
-            merge_fields(target[key], value)
+            merge_fields(target.setdefault(key, {}), value)
 
 
 def merge_chunk(final_response: dict, delta: dict) -> None:
     """
     Merge fields from delta into final_response.
+
+    Tool call fragments are merged into
+    final_response["tool_calls"][index] using the
+    ``index`` each fragment carries, so interleaved
+    or multiple fragments per delta are assembled
+    into the right call.
     """
     delta.pop("role", None)
+    tool_calls = delta.pop("tool_calls", None)
     merge_fields(final_response, delta)
-    tool_calls = delta.get("tool_calls")
-    if tool_calls and len(tool_calls) > 0:
-        index = tool_calls[0].pop("index")
-        merge_fields(final_response["tool_calls"][index], tool_calls[0])
+    for tool_call in tool_calls or []:
+        index = tool_call.pop("index", 0) or 0
+        merge_fields(final_response["tool_calls"][index], tool_call)
+
+
+def cli_stream_display(agent_name, model, debug):
+    """
+    Create a transient live display that renders streamed
+    assistant content as it arrives.
+
+    The display is cleared once the stream is complete so that
+    the regular agent panel (with token and cost details) is
+    printed afterwards without duplicating the content.
+
+    Returns:
+        rich.live.Live or None if CLI output is disabled
+    """
+    if debug != 2:  # same condition as cli_print_agent_messages
+        return None
+    live = Live(
+        _stream_panel(agent_name, model, ""),
+        console=console,
+        transient=True,
+        refresh_per_second=12,
+    )
+    live.start()
+    return live
+
+
+def cli_update_stream_display(live, agent_name, model, content):
+    """Refresh a display created by cli_stream_display."""
+    if live is None:
+        return
+    live.update(_stream_panel(agent_name, model, content))
+
+
+def _stream_panel(agent_name, model, content, max_lines=20):
+    """Panel with the tail of the streamed content."""
+    text = Text()
+    text.append(f"Agent: {agent_name} ", style="bold green")
+    text.append(f"({model})", style="bold magenta")
+    lines = content.splitlines()[-max_lines:]
+    if lines:
+        text.append("\n" + "\n".join(lines), style="yellow")
+    return Panel(
+        text,
+        border_style="blue",
+        box=ROUNDED,
+        padding=(0, 1),
+        title="[bold]Agent Interaction (streaming)[/bold]",
+        title_align="left"
+    )
+
+
+def cli_command_display(command):
+    """
+    Create a transient live display of the output of a running
+    command (see cai.tools.common.stream_command).
+
+    Returns:
+        rich.live.Live or None if another live display (a streamed
+        completion, or a command running in parallel) is active
+    """
+    live = Live(
+        _command_panel(command, ""),
+        console=console,
+        transient=True,
+        refresh_per_second=8,
+    )
+    try:
+        live.start()
+    except LiveError:
+        return None
+    return live
+
+
+def cli_update_command_display(live, command, content):
+    """Refresh a display created by cli_command_display."""
+    live.update(_command_panel(command, content))
+
+
+def _command_panel(command, content, max_lines=15):
+    """Panel with the tail of the output of a running command."""
+    text = Text()
+    text.append(f"$ {command}", style="bold cyan")
+    lines = content.splitlines()[-max_lines:]
+    if lines:
+        text.append("\n" + "\n".join(lines), style="green")
+    return Panel(
+        text,
+        border_style="blue",
+        box=ROUNDED,
+        padding=(0, 1),
+        title="[bold]Tool Execution (running)[/bold]",
+        title_align="left"
+    )
 
 
 def function_to_json(
@@ -1367,6 +1548,77 @@ def function_to_json(
     else:
         raise ValueError(f"Unsupported format: '{format}'. Choose 'gemini' or 'original'.")
 
+
+# Schemas per function and provider, dropped with the function
+_FUNCTION_SCHEMAS = weakref.WeakKeyDictionary()
+# Ready-to-send tool lists per (provider, functions), most recent last
+_TOOL_LISTS = OrderedDict()
+_TOOL_LISTS_MAX = 64
+_TOOL_SCHEMA_LOCK = threading.Lock()
+
+
+def _build_tool_schema(func, provider):
+    tool = function_to_json(func)
+    if provider == "gemini":
+        tool["function"]["name"] = tool["function"].get(
+            "name", "").replace("-", "_")
+    # Hide context_variables from model
+    params = tool["function"]["parameters"]
+    params["properties"].pop("context_variables", None)
+    if "context_variables" in params["required"]:
+        params["required"].remove("context_variables")
+    return freeze(tool)
+
+
+def _get_tool_schema(func, provider):
+    try:
+        per_provider = _FUNCTION_SCHEMAS.get(func)
+    except TypeError:  # not weak-referenceable, do not cache
+        return _build_tool_schema(func, provider)
+    if per_provider is None:
+        per_provider = {}
+        _FUNCTION_SCHEMAS[func] = per_provider
+    schema = per_provider.get(provider)
+    if schema is None:
+        schema = per_provider[provider] = _build_tool_schema(func, provider)
+    return schema
+
+
+def get_tool_schemas(
+    functions,
+    provider: Literal['default', 'gemini'] = 'default'
+) -> tuple:
+    """
+    Return the tool schemas sent to the model for a list of functions.
+
+    Schemas are built with function_to_json once per function and
+    provider, and whole tool lists are cached by the identity of the
+    functions in them, so a changed agent.functions (e.g. MCP tools
+    added or removed with /mcp) simply maps to a new entry.
+
+    Args:
+        functions: The agent functions; non-callables are skipped
+        provider: 'gemini' replaces '-' with '_' in tool names
+
+    Returns:
+        A tuple of read-only tool dicts (see cai.types.FrozenDict). The
+        tuple is shared between calls and must not be modified; deep
+        copy it if a mutable version is needed.
+    """
+    functions = tuple(f for f in functions if callable(f))
+    key = (provider, tuple(map(id, functions)))
+    with _TOOL_SCHEMA_LOCK:
+        cached = _TOOL_LISTS.get(key)
+        if cached is not None:
+            _TOOL_LISTS.move_to_end(key)
+            return cached[1]
+        tools = tuple(_get_tool_schema(f, provider) for f in functions)
+        # keeping the functions alive keeps their ids from being reused
+        _TOOL_LISTS[key] = (functions, tools)
+        if len(_TOOL_LISTS) > _TOOL_LISTS_MAX:
+            _TOOL_LISTS.popitem(last=False)
+        return tools
+
 def check_flag(output, ctf, challenge=None):
     """
     Check if the CTF flag is present in the output.
@@ -1508,7 +1760,8 @@ def fix_message_list(messages):  # pylint: disable=R0914,R0915,R0912
             for j, tc in enumerate(msg["tool_calls"]):
                 if j not in removal_assistant_entries.get(i, set()):
                     new_tool_calls.append(tc)
-            msg["tool_calls"] = new_tool_calls
+            # copy instead of modifying messages owned by the caller
+            msg = {**msg, "tool_calls": new_tool_calls}
         # If after modification message has no content and no tool_calls,
         # discard it
         msg_content = msg.get("content")
@@ -1559,12 +1812,15 @@ def create_graph_from_history(history):
             agent=agent,
             turn=turn,
             message=Message(**message),
-            history=history[:i + 1],
+            history=history,
+            history_length=i + 1,
             # NOTE: Include all history up to this point
             # but NOT the related tool responses, as that
             # doing so will affect the resulting network
             # state, if computed. These tool responses
-            # will be handled in the next Node
+            # will be handled in the next Node. The graph
+            # stores only the messages not shared with the
+            # previous node
         )
 
         # Handle tool calls and their responses
@@ -1716,6 +1972,48 @@ def get_template_content(template_path):
         debug_print(1, f"Failed to load template content '{template_path}': {str(e)}")
         raise ValueError(f"Failed to load template content '{template_path}': {str(e)}")
 
+_COMPILED_TEMPLATES = {}
+
+
+def get_compiled_template(template_path):
+    """
+    Return the compiled Mako template for template_path.
+
+    Templates are read and compiled once per process. If
+    CAI_TEMPLATE_MODULE_DIR is set, Mako also keeps the compiled
+    modules in that directory so later processes skip compilation
+    as well (modules older than their template are recompiled).
+
+    Args:
+        template_path: Path to the template file relative to the cai package,
+                      e.g., "prompts/system_bug_bounter.md"
+
+    Returns:
+        mako.template.Template
+    """
+    template = _COMPILED_TEMPLATES.get(template_path)
+    if template is not None:
+        return template
+
+    from mako.template import Template  # pylint: disable=import-outside-toplevel # noqa: E501
+    module_directory = os.getenv("CAI_TEMPLATE_MODULE_DIR")
+    template_file = None
+    if module_directory:
+        parts = template_path.removeprefix('cai/').split('/')
+        resource = importlib.resources.files(
+            '.'.join(['cai'] + parts[:-1])).joinpath(parts[-1])
+        if isinstance(resource, pathlib.Path) and resource.is_file():
+            template_file = resource
+    if template_file:
+        template = Template(filename=str(template_file),
+                            module_directory=module_directory,
+                            uri='/'.join(parts))
+    else:
+        template = Template(text=get_template_content(template_path))
+    _COMPILED_TEMPLATES[template_path] = template
+    return template
+
+
 def load_prompt_template(template_path, **template_vars):
     """
     Load a prompt template from the package resources and render it with the given variables.
@@ -1729,11 +2027,82 @@ def load_prompt_template(template_path, **template_vars):
         The rendered template as a string
     """
     try:
-        template_content = get_template_content(template_path)
-        
-        # Render the template
-        from mako.template import Template
-        return Template(text=template_content).render(**template_vars)
+        return get_compiled_template(template_path).render(**template_vars)
     except Exception as e:
         debug_print(1, f"Failed to render template '{template_path}': {str(e)}")
-        raise ValueError(f"Failed to render template '{template_path}': {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Failed to render template '{template_path}': {str(e)}")
+
+
+_ENV_CONTEXT = {"expires": 0.0, "value": None}
+
+
+def get_environment_context():
+    """
+    Probe the attacker machine for the environment section of the
+    system prompt.
+
+    The result is cached for CAI_ENV_CONTEXT_TTL seconds (default
+    300, 0 probes on every call), so rendering the prompt does not
+    pay for a DNS lookup and wordlist directory scans on every
+    interaction.
+
+    Returns:
+        dict: hostname, ip_addr, os_name, tun0_addr, wordlist_files
+            and seclist_dirs
+    """
+    now = time.monotonic()
+    if _ENV_CONTEXT["value"] is not None and now < _ENV_CONTEXT["expires"]:
+        return _ENV_CONTEXT["value"]
+
+    import platform  # pylint: disable=import-outside-toplevel
+    import socket  # pylint: disable=import-outside-toplevel
+
+    # Attempt import of netifaces to get tun0 IP if available
+    try:
+        import netifaces  # pylint: disable=import-outside-toplevel,import-error # noqa: E501
+    except ImportError:
+        netifaces = None
+
+    # Gather system info
+    try:
+        hostname = socket.gethostname()
+        ip_addr = socket.gethostbyname(hostname)
+        os_name = platform.system()
+    except Exception:  # pylint: disable=broad-except
+        hostname = "local0"
+        ip_addr = "127.0.0.1"
+        os_name = "Linux"
+
+    # Retrieve tun0 address if netifaces is installed and tun0 exists
+    tun0_addr = None
+    if netifaces and 'tun0' in netifaces.interfaces():
+        addrs = netifaces.ifaddresses('tun0')
+        if netifaces.AF_INET in addrs:
+            tun0_addr = addrs[netifaces.AF_INET][0].get('addr', None)
+
+    # Get wordlist directories
+    wordlist_path = pathlib.Path('/usr/share/wordlists')
+    wordlist_files = []
+    if wordlist_path.exists():
+        wordlist_files = [
+            f.name for f in wordlist_path.iterdir() if f.is_file()
+        ]
+
+    seclists_path = wordlist_path / 'seclists'
+    seclist_dirs = []
+    if seclists_path.exists():
+        seclist_dirs = [
+            d.name for d in seclists_path.iterdir() if d.is_dir()
+        ]
+
+    _ENV_CONTEXT["value"] = {
+        "hostname": hostname,
+        "ip_addr": ip_addr,
+        "os_name": os_name,
+        "tun0_addr": tun0_addr,
+        "wordlist_files": wordlist_files,
+        "seclist_dirs": seclist_dirs,
+    }
+    _ENV_CONTEXT["expires"] = now + float(
+        os.getenv("CAI_ENV_CONTEXT_TTL", "300"))
+    return _ENV_CONTEXT["value"]
@@ -0,0 +1,178 @@
+"""
+Tests for the async engine: CAI.arun, the run() wrapper
+and arun_command.
+"""
+import asyncio
+import threading
+
+import litellm
+from litellm.types.utils import (  # pylint: disable=import-error
+    ChatCompletionDeltaToolCall,
+    Delta,
+    Function,
+    ModelResponseStream,
+    StreamingChoices,
+)
+
+from cai.core import CAI, Agent
+from cai.tools.common import arun_command
+
+
+def _completion(content="", tool_calls=None):
+    return litellm.ModelResponse(
+        model="gpt-4o",
+        choices=[litellm.Choices(
+            index=0,
+            finish_reason="tool_calls" if tool_calls else "stop",
+            message=litellm.Message(
+                role="assistant", content=content, tool_calls=tool_calls),
+        )],
+        usage=litellm.Usage(
+            prompt_tokens=10, completion_tokens=5, total_tokens=15),
+    )
+
+
+def _fake_acompletion(responses):
+    calls = []
+
+    async def acompletion(**params):
+        calls.append(params)
+        return responses[len(calls) - 1]
+    return acompletion, calls
+
+
+def test_arun_awaits_async_tools(monkeypatch):
+    """A coroutine tool is awaited and its result fed back."""
+    async def echo(text: str):
+        await asyncio.sleep(0)
+        return f"echo: {text}"
+
+    acompletion, calls = _fake_acompletion([
+        _completion(tool_calls=[{
+            "id": "call_1", "type": "function",
+            "function": {"name": "echo", "arguments": '{"text": "hi"}'},
+        }]),
+        _completion("done"),
+    ])
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    agent = Agent(model="gpt-4o", functions=[echo])
+    client = CAI(log_training_data=False)
+    response = asyncio.run(client.arun(
+        agent=agent, messages=[{"role": "user", "content": "say hi"}]))
+
+    assert len(calls) == 2
+    assert response.messages[1]["role"] == "tool"
+    assert response.messages[1]["content"] == "echo: hi"
+    assert response.messages[-1]["content"] == "done"
+
+
+def test_run_wraps_arun(monkeypatch):
+    """The synchronous run() drives arun() and can be called again."""
+    acompletion, calls = _fake_acompletion(
+        [_completion("first"), _completion("second")])
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    agent = Agent(model="gpt-4o")
+    client = CAI(log_training_data=False)
+    first = client.run(agent=agent,
+                       messages=[{"role": "user", "content": "1"}])
+    second = client.run(agent=agent,
+                        messages=[{"role": "user", "content": "2"}])
+
+    assert len(calls) == 2
+    assert first.messages[-1]["content"] == "first"
+    assert second.messages[-1]["content"] == "second"
+
+
+def test_arun_command_local_and_timeout(monkeypatch, tmp_path):
+    """Local commands run as asyncio subprocesses and are killed on
+    timeout."""
+    monkeypatch.delenv("CAI_ACTIVE_CONTAINER", raising=False)
+    monkeypatch.delenv("SSH_USER", raising=False)
+    monkeypatch.setenv("CAI_WORKSPACE_DIR", str(tmp_path))
+
+    assert asyncio.run(arun_command("echo hello")) == "hello"
+    assert asyncio.run(
+        arun_command("sleep 5", timeout=0.2)).startswith("Timeout")
+
+
+def test_parallel_sync_tools_use_the_tool_pool(monkeypatch):
+    """Synchronous tools called in parallel run on the tool worker
+    pool, not on the event loop's default executor."""
+    threads = []
+
+    def where(label: str):
+        threads.append(threading.current_thread().name)
+        return label
+
+    acompletion, _ = _fake_acompletion([
+        _completion(tool_calls=[{
+            "id": f"call_{i}", "type": "function",
+            "function": {"name": "where",
+                         "arguments": f'{{"label": "{i}"}}'},
+        } for i in range(3)]),
+        _completion("done"),
+    ])
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    agent = Agent(model="gpt-4o", functions=[where],
+                  parallel_tool_calls=True)
+    response = asyncio.run(CAI(log_training_data=False).arun(
+        agent=agent, messages=[{"role": "user", "content": "go"}]))
+
+    assert [m["content"] for m in response.messages[1:4]] == ["0", "1", "2"]
+    assert len(threads) == 3
+    assert all(name.startswith("cai-tool-parallel") for name in threads)
+
+
+class _CutStream(litellm.CustomStreamWrapper):  # pylint: disable=abstract-method
+    """A stream that fails after its first tool call is complete."""
+
+    def __init__(self):  # pylint: disable=super-init-not-called
+        pass
+
+    def __aiter__(self):
+        return self._chunks()
+
+    @staticmethod
+    async def _chunks():
+        for index, call_id in enumerate(("call_1", "call_2")):
+            yield ModelResponseStream(
+                id="chatcmpl-1", model="gpt-4o", created=1,
+                choices=[StreamingChoices(index=0, delta=Delta(
+                    tool_calls=[ChatCompletionDeltaToolCall(
+                        index=index, id=call_id, type="function",
+                        function=Function(
+                            name="touch",
+                            arguments=f'{{"label": "{call_id}"}}'))]))])
+        raise ConnectionError("stream cut")
+
+
+def test_tools_started_before_a_failed_stream_are_recorded(monkeypatch):
+    """A tool started while streaming is recorded with its result when
+    the stream then fails, so the model does not ask to run it again."""
+    ran = []
+
+    def touch(label: str):
+        ran.append(label)
+        return f"touched {label}"
+
+    replies = [_CutStream(), _completion("done")]
+
+    async def acompletion(**params):
+        return replies.pop(0)
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    agent = Agent(model="gpt-4o", functions=[touch])
+    client = CAI(log_training_data=False)
+    response = asyncio.run(client.arun(
+        agent=agent, messages=[{"role": "user", "content": "go"}],
+        stream=True))
+
+    assert ran == ["call_1"]
+    assert [t["id"] for t in response.messages[0]["tool_calls"]] == [
+        "call_1"]
+    assert response.messages[1]["content"] == "touched call_1"
+    assert response.messages[-1]["content"] == "done"
+    assert not client._pending_tool_calls  # pylint: disable=protected-access
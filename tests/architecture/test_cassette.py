@@ -0,0 +1,95 @@
+"""
+Tests for the record/replay cassette of LLM completions.
+"""
+import os
+
+import litellm  # pylint: disable=import-error
+
+from cai import core, util
+from cai.cassette import Cassette, request_key
+from cai.core import CAI, Agent
+
+
+def _counting_completion(monkeypatch):
+    calls = []
+    original = litellm.acompletion
+
+    async def acompletion(**params):
+        calls.append(params)
+        return await original(**params, mock_response="recorded reply")
+    monkeypatch.setattr(core.litellm, "acompletion", acompletion)
+    return calls
+
+
+def _complete(client):
+    return client.get_chat_completion(
+        Agent(model="gpt-4o"), [{"role": "user", "content": "task"}], {},
+        None, False, False)
+
+
+def test_request_key_is_canonical():
+    """Key order and transport settings do not change the key."""
+    params = {"model": "gpt-4o", "stream": False,
+              "messages": [{"role": "user", "content": "a"}]}
+    same = {"messages": [{"content": "a", "role": "user"}],
+            "model": "gpt-4o", "stream": True, "timeout": 60}
+    assert request_key(params) == request_key(same)
+    assert request_key(params) != request_key({**params, "model": "o3"})
+
+
+def test_record_then_replay(monkeypatch, tmp_path):
+    """Recorded completions are replayed without calling the model."""
+    calls = _counting_completion(monkeypatch)
+    monkeypatch.setenv("CAI_CASSETTE", str(tmp_path / "run.sqlite"))
+    monkeypatch.setenv("CAI_CASSETTE_MODE", "record-missing")
+    first = _complete(CAI(log_training_data=False))
+    assert first.choices[0].message.content == "recorded reply"
+    assert len(calls) == 1
+
+    monkeypatch.setenv("CAI_CASSETTE_MODE", "replay")
+    client = CAI(log_training_data=False)
+    replayed = _complete(client)
+    assert replayed.choices[0].message.content == "recorded reply"
+    assert replayed.usage.total_tokens == first.usage.total_tokens
+    assert len(calls) == 1
+    assert client.total_input_tokens == first.usage.prompt_tokens
+
+
+def test_replay_on_another_host(monkeypatch, tmp_path):
+    """The environment context of the system prompt is not keyed."""
+    calls = _counting_completion(monkeypatch)
+    monkeypatch.setenv("CAI_CASSETTE", str(tmp_path / "run.sqlite"))
+    monkeypatch.setenv("CAI_ENV_CONTEXT", "true")
+
+    def on_host(hostname, ip_addr):
+        env = {"hostname": hostname, "ip_addr": ip_addr,
+               "os_name": "Linux", "tun0_addr": ip_addr,
+               "wordlist_files": [hostname + ".txt"],
+               "seclist_dirs": ["Discovery"]}
+        monkeypatch.setattr(util, "get_environment_context", lambda: env)
+
+    on_host("recorder", "10.0.0.1")
+    monkeypatch.setenv("CAI_CASSETTE_MODE", "record")
+    _complete(CAI(log_training_data=False))
+    assert "recorder" in calls[0]["messages"][0]["content"]
+
+    on_host("replayer", "10.0.0.2")
+    monkeypatch.setenv("CAI_CASSETTE_MODE", "replay")
+    replayed = _complete(CAI(log_training_data=False))
+    assert replayed.choices[0].message.content == "recorded reply"
+    assert len(calls) == 1
+
+
+def test_replay_miss_and_jsonl_import(monkeypatch, tmp_path):
+    """Unrecorded requests fail in replay mode; JSONL logs import."""
+    calls = _counting_completion(monkeypatch)
+    monkeypatch.setenv("CAI_CASSETTE", str(tmp_path / "run.sqlite"))
+    monkeypatch.setenv("CAI_CASSETTE_MODE", "replay")
+    assert _complete(CAI(log_training_data=False)) is None
+    assert not calls
+
+    cassette = Cassette(str(tmp_path / "ctf.sqlite"))
+    count = cassette.import_jsonl(os.path.join(
+        os.path.dirname(__file__), "..", "agents", "kiddoctf.jsonl"))
+    assert count > 0
+    assert len(cassette) <= count
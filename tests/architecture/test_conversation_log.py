@@ -0,0 +1,73 @@
+"""
+Tests for the copy-on-write conversation log in cai.types.
+"""
+import copy
+
+import pytest
+
+from cai.core import CAI, Agent
+from cai.types import ConversationLog, MessageRecord, ReadOnlyError, thaw
+
+
+def test_message_records_are_read_only():
+    """Records reject changes; copies of them are plain dicts."""
+    record = MessageRecord.of({"role": "user", "content": "hi"})
+    assert MessageRecord.of(record) is record
+    with pytest.raises(TypeError):
+        record["content"] = "changed"
+    with pytest.raises(TypeError):
+        record.update(content="changed")
+
+    for mutable in (dict(record), record.copy(), copy.deepcopy(record)):
+        assert type(mutable) is dict  # pylint: disable=unidiomatic-typecheck
+        mutable["content"] = "changed"
+    assert record["content"] == "hi"
+
+
+def test_nested_values_of_records_are_read_only():
+    """tool_calls and content parts are frozen with the record; deep
+    copies of them are plain lists and dicts."""
+    record = MessageRecord.of({"role": "assistant", "tool_calls": [
+        {"id": "1", "function": {"name": "ls", "arguments": "{}"}}]})
+    assert isinstance(record["tool_calls"], list)
+    with pytest.raises(ReadOnlyError):
+        record["tool_calls"].append({})
+    with pytest.raises(ReadOnlyError):
+        record["tool_calls"][0]["function"]["arguments"] = "{ }"
+
+    mutable = thaw(record)
+    assert type(mutable["tool_calls"]) is list  # pylint: disable=unidiomatic-typecheck
+    mutable["tool_calls"][0]["function"]["arguments"] = "{ }"
+    assert copy.deepcopy(record) == thaw(record)
+    assert record["tool_calls"][0]["function"]["arguments"] == "{}"
+
+
+def test_forks_share_records_but_not_the_list():
+    """A fork costs pointers only and is isolated from its parent."""
+    messages = [{"role": "user", "content": "task"}]
+    log = ConversationLog(messages)
+    log.append({"role": "assistant", "content": "reply"})
+    assert messages == [{"role": "user", "content": "task"}]
+    assert all(isinstance(m, MessageRecord) for m in log)
+
+    fork = log.fork()
+    fork.append({"role": "user", "content": "more"})
+    fork[0] = {"role": "user", "content": "other task"}
+    assert [m["content"] for m in log] == ["task", "reply"]
+    assert fork[1] is log[1]
+    assert isinstance(fork[0], MessageRecord)
+    assert ConversationLog(log)[1] is log[1]
+
+
+def test_last_record_copied_for_cache_control():
+    """Only the last message is copied, to add cache_control, and the
+    token estimates are kept on the records for the next turns."""
+    history = ConversationLog([{"role": "user", "content": "task"}])
+    params = CAI(log_training_data=False).prepare_completion_params(
+        Agent(model="claude-3-5-sonnet-20241022"), history, {}, None,
+        False, 0)
+    sent = params["messages"][-1]
+    assert sent["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in history[0]
+    # pylint: disable-next=protected-access
+    assert ("tokens", "claude-3-5-sonnet-20241022") in history[0]._derived
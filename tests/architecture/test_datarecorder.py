@@ -0,0 +1,245 @@
+"""
+Tests for the v1 and v2 DataRecorder log layouts.
+"""
+import json
+import os
+import threading
+import time
+
+import pytest
+from litellm import ModelResponse  # pylint: disable=import-error
+
+from cai import datarecorder
+from cai.internal.components import transfer
+from cai.datarecorder import (
+    DataRecorder,
+    _LogWriter,
+    INDEX_SUFFIX,
+    convert_jsonl,
+    get_token_stats,
+    index_jsonl,
+    iter_jsonl_records,
+    load_history_from_jsonl,
+    log_files,
+    read_jsonl_index,
+    read_manifest,
+)
+
+KIDDOCTF = os.path.join(os.path.dirname(__file__), "..", "agents",
+                        "kiddoctf.jsonl")
+
+
+def _record_session(monkeypatch, tmp_path, log_format, **env):
+    tmp_path.mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CAI_LOG_FORMAT", log_format)
+    monkeypatch.setenv("CAI_PUBLIC_IP", "false")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    recorder = DataRecorder()
+    tools = [{"type": "function", "function": {"name": "ls"}}]
+    messages = [{"role": "system", "content": "prompt"}]
+    for turn in range(5):
+        messages = messages + [{"role": "user", "content": f"step {turn}"}]
+        reply = ModelResponse(
+            model="gpt-4o",
+            choices=[{"message": {"role": "assistant",
+                                  "content": f"reply {turn}"}}],
+            usage={"prompt_tokens": 10, "completion_tokens": 2,
+                   "total_tokens": 12})
+        recorder.rec_training_data(
+            {"model": "gpt-4o", "messages": messages, "stream": False,
+             "tools": tools, "tool_choice": None}, reply)
+        recorder.flush()
+        messages = messages + [{"role": "assistant",
+                                "content": f"reply {turn}"}]
+    recorder.close()
+    return os.path.abspath(recorder.filename)
+
+
+def test_v2_logs_read_like_v1(monkeypatch, tmp_path):
+    """Both layouts decode to the same records; v2 writes each
+    message and tool once."""
+    v1 = _record_session(monkeypatch, tmp_path / "v1", "1")
+    v2 = _record_session(monkeypatch, tmp_path / "v2", "2")
+    strip = [{k: v for k, v in r.items()
+              if k not in ("id", "created", "timestamp_iso", "timing")}
+             for r in iter_jsonl_records(v1)]
+    assert strip == [{k: v for k, v in r.items()
+                      if k not in ("id", "created", "timestamp_iso",
+                                   "timing")}
+                     for r in iter_jsonl_records(v2)]
+    assert load_history_from_jsonl(v1) == load_history_from_jsonl(v2)
+    assert get_token_stats(v1)[:4] == get_token_stats(v2)[:4] == \
+        ("gpt-4o", 50, 10, 0.0)
+
+    with open(v2, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0] == {"type": "header", "format": "cai-jsonl",
+                          "version": 2}
+    kinds = [r.get("type") for r in records]
+    assert kinds.count("message") == 10
+    assert kinds.count("tool") == 1
+    assert [r["prefix"] for r in records if r.get("type") == "request"] \
+        == [0, 2, 4, 6, 8]
+
+
+def test_convert_round_trip(tmp_path):
+    """Old logs convert to v2 and back without changes."""
+    v2 = tmp_path / "log.v2.jsonl"
+    v1 = tmp_path / "log.v1.jsonl"
+    assert convert_jsonl(KIDDOCTF, v2) == 26
+    assert os.path.getsize(v2) < os.path.getsize(KIDDOCTF) / 4
+    assert list(iter_jsonl_records(v2)) == list(iter_jsonl_records(KIDDOCTF))
+    convert_jsonl(v2, v1, version=1)
+    with open(KIDDOCTF, encoding="utf-8") as f:
+        original = [json.loads(line) for line in f if line.strip()]
+    assert list(iter_jsonl_records(v1)) == original
+
+
+def test_sidecar_index(monkeypatch, tmp_path):
+    """Indexed reads match full scans; stale or missing indexes fall
+    back to scanning the log."""
+    recorded = _record_session(monkeypatch, tmp_path / "rec", "2")
+    entries = read_jsonl_index(recorded)
+    assert [e["messages"] for e in entries if e["type"] == "request"] \
+        == [2, 4, 6, 8, 10]
+    assert len(entries) == sum(1 for _ in open(recorded, "rb"))
+
+    history = load_history_from_jsonl(KIDDOCTF)
+    stats = get_token_stats(KIDDOCTF)
+    assert read_jsonl_index(KIDDOCTF) is None
+    for version in (1, 2):
+        path = str(tmp_path / f"log.v{version}.jsonl")
+        convert_jsonl(KIDDOCTF, path, version=version)
+        assert read_jsonl_index(path) is not None
+        assert load_history_from_jsonl(path) == history
+        assert get_token_stats(path) == stats
+
+    with open(path, "a", encoding="utf-8") as f:  # index now stale
+        f.write(json.dumps({"model": "other", "usage": {
+            "prompt_tokens": 1, "completion_tokens": 1}}) + "\n")
+    assert read_jsonl_index(path) is None
+    assert get_token_stats(path)[:3] == ("other", stats[1] + 1,
+                                         stats[2] + 1)
+    assert index_jsonl(path) == len(read_jsonl_index(path))
+    assert get_token_stats(path)[:3] == ("other", stats[1] + 1,
+                                         stats[2] + 1)
+    os.remove(path + INDEX_SUFFIX)
+    assert load_history_from_jsonl(path) == history
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_rotated_segments(monkeypatch, tmp_path, compression):
+    """Rotated, compressed segments read back as one log."""
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    plain = _record_session(monkeypatch, tmp_path / "plain", "2")
+    rotated = _record_session(monkeypatch, tmp_path / "rotated", "2",
+                              CAI_LOG_ROTATE_SIZE="400",
+                              CAI_LOG_COMPRESSION=compression)
+    manifest = read_manifest(rotated)
+    assert manifest["compression"] == compression
+    assert len(manifest["segments"]) > 1
+    assert not os.path.exists(rotated)  # the last segment is compressed
+    files = log_files(rotated)
+    assert all(f.endswith(".zst" if compression == "zstd" else ".gz")
+               for f in files)
+    assert sum(s["records"] for s in manifest["segments"]) == \
+        sum(1 for _ in open(plain, "rb"))
+
+    assert list(iter_jsonl_records(rotated)) == \
+        list(iter_jsonl_records(rotated + ".manifest.json"))
+    assert load_history_from_jsonl(rotated) == load_history_from_jsonl(plain)
+    assert get_token_stats(rotated)[:4] == get_token_stats(plain)[:4]
+    assert len(list(iter_jsonl_records(rotated))) == 10
+
+
+def test_rotation_is_checked_per_record(tmp_path):
+    """A batch of records is split into segments of the rotation size,
+    not written whole into the current one."""
+    path = str(tmp_path / "log.jsonl")
+    writer = _LogWriter(path, rotate_size=100)
+    writer.write(*({"n": i, "pad": "x" * 20} for i in range(20)))
+    writer.close()
+    segments = read_manifest(path)["segments"]
+    assert len(segments) >= 6
+    assert all(s["bytes"] < 100 + 40 for s in segments)
+    assert [r["n"] for r in iter_jsonl_records(path)] == list(range(20))
+
+
+def test_upload_sends_every_segment(monkeypatch, tmp_path):
+    """The telemetry upload of a rotated log sends its segments and its
+    manifest, each closed segment once per endpoint."""
+    rotated = _record_session(monkeypatch, tmp_path / "rotated", "2",
+                              CAI_LOG_ROTATE_SIZE="400")
+    sent = []
+    monkeypatch.setattr(
+        transfer, "_transmit_data",
+        lambda payload, endpoint: sent.append(payload["name"]) or True)
+    assert transfer.process(rotated, "http://localhost/upload", "id")
+    assert sent == [os.path.basename(f) for f in log_files(rotated)] + \
+        [os.path.basename(rotated) + ".manifest.json"]
+
+    # closed segments are not sent again, to the same endpoint
+    sent.clear()
+    assert transfer.process(rotated, "http://localhost/upload", "id")
+    assert sent == [os.path.basename(rotated) + ".manifest.json"]
+    sent.clear()
+    assert transfer.process(rotated, "http://localhost/final", "id")
+    assert len(sent) == len(log_files(rotated)) + 1
+
+
+def test_background_writer_flushes_on_demand(tmp_path):
+    """Queued records reach the file on flush() and close(), in order."""
+    path = tmp_path / "log.jsonl"
+    writer = _LogWriter(str(path))
+    writer.FLUSH_INTERVAL = 60  # only explicit flushes
+    writer.write(*({"n": i} for i in range(100)))
+    writer.flush()
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["n"] for line in f] == list(range(100))
+
+    writer.write({"n": 100})
+    writer.close()
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 101
+    with pytest.raises(ValueError):
+        writer.write({"n": 101})
+
+
+def test_public_ip_lookup_does_not_block(monkeypatch, tmp_path):
+    """The log is named without waiting for the IP lookup, whose result
+    is cached for the next sessions."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CAI_PUBLIC_IP", "auto")
+    monkeypatch.setattr(datarecorder, "PUBLIC_IP_CACHE",
+                        str(tmp_path / "ip.json"))
+    monkeypatch.setattr(datarecorder, "_PUBLIC_IP", {
+        "value": None, "expires": 0.0, "lookup": None, "loaded": False})
+    lookups = []
+    release = threading.Event()
+
+    def slow_lookup():
+        lookups.append(1)
+        release.wait(5)
+        return "203.0.113.7"
+    monkeypatch.setattr(datarecorder, "_lookup_public_ip", slow_lookup)
+
+    start = time.monotonic()
+    recorder = DataRecorder()
+    assert recorder.filename.endswith("_127_0_0_1.jsonl")
+    assert time.monotonic() - start < 1
+    release.set()
+    datarecorder._PUBLIC_IP["lookup"].join()  # pylint: disable=protected-access
+    assert DataRecorder().filename.endswith("_203_0_113_7.jsonl")
+    assert len(lookups) == 1
+
+    # a new process reads the cache instead of looking the IP up
+    monkeypatch.setattr(datarecorder, "_PUBLIC_IP", {
+        "value": None, "expires": 0.0, "lookup": None, "loaded": False})
+    assert datarecorder.public_ip() == "203.0.113.7"
+    assert len(lookups) == 1
+
+    monkeypatch.setenv("CAI_PUBLIC_IP", "false")
+    assert datarecorder.public_ip() == "127.0.0.1"
@@ -0,0 +1,136 @@
+"""
+Tests for node histories, naming and edge labels in cai.graph.
+"""
+import os
+
+from cai.datarecorder import load_history_from_jsonl
+from cai.graph import Graph, Node, reset_default_graph
+from cai.types import Agent, ChatCompletionMessageToolCall, ConversationLog
+from cai.util import create_graph_from_history
+
+KIDDOCTF = os.path.join(os.path.dirname(__file__), "..", "agents",
+                        "kiddoctf.jsonl")
+
+
+def test_nodes_share_one_message_log():
+    """Growing histories are stored once; forks and rewrites keep
+    their own messages."""
+    graph = Graph()
+    agent = Agent(name="Agent")
+    history = ConversationLog([{"role": "user", "content": "start"}])
+    for turn in range(50):
+        history.append({"role": "assistant", "content": f"reply {turn}"})
+        graph.add_to_graph(Node(name="Agent", agent=agent, turn=turn,
+                                history=history))
+    assert len(graph._history_log) == 51  # pylint: disable=protected-access
+    nodes = list(graph.nodes)
+    assert [len(node.history) for node in nodes] == list(range(2, 52))
+    assert nodes[10].history == list(history[:12])
+    assert nodes[10].history[-1]["content"] == "reply 10"
+
+    # a new turn forks the history; a rewritten one diverges
+    fork = history.fork()
+    fork.append({"role": "user", "content": "next"})
+    graph.add_to_graph(Node(name="Agent", agent=agent, history=fork))
+    rewritten = ConversationLog(history[:5])
+    rewritten.append({"role": "user", "content": "other"})
+    graph.add_to_graph(Node(name="Agent", agent=agent, history=rewritten))
+    assert len(graph._history_log) == 53  # pylint: disable=protected-access
+    assert graph.previous_node.history == list(rewritten)
+    assert len(graph.previous_node.history.ranges) == 2
+
+    # nodes hash by id, not by content
+    twin = Node(name="Agent_1", agent=agent, turn=0, history=history[:2])
+    assert twin != nodes[0] and twin not in graph
+    assert nodes[0] in graph
+
+
+def test_equal_last_message_does_not_skip_the_prefix():
+    """A history ending like the previous one only by value is compared
+    message by message."""
+    graph = Graph()
+    agent = Agent(name="Agent")
+    repeated = {"role": "assistant", "content": "X"}
+    first = [{"role": "user", "content": "A"},
+             {"role": "assistant", "content": "B"}, repeated]
+    graph.add_to_graph(Node(name="Agent", agent=agent, history=first))
+    second = [{"role": "user", "content": "C"},
+              {"role": "assistant", "content": "D"}, dict(repeated),
+              {"role": "user", "content": "E"}]
+    graph.add_to_graph(Node(name="Agent", agent=agent, history=second))
+    assert graph.previous_node.history == second
+    assert list(graph.nodes)[0].history == first
+
+
+def test_graph_from_history():
+    """create_graph_from_history gives every node its history prefix
+    without copying it per node."""
+    reset_default_graph()
+    history = load_history_from_jsonl(KIDDOCTF)
+    graph = create_graph_from_history(history)
+    for node in graph.nodes:
+        assert node.history == history[:len(node.history)]
+    assert len(graph._history_log) <= len(history)  # pylint: disable=protected-access
+    reset_default_graph()
+
+
+def test_unique_names_and_lazy_edge_labels():
+    """Names get increasing suffixes per base name; edge labels are
+    only built on export."""
+    graph = Graph()
+    agent = Agent(name="Agent")
+    for _ in range(3):
+        graph.add_to_graph(Node(name="Agent", agent=agent))
+        graph.add_to_graph(Node(name="Red_Team", agent=agent))
+    assert list(graph.get_name_op_map()) == [
+        "Agent", "Red_Team", "Agent_1", "Red_1", "Agent_2", "Red_2"]
+    assert graph.get_unique_name(Node(name="Agent")) == "Agent_3"
+
+    call = ChatCompletionMessageToolCall(
+        id="call_1", type="function",
+        function={"name": "ls", "arguments": '{"path": "/tmp"}'})
+    graph.add_to_graph(Node(name="Agent", agent=agent), action=[call])
+    edge = graph.edges[graph.get_name_op_map()["Red_2"], graph.previous_node]
+    assert "label" not in edge and edge["action"] == [call]
+    graph.to_pydot()
+    assert edge == {"label": "ls(path=/tmp)"}
+
+
+def test_ascii_is_rendered_locally_and_incrementally(monkeypatch):
+    """Graph.ascii draws boxes and labelled arrows without the network,
+    drawing again only what changed."""
+    monkeypatch.setattr("socket.socket.connect", None)  # no network
+    graph = Graph()
+    agent = Agent(name="Agent")
+    call = ChatCompletionMessageToolCall(
+        id="call_1", type="function",
+        function={"name": "ls", "arguments": '{"path": "/tmp"}'})
+    graph.add_to_graph(Node(name="Agent", agent=agent))
+    graph.add_to_graph(Node(name="Agent", agent=agent), action=[call])
+    assert graph.ascii() == "\n".join([
+        "┌───────┐",
+        "│ Agent │",
+        "└───────┘",
+        "  │ ls(path=/tmp)",
+        "  ▼",
+        "┌─────────┐",
+        "│ Agent_1 │",
+        "└─────────┘"])
+
+    drawn = []
+    renderer = graph._ascii_renderer  # pylint: disable=protected-access
+    draw_row = renderer._row  # pylint: disable=protected-access
+    for _ in range(498):
+        graph.add_to_graph(Node(name="Agent", agent=agent), action=[call])
+    graph.ascii()
+    monkeypatch.setattr(renderer, "_row",
+                        lambda nodes: drawn.append(nodes) or draw_row(nodes))
+    graph.add_to_graph(Node(name="Agent", agent=agent), action=[call])
+    text = graph.ascii()
+    assert text.endswith("│ Agent_500 │\n└───────────┘")
+    # the row of the new node, and the arrows of the row before it
+    assert len(drawn) == 3
+    fresh = Graph()
+    fresh.add_nodes_from(graph.nodes)
+    fresh.add_edges_from(graph.edges(data=True))
+    assert fresh.ascii() == text
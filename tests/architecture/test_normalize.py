@@ -0,0 +1,47 @@
+"""
+Tests for the tool output normalization pipeline.
+"""
+from cai.normalize import (
+    OutputNormalizer,
+    collapse_cr,
+    rle_lines,
+    strip_ansi,
+    strip_padding,
+)
+
+
+def test_stages():
+    """Each stage removes its kind of terminal noise only."""
+    assert strip_ansi("\x1b[1;32mopen\x1b[0m 22/tcp\x1b]0;title\x07") == \
+        "open 22/tcp"
+    assert collapse_cr("get\r\n 10%\r 50%\r100%\ndone\r\n") == \
+        "get\n100%\ndone\n"
+    assert rle_lines("a\nb\nb\nb\nb\nc\nc") == \
+        "a\nb\n[previous line repeated 3 more times]\nc\nc"
+    assert strip_padding("\n\nport 80   \n\n\n\nport 443\t\n\n") == \
+        "port 80\n\nport 443"
+    plain = "nothing to do\nhere"
+    assert all(stage(plain) is plain
+               for stage in (strip_ansi, collapse_cr))
+
+
+def test_pipeline_reports_savings(monkeypatch):
+    """Savings are reported for the stages that changed the output and
+    disabled stages are skipped."""
+    output = ("\x1b[33mscanning\x1b[0m\n" +
+              "".join(f"\r{i}%" for i in range(0, 101, 5)) + "\n" +
+              "Timeout\n" * 40 + "\n\n\n")
+    normalizer = OutputNormalizer()
+    text, savings = normalizer.normalize(output)
+    assert text == ("scanning\n100%\nTimeout\n"
+                    "[previous line repeated 39 more times]")
+    assert set(savings) == {"ansi", "cr", "rle", "blank"}
+    assert all(saved_bytes > 0 for saved_bytes, _ in savings.values())
+    assert normalizer.stats["rle"][0] == 1
+    assert normalizer.stats["rle"][1] == savings["rle"][0]
+
+    monkeypatch.setenv("CAI_TOOL_OUTPUT_NORMALIZE", "ansi,blank")
+    text, savings = normalizer.normalize(output)
+    assert set(savings) == {"ansi", "blank"}
+    monkeypatch.setenv("CAI_TOOL_OUTPUT_NORMALIZE", "none")
+    assert normalizer.normalize(output) == (output, {})
@@ -0,0 +1,118 @@
+"""
+Tests for the incremental outbound message view used by
+CAI.prepare_completion_params.
+"""
+from cai import core
+from cai.core import CAI, Agent
+from cai.types import ConversationLog
+
+
+def _outbound(client, history):
+    params = client.prepare_completion_params(
+        Agent(model="gpt-4o"), history, {}, None, False, 0)
+    return params["messages"][1:]
+
+
+def test_outbound_messages_follow_history():
+    """Hidden senders and add_memory calls are filtered as history grows."""
+    client = CAI(log_training_data=False)
+    history = [{"role": "user", "content": "start"}]
+    assert _outbound(client, history) == history
+
+    memory_call = {
+        "role": "assistant", "content": None,
+        "tool_calls": [{"id": "1", "type": "function",
+                        "function": {"name": "add_memory",
+                                     "arguments": "{}"}}],
+    }
+    history += [
+        {"role": "assistant", "content": "thinking",
+         "sender": "Reasoner Agent"},
+        memory_call,
+        {"role": "assistant", "content": "reply", "sender": "Agent"},
+    ]
+    outbound = _outbound(client, history)
+    assert [m["content"] for m in outbound] == ["start", "reply"]
+    assert outbound[0] == history[0]
+    assert client._outbound.scanned == 4  # pylint: disable=protected-access
+
+
+def test_outbound_messages_rebuilt_for_new_history():
+    """A replaced or shortened history does not reuse the stale view."""
+    client = CAI(log_training_data=False)
+    history = [{"role": "user", "content": "a"},
+               {"role": "assistant", "content": "b"}]
+    _outbound(client, history)
+    # litellm may pop from the list it is given
+    params = client.prepare_completion_params(
+        Agent(model="gpt-4o"), history, {}, None, False, 0)
+    params["messages"].pop()
+
+    del history[1:]
+    assert [m["content"] for m in _outbound(client, history)] == ["a"]
+    other = [{"role": "user", "content": "c"}]
+    assert [m["content"] for m in _outbound(client, other)] == ["c"]
+
+
+def test_context_fitted_before_sending(monkeypatch):
+    """Long histories are trimmed before the request, not after a
+    context window error."""
+    monkeypatch.setattr(core, "get_model_input_tokens", lambda model: 6000)
+    client = CAI(log_training_data=False)
+    client.context_reserve = 0
+    history = [{"role": "user", "content": "task"}]
+    sent = _outbound(client, history)
+    assert sent == history
+
+    system_tokens = core.estimate_message_tokens(
+        "gpt-4o", client.prepare_completion_params(
+            Agent(model="gpt-4o"), history, {}, None, False, 0
+        )["messages"][0])
+    monkeypatch.setattr(core, "get_model_input_tokens",
+                        lambda model: system_tokens + 3000)
+    for i in range(20):
+        history.append({"role": "assistant", "content": f"step {i} " * 100})
+    sent = _outbound(client, history)
+    assert sent[0] == history[0]
+    assert "omitted to fit the context window" in sent[1]["content"]
+    assert sent[-1] == history[-1]
+    assert sum(core.estimate_message_tokens("gpt-4o", m)
+               for m in sent) <= 3000
+
+
+def test_records_are_sent_without_copies():
+    """History records go out as they are; the last message is copied
+    for cache_control, and all of them, deeply, once litellm rewrites
+    messages in place for the model."""
+    client = CAI(log_training_data=False)
+    history = ConversationLog([
+        {"role": "user", "content": "task"},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "1", "type": "function",
+             "function": {"name": "ls", "arguments": "{}"}}]},
+        {"role": "tool", "tool_call_id": "1", "content": "files"}])
+    params = client.prepare_completion_params(
+        Agent(model="claude-3-7-sonnet-20250219"), history, {}, None,
+        False, 0)
+    sent = params["messages"][1:]
+    assert sent[1] is history[1]
+    assert sent[2] == {**history[2], "cache_control": {"type": "ephemeral"}}
+    assert "cache_control" not in history[2]
+
+    try:
+        try:  # nested values are read-only too
+            sent[1]["tool_calls"][0]["function"]["arguments"] = "{ }"
+        except TypeError as e:
+            raise RuntimeError("wrapped by litellm") from e
+    except RuntimeError as e:
+        assert client.recover_completion(e, params) is None
+    assert params["messages"][2] == history[1]
+    params["messages"][2]["tool_calls"][0]["function"]["arguments"] = "{ }"
+    assert history[1]["tool_calls"][0]["function"]["arguments"] == "{}"
+    sent = _outbound(client, history)
+    assert sent[1] is history[1]  # another model
+    params = client.prepare_completion_params(
+        Agent(model="claude-3-7-sonnet-20250219"), history, {}, None,
+        False, 0)
+    assert params["messages"][2] is not history[1]
+    assert type(params["messages"][2]["tool_calls"]) is list
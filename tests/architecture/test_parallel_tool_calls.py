@@ -0,0 +1,170 @@
+"""
+Tests for concurrent execution of tool calls in
+CAI.handle_tool_calls and CAI.arun (Agent.parallel_tool_calls).
+"""
+import asyncio
+import json
+import time
+
+import litellm
+
+from cai.core import CAI, Agent
+from cai.types import ChatCompletionMessageToolCall, Function
+
+
+def _tool_call(call_id, name, **args):
+    return ChatCompletionMessageToolCall(
+        id=call_id,
+        type="function",
+        function=Function(name=name, arguments=json.dumps(args)),
+    )
+
+
+def test_parallel_tool_calls_run_concurrently_in_order():
+    """Slow independent calls overlap but results keep their order."""
+    def slow_command(delay: float, label: str):
+        time.sleep(delay)
+        return label
+
+    agent = Agent(functions=[slow_command], parallel_tool_calls=True)
+    client = CAI(log_training_data=False)
+    tool_calls = [
+        _tool_call("call_1", "slow_command", delay=0.5, label="first"),
+        _tool_call("call_2", "slow_command", delay=0.1, label="second"),
+        _tool_call("call_3", "slow_command", delay=0.3, label="third"),
+    ]
+
+    start = time.monotonic()
+    response = client.handle_tool_calls(
+        tool_calls, agent.functions, {}, 0, agent)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.85
+    assert [m["tool_call_id"] for m in response.messages] == [
+        "call_1", "call_2", "call_3"]
+    assert [m["content"] for m in response.messages] == [
+        "first", "second", "third"]
+
+
+def test_parallel_handoff_is_deterministic():
+    """The last handoff in tool call order wins, as when sequential."""
+    agent_a = Agent(name="Agent A")
+    agent_b = Agent(name="Agent B")
+
+    def transfer_to_a():
+        time.sleep(0.2)
+        return agent_a
+
+    def transfer_to_b():
+        return agent_b
+
+    agent = Agent(functions=[transfer_to_a, transfer_to_b],
+                  parallel_tool_calls=True)
+    client = CAI(log_training_data=False)
+    response = client.handle_tool_calls(
+        [_tool_call("call_1", "transfer_to_b"),
+         _tool_call("call_2", "transfer_to_a")],
+        agent.functions, {}, 0, agent)
+
+    assert response.agent.name == "Agent A"
+
+
+def test_parallel_tool_timeout():
+    """A tool exceeding CAI_TOOL_TIMEOUT reports an error message."""
+    def slow_command(delay: float):
+        time.sleep(delay)
+        return "done"
+
+    agent = Agent(functions=[slow_command], parallel_tool_calls=True)
+    client = CAI(log_training_data=False)
+    client.tool_timeout = 0.2
+    response = client.handle_tool_calls(
+        [_tool_call("call_1", "slow_command", delay=1),
+         _tool_call("call_2", "slow_command", delay=0)],
+        agent.functions, {}, 0, agent)
+
+    assert "timed out" in response.messages[0]["content"]
+    assert response.messages[1]["content"] == "done"
+
+
+def test_calls_queued_behind_hung_tools_still_run():
+    """Calls queued while every worker is stuck on a timed out tool
+    run on a new pool instead of waiting forever."""
+    release = []
+
+    def hang():
+        while not release:
+            time.sleep(0.05)
+        return "late"
+
+    def quick(label: str):
+        return label
+
+    agent = Agent(functions=[hang, quick], parallel_tool_calls=True)
+    client = CAI(log_training_data=False)
+    client.tool_timeout = 0.3
+    client.max_parallel_tools = 2
+    start = time.monotonic()
+    response = client.handle_tool_calls(
+        [_tool_call("call_1", "hang"), _tool_call("call_2", "hang"),
+         _tool_call("call_3", "quick", label="a"),
+         _tool_call("call_4", "quick", label="b")],
+        agent.functions, {}, 0, agent)
+    release.append(True)
+
+    assert time.monotonic() - start < 3
+    assert ["timed out" in m["content"] for m in response.messages[:2]] == [
+        True, True]
+    assert [m["content"] for m in response.messages[2:]] == ["a", "b"]
+
+
+def test_arun_calls_queued_behind_hung_tools_still_run(monkeypatch):
+    """Through arun, as CAI.run uses it: calls queued behind tools that
+    hang on every worker still run, and the turn goes on."""
+    release = []
+
+    def hang():
+        while not release:
+            time.sleep(0.05)
+        return "late"
+
+    def quick(label: str):
+        return label
+
+    replies = [
+        litellm.ModelResponse(model="gpt-4o", choices=[litellm.Choices(
+            index=0, finish_reason="tool_calls",
+            message=litellm.Message(role="assistant", content="",
+                                    tool_calls=[t.model_dump() for t in (
+                _tool_call("call_1", "hang"), _tool_call("call_2", "hang"),
+                _tool_call("call_3", "quick", label="a"),
+                _tool_call("call_4", "quick", label="b"))]))],
+            usage=litellm.Usage(prompt_tokens=10, completion_tokens=5,
+                                total_tokens=15)),
+        litellm.ModelResponse(model="gpt-4o", choices=[litellm.Choices(
+            index=0, finish_reason="stop",
+            message=litellm.Message(role="assistant", content="done"))],
+            usage=litellm.Usage(prompt_tokens=10, completion_tokens=5,
+                                total_tokens=15)),
+    ]
+
+    async def acompletion(**params):
+        return replies.pop(0)
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    agent = Agent(model="gpt-4o", functions=[hang, quick],
+                  parallel_tool_calls=True)
+    client = CAI(log_training_data=False)
+    client.tool_timeout = 0.3
+    client.max_parallel_tools = 2
+    start = time.monotonic()
+    response = asyncio.run(client.arun(
+        agent=agent, messages=[{"role": "user", "content": "go"}]))
+    release.append(True)
+
+    assert time.monotonic() - start < 3
+    tool_messages = [m for m in response.messages if m["role"] == "tool"]
+    assert ["timed out" in m["content"] for m in tool_messages[:2]] == [
+        True, True]
+    assert [m["content"] for m in tool_messages[2:]] == ["a", "b"]
+    assert response.messages[-1]["content"] == "done"
@@ -0,0 +1,76 @@
+"""
+Tests for the provider-aware rate-limit scheduler.
+"""
+import asyncio
+
+import pytest
+
+from cai.ratelimit import RateLimiter, provider_of, retry_after
+
+
+class _RateLimitError(Exception):
+    def __init__(self, headers=None, message=""):
+        super().__init__(message)
+        self.message = message
+        self.litellm_response_headers = headers or {}
+
+
+def test_requests_queue_behind_rpm_bucket(monkeypatch):
+    monkeypatch.setenv("CAI_RATE_LIMIT_RPM_TESTPROV", "2")
+    limiter = RateLimiter()
+    assert provider_of("testprov/model") == "testprov"
+    assert limiter.reserve("testprov/model") == 0
+    assert limiter.reserve("testprov/model") == 0
+    assert limiter.reserve("testprov/model") == pytest.approx(30, abs=0.5)
+    assert limiter.reserve("testprov/model") == pytest.approx(60, abs=0.5)
+    # other providers are not affected
+    assert limiter.reserve("otherprov/model") == 0
+
+
+def test_tpm_bucket_and_usage(monkeypatch):
+    monkeypatch.setenv("CAI_RATE_LIMIT_TPM", "6000")
+    limiter = RateLimiter()
+    assert limiter.reserve("tpmprov/model", tokens=5000) == 0
+    limiter.record_usage("tpmprov/model", 2000)
+    assert limiter.reserve("tpmprov/model", tokens=1000) == pytest.approx(
+        20, abs=0.5)
+
+
+@pytest.mark.parametrize("headers,expected", [
+    ({"Retry-After": "7"}, 7),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"x-ratelimit-reset-requests": "6m0s"}, 360),
+])
+def test_retry_after_headers(headers, expected):
+    assert retry_after(_RateLimitError(headers)) == pytest.approx(expected)
+
+
+def test_backoff_is_shared_and_exponential():
+    limiter = RateLimiter()
+    first = limiter.on_rate_limited("backoff/model", _RateLimitError())
+    assert 1 <= first <= 2
+    second = limiter.on_rate_limited("backoff/model", _RateLimitError())
+    assert second >= 2
+    # every caller of the provider waits for the window
+    assert limiter.reserve("backoff/model") == pytest.approx(second, abs=0.1)
+    limiter.record_usage("backoff/model", 0)
+    assert limiter.on_rate_limited("backoff/model", _RateLimitError(
+        {"retry-after": "0.01"})) <= second
+
+
+def test_aslot_tracks_concurrent_callers():
+    limiter = RateLimiter()
+
+    async def request(results):
+        async with limiter.aslot("slots/model"):
+            results.append(limiter.stats("slots/model"))
+            await asyncio.sleep(0.05)
+
+    async def main():
+        results = []
+        await asyncio.gather(request(results), request(results))
+        return results
+
+    results = asyncio.run(main())
+    assert max(in_flight for _, in_flight in results) == 2
+    assert limiter.stats("slots/model") == (0, 0)
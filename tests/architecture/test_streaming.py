@@ -0,0 +1,143 @@
+"""
+Tests for the streaming path of CAI.get_chat_completion
+(CAI.consume_stream), using hand-built litellm chunks so no
+model is needed.
+"""
+from litellm.types.utils import (  # pylint: disable=import-error
+    ChatCompletionDeltaToolCall,
+    Delta,
+    Function,
+    ModelResponseStream,
+    StreamingChoices,
+    Usage,
+)
+
+from cai.core import CAI, Agent
+from cai.util import merge_chunk
+
+
+def _chunk(content=None, tool_calls=None, finish_reason=None, usage=None):
+    choices = [] if usage else [
+        StreamingChoices(
+            index=0,
+            delta=Delta(content=content, tool_calls=tool_calls),
+            finish_reason=finish_reason,
+        )
+    ]
+    chunk = ModelResponseStream(
+        id="chatcmpl-1", model="gpt-4o", created=1, choices=choices)
+    if usage:
+        chunk.usage = usage
+    return chunk
+
+
+def _tool_fragment(index, arguments, call_id=None, name=None):
+    return ChatCompletionDeltaToolCall(
+        index=index,
+        id=call_id,
+        type="function" if call_id else None,
+        function=Function(name=name, arguments=arguments),
+    )
+
+
+def _weather_stream():
+    return [
+        _chunk("Checking "),
+        _chunk("weather"),
+        _chunk(tool_calls=[_tool_fragment(
+            0, '{"loc', call_id="call_a", name="get_weather")]),
+        _chunk(tool_calls=[_tool_fragment(0, 'ation": "SF"}')]),
+        _chunk(tool_calls=[_tool_fragment(
+            1, '{"location": "NY"}', call_id="call_b", name="get_weather")]),
+        _chunk(finish_reason="tool_calls"),
+        _chunk(usage=Usage(
+            prompt_tokens=10, completion_tokens=5, total_tokens=15)),
+    ]
+
+
+def test_merge_chunk_uses_fragment_index():
+    """Fragments for different tool calls land in their own slot."""
+    message = {"content": "", "tool_calls": {
+        0: {"id": "", "function": {"name": "", "arguments": ""}},
+        1: {"id": "", "function": {"name": "", "arguments": ""}},
+    }}
+    merge_chunk(message, {"role": "assistant", "content": "a", "tool_calls": [
+        {"index": 1, "id": "x", "function": {"name": "f", "arguments": "{"}},
+        {"index": 0, "id": "y", "function": {"name": "g", "arguments": "["}},
+    ]})
+    merge_chunk(message, {"content": "b", "tool_calls": [
+        {"index": 1, "id": None, "function": {"arguments": "}"}},
+    ]})
+    assert message["content"] == "ab"
+    assert message["tool_calls"][1]["function"]["arguments"] == "{}"
+    assert message["tool_calls"][0]["id"] == "y"
+
+
+def test_consume_stream_rebuilds_completion():
+    """Content, tool calls and usage survive streaming."""
+    client = CAI(log_training_data=False)
+    completion = client.consume_stream(
+        iter(_weather_stream()),
+        Agent(),
+        {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]},
+        debug=0)
+
+    message = completion.choices[0].message
+    assert message.content == "Checking weather"
+    assert [t.id for t in message.tool_calls] == ["call_a", "call_b"]
+    assert message.tool_calls[0].function.arguments == '{"location": "SF"}'
+    assert completion.usage.prompt_tokens == 10
+    assert completion.usage.completion_tokens == 5
+
+
+def test_consume_stream_keeps_interleaved_tool_calls_apart():
+    """Fragments of several tool calls arriving interleaved are
+    assembled by index."""
+    stream = [
+        _chunk(tool_calls=[_tool_fragment(
+            0, '{"loc', call_id="call_a", name="get_weather")]),
+        _chunk(tool_calls=[_tool_fragment(
+            1, '{"loc', call_id="call_b", name="get_weather")]),
+        _chunk(tool_calls=[_tool_fragment(0, 'ation": "SF"}')]),
+        _chunk(tool_calls=[_tool_fragment(1, 'ation": "NY"}')]),
+        _chunk(finish_reason="tool_calls"),
+    ]
+    completion = CAI(log_training_data=False).consume_stream(
+        iter(stream), Agent(),
+        {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]},
+        debug=0)
+    tool_calls = completion.choices[0].message.tool_calls
+    assert [(t.id, t.function.arguments) for t in tool_calls] == [
+        ("call_a", '{"location": "SF"}'), ("call_b", '{"location": "NY"}')]
+
+
+def test_tools_dispatched_before_stream_ends():
+    """Completed tool calls run early and keep their order."""
+    locations = []
+
+    def get_weather(location):
+        locations.append(location)
+        return f"sunny in {location}"
+
+    agent = Agent(functions=[get_weather])
+    client = CAI(log_training_data=False)
+    ready = []
+
+    def on_tool_call_ready(tool_call):
+        ready.append(tool_call.id)
+        client.dispatch_tool_call(tool_call, agent.functions, {}, 0)
+
+    completion = client.consume_stream(
+        iter(_weather_stream()),
+        agent,
+        {"model": "gpt-4o", "messages": [{"role": "user", "content": "hi"}]},
+        debug=0,
+        on_tool_call_ready=on_tool_call_ready)
+    assert ready == ["call_a", "call_b"]
+
+    response = client.handle_tool_calls(
+        completion.choices[0].message.tool_calls,
+        agent.functions, {}, 0, agent)
+    assert locations == ["SF", "NY"]
+    assert [m["content"] for m in response.messages] == [
+        "sunny in SF", "sunny in NY"]
@@ -12,7 +12,13 @@ project_root = Path(__file__).parent.absolute()
 sys.path.insert(0, str(project_root))
 
 # Import the template loading function
-from cai.util import get_template_content, load_prompt_template
+from cai import util
+from cai.util import (
+    get_compiled_template,
+    get_environment_context,
+    get_template_content,
+    load_prompt_template,
+)
 
 def test_template_loading():
     """Test that templates can be loaded correctly"""
@@ -59,5 +65,36 @@ def test_template_loading():
         
     print("Template loading tests completed.")
 
+
+def test_compiled_template_is_reused():
+    """Templates are compiled once and cached per path"""
+    template = get_compiled_template("prompts/system_bug_bounter.md")
+    assert get_compiled_template("prompts/system_bug_bounter.md") is template
+    assert load_prompt_template("prompts/system_bug_bounter.md") == \
+        template.render()
+
+
+def test_compiled_template_module_directory(tmp_path, monkeypatch):
+    """With CAI_TEMPLATE_MODULE_DIR, compiled modules are kept on disk"""
+    monkeypatch.setenv("CAI_TEMPLATE_MODULE_DIR", str(tmp_path))
+    monkeypatch.setattr(util, "_COMPILED_TEMPLATES", {})
+    rendered = load_prompt_template("prompts/system_thought_router.md")
+    assert rendered
+    assert list(tmp_path.rglob("*.py"))
+
+
+def test_environment_context_is_cached(monkeypatch):
+    """The environment probe only runs again once the TTL expires"""
+    monkeypatch.setattr(util, "_ENV_CONTEXT", {"expires": 0.0, "value": None})
+    monkeypatch.setenv("CAI_ENV_CONTEXT_TTL", "300")
+    first = get_environment_context()
+    assert get_environment_context() is first
+
+    monkeypatch.setenv("CAI_ENV_CONTEXT_TTL", "0")
+    util._ENV_CONTEXT["expires"] = 0.0  # pylint: disable=protected-access
+    assert get_environment_context() is not first
+    assert set(first) == {"hostname", "ip_addr", "os_name", "tun0_addr",
+                          "wordlist_files", "seclist_dirs"}
+
 if __name__ == "__main__":
     test_template_loading() 
\ No newline at end of file
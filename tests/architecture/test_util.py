@@ -1,4 +1,8 @@
-from cai.util import function_to_json
+import copy
+
+import pytest
+
+from cai.util import fit_messages, function_to_json, get_tool_schemas
 
 
 def test_basic_function():
@@ -69,3 +73,63 @@ def test_gemini_format():
             "required": ["arg1"],
         },
     }
+
+
+def test_tool_schemas_are_cached_and_read_only():
+    def my_tool(target: str, context_variables: dict = None):
+        """Scan a target."""
+
+    first = get_tool_schemas([my_tool])
+    assert get_tool_schemas([my_tool]) is first
+    params = first[0]["function"]["parameters"]
+    assert "context_variables" not in params["properties"]
+    with pytest.raises(TypeError):
+        params["properties"]["extra"] = {}
+
+    # deep copies are plain and mutable, e.g. to hand to litellm
+    sent = copy.deepcopy(list(first))
+    sent[0]["function"]["parameters"]["required"].append("extra")
+    required = first[0]["function"]["parameters"]["required"]
+    assert required == ["target"]
+    with pytest.raises(TypeError):
+        required.append("extra")
+
+
+def test_tool_schemas_follow_function_changes():
+    def tool_a():
+        """A."""
+
+    def mcp_tool_b():
+        """B."""
+
+    functions = [tool_a]
+    before = get_tool_schemas(functions)
+    functions.append(mcp_tool_b)
+    after = get_tool_schemas(functions)
+    assert [t["function"]["name"] for t in after] == ["tool_a", "mcp_tool_b"]
+    assert after[0] is before[0]
+    assert len(before) == 1
+
+
+def test_fit_messages_keeps_tool_call_pairs():
+    messages = [
+        {"role": "user", "content": "task"},
+        {"role": "assistant", "content": None,
+         "tool_calls": [{"id": "a"}, {"id": "b"}]},
+        {"role": "tool", "tool_call_id": "a", "content": "x" * 100},
+        {"role": "tool", "tool_call_id": "b", "content": "y" * 100},
+        {"role": "assistant", "content": "so far so good"},
+        {"role": "user", "content": "go on"},
+    ]
+    counts = [5, 5, 50, 50, 5, 5]
+    assert fit_messages(messages, counts, 1000) is messages
+
+    fitted = fit_messages(messages, counts, 30)
+    assert fitted[0] is messages[0]
+    assert "2 earlier messages" not in fitted[1]["content"]
+    assert "3 earlier messages" in fitted[1]["content"]
+    assert fitted[2:] == messages[4:]
+    assert not any(m.get("role") == "tool" for m in fitted)
+
+    # the latest exchange is kept even if it alone is too large
+    assert fit_messages(messages[:4], counts[:4], 1) == messages[:4]
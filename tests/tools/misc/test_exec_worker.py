@@ -0,0 +1,110 @@
+import asyncio
+import os
+import stat
+import time
+
+from cai.tools import common
+from cai.tools.common import arun_command, run_command
+
+import pytest
+
+# Stand-in for the docker CLI: runs "docker exec" commands on the host
+# and logs the first line of each call
+FAKE_DOCKER = """#!/bin/sh
+echo "$@" | head -n 1 >> "$DOCKER_CALLS"
+shift  # exec
+case "$1" in -i) shift ;; -w) cd "$2"; shift 2 ;; esac
+shift  # container id
+exec "$@"
+"""
+
+
+@pytest.fixture(autouse=True)
+def docker(tmp_path, monkeypatch):
+    """Put the fake docker first in PATH, with a container active"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "docker"
+    script.write_text(FAKE_DOCKER)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    calls = tmp_path / "calls"
+    calls.touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("DOCKER_CALLS", str(calls))
+    monkeypatch.setenv("CAI_ACTIVE_CONTAINER", "0123456789abcdef")
+    monkeypatch.setattr(common, "_get_container_workspace_path",
+                        lambda: str(tmp_path / "workspace"))
+    yield calls
+    for worker in common._EXEC_WORKERS.values():  # pylint: disable=protected-access
+        worker.close()
+    common._EXEC_WORKERS.clear()  # pylint: disable=protected-access
+    common._EXEC_WORKER_FAILED.clear()  # pylint: disable=protected-access
+
+
+def test_commands_share_one_docker_exec(docker, tmp_path):
+    """Commands, sync and async, go through one worker process, in
+    the container workspace"""
+    assert run_command("pwd") == str(tmp_path / "workspace")
+    assert run_command("echo out; echo err >&2; exit 3") == "out"
+    assert run_command("echo err >&2; exit 3") == "err"
+
+    async def many():
+        return await asyncio.gather(
+            *(arun_command(f"sleep 0.2; echo {i}") for i in range(10)))
+    start = time.time()
+    assert asyncio.run(many()) == [str(i) for i in range(10)]
+    assert time.time() - start < 1.5  # concurrent in the worker
+    assert len(docker.read_text().splitlines()) == 1
+
+
+def test_timed_out_commands_are_not_run_again(docker, tmp_path,
+                                              monkeypatch):
+    """A command that times out is killed in the container and
+    reported, without waiting for the children that left its process
+    group, and is never run a second time"""
+    start = time.time()
+    output = run_command("echo run >> ran; setsid sleep 15 & "
+                         "echo start; sleep 5", timeout=1)
+    assert time.time() - start < 5
+    assert output == "Timeout executing command in container: start\n"
+    assert (tmp_path / "workspace" / "ran").read_text() == "run\n"
+
+    # no reply in time: reported too, the worker keeps serving
+    monkeypatch.setattr(common._ExecWorker, "REPLY_GRACE", 0)  # pylint: disable=protected-access
+    output = asyncio.run(arun_command("echo run >> ran; sleep 2",
+                                      timeout=1))
+    assert output.startswith("Timeout executing command in container")
+    time.sleep(2)
+    assert (tmp_path / "workspace" / "ran").read_text() == "run\nrun\n"
+    assert run_command("echo alive") == "alive"
+    assert len(docker.read_text().splitlines()) == 1
+
+
+def test_dead_worker_falls_back_to_docker_exec(docker, monkeypatch):
+    """When the worker dies, commands still run with docker exec"""
+    assert run_command("echo one") == "one"
+    worker = common._EXEC_WORKERS["0123456789abcdef"]  # pylint: disable=protected-access
+    worker.close()
+    worker.process.wait()
+    assert run_command("echo two") == "two"
+    calls = docker.read_text().splitlines()
+    assert calls[-1].endswith("sh -c echo two")
+
+    # disabled: docker exec per command
+    monkeypatch.setenv("CAI_CONTAINER_WORKER", "false")
+    common._EXEC_WORKER_FAILED.clear()  # pylint: disable=protected-access
+    assert run_command("echo three") == "three"
+    assert "-i" not in docker.read_text().splitlines()[-1].split()
+
+
+def test_worker_output_is_capped(docker, monkeypatch):
+    """The worker keeps the head and tail of long outputs and kills
+    runaway commands"""
+    monkeypatch.setenv("CAI_COMMAND_OUTPUT_LIMIT", "100")
+    output = run_command("seq 100000")
+    assert output.startswith("1\n2\n") and output.endswith("99999\n100000")
+    assert "bytes omitted" in output
+    monkeypatch.setenv("CAI_COMMAND_OUTPUT_CAP", "100000")
+    assert run_command("yes | cat").endswith(
+        "[Output cap of 100000 bytes reached: command killed]")
+    assert len(docker.read_text().splitlines()) == 1
@@ -0,0 +1,140 @@
+import threading
+import time
+
+from cai.tools import common
+from cai.tools.reconnaissance.generic_linux_command import (
+    generic_linux_command,
+)
+from cai.tools.common import (
+    ACTIVE_SESSIONS,
+    OutputRing,
+    create_shell_session,
+    get_session_output,
+    terminate_session,
+)
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    """Run the sessions in a temporary workspace"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("CAI_WORKSPACE", raising=False)
+    monkeypatch.delenv("CAI_WORKSPACE_DIR", raising=False)
+
+
+def _wait_finished(session, timeout=5):
+    deadline = time.time() + timeout
+    while session.is_running and time.time() < deadline:
+        session.wait_for_output(0.1)
+    return not session.is_running
+
+
+def test_sessions_share_one_reader_thread():
+    """Output of many sessions is read by the reactor thread alone,
+    and the end of each process is noticed"""
+    create_shell_session("true")  # start the reactor
+    threads = set(threading.enumerate())
+    ids = [create_shell_session(f"echo session {i}") for i in range(20)]
+    assert not set(threading.enumerate()) - threads
+    for i, session_id in enumerate(ids):
+        assert _wait_finished(ACTIVE_SESSIONS[session_id])
+        output = get_session_output(session_id)
+        assert f"session {i}\r\n" in output
+        assert output.endswith("Process terminated.\n")
+        terminate_session(session_id)
+
+
+def test_output_wakes_waiters_and_decodes_split_characters():
+    """Waiters wake up on output; UTF-8 characters split across reads
+    are decoded once complete"""
+    session_id = create_shell_session("cat")
+    session = ACTIVE_SESSIONS[session_id]
+    get_session_output(session_id)
+    session.send_input("héllo €")
+    assert session.wait_for_output(5)
+    data = "€uro".encode()
+    session._on_output(data[:2])  # pylint: disable=protected-access
+    session._on_output(data[2:])  # pylint: disable=protected-access
+    time.sleep(0.2)
+    output = get_session_output(session_id)
+    assert "héllo €" in output and "€uro" in output
+    assert "�" not in output
+    terminate_session(session_id)
+    time.sleep(0.2)
+    assert session.master is None
+    assert common._reactor._thread.is_alive()  # pylint: disable=protected-access
+
+
+def test_reader_survives_failing_sessions_and_restarts(monkeypatch):
+    """A session whose output cannot be handled is closed alone; if the
+    reader thread dies, the next session restarts it and the running
+    sessions are read again"""
+    reactor = common._reactor  # pylint: disable=protected-access
+    bad = ACTIVE_SESSIONS[create_shell_session("cat")]
+    good_id = create_shell_session("cat")
+    get_session_output(good_id)
+
+    def broken(data):
+        raise ValueError("broken")
+    monkeypatch.setattr(bad, "_on_output", broken)
+    bad.send_input("x")
+    assert _wait_finished(bad)
+    ACTIVE_SESSIONS[good_id].send_input("still read")
+    assert ACTIVE_SESSIONS[good_id].wait_for_output(5)
+    assert reactor._thread.is_alive()  # pylint: disable=protected-access
+
+    def crash():
+        monkeypatch.undo()
+        raise RuntimeError("crash")
+    monkeypatch.setattr(reactor, "_apply_pending", crash)
+    thread = reactor._thread  # pylint: disable=protected-access
+    create_shell_session("true")
+    thread.join(5)
+    assert not thread.is_alive()
+    other_id = create_shell_session("true")
+    assert reactor._thread.is_alive()  # pylint: disable=protected-access
+    good = ACTIVE_SESSIONS[good_id]
+    good.send_input("read again")
+    deadline = time.time() + 5
+    while ("read again" not in good.read_output()[0] and
+           time.time() < deadline):
+        good.wait_for_output(0.1)
+    assert "read again" in good.read_output()[0]
+    assert _wait_finished(ACTIVE_SESSIONS[other_id])
+    for session_id in (good_id, other_id):
+        terminate_session(session_id)
+
+
+def test_output_ring_keeps_offsets_and_reports_drops():
+    """The ring keeps the last bytes, at stable offsets"""
+    ring = OutputRing(limit=10)
+    assert ring.write("hello ") == 6
+    assert ring.read(0) == ("hello ", 6, 0)
+    ring.write("wörld!!")  # 8 bytes, overflows
+    text, offset, dropped = ring.read(0)
+    assert (text, offset, dropped) == ("o wörld!!", 14, 4)
+    assert ring.read(offset) == ("", 14, 0)
+    ring.write("x" * 3)
+    text, _, dropped = ring.read(2)  # ö must not be cut in half
+    assert "\ufffd" not in text and dropped > 0
+
+
+def test_session_output_returns_only_new_output(monkeypatch):
+    """"session output <id>" returns what is new since the last call,
+    without extra newlines, noting dropped bytes"""
+    monkeypatch.setenv("CAI_SESSION_OUTPUT_LIMIT", "4096")
+    session_id = create_shell_session("cat")
+    session = ACTIVE_SESSIONS[session_id]
+    generic_linux_command("session", f"output {session_id}")
+    session._on_output(b"first ")  # pylint: disable=protected-access
+    session._on_output(b"chunk\n")  # pylint: disable=protected-access
+    assert generic_linux_command(
+        "session", f"output {session_id}") == "first chunk\n"
+    assert generic_linux_command("session", f"output {session_id}") == ""
+
+    session._on_output(b"y" * 10000)  # pylint: disable=protected-access
+    output = generic_linux_command("session", f"output {session_id}")
+    assert output == "[... 5904 bytes dropped ...]\n" + "y" * 4096
+    terminate_session(session_id)
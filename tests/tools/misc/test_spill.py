@@ -0,0 +1,96 @@
+from cai import core
+from cai.core import CAI, Agent
+from cai.types import ChatCompletionMessageToolCall, Function, Response
+from cai.tools.misc import spill
+from cai.tools.misc.spill import SpillStore, read_tool_output
+
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh spill store under a temporary workspace"""
+    monkeypatch.setenv("CAI_WORKSPACE_DIR", str(tmp_path))
+    monkeypatch.setenv("CAI_WORKSPACE", "spill_test")
+    store = SpillStore()
+    monkeypatch.setattr(spill, "spill_store", store)
+    monkeypatch.setattr(core, "spill_store", store)
+    return store
+
+
+def _tool_call(name):
+    return ChatCompletionMessageToolCall(
+        id="call_1", type="function",
+        function=Function(name=name, arguments="{}"))
+
+
+def _output():
+    return "".join(f"line {i} {'open' if i % 50 == 0 else 'closed'}\n"
+                   for i in range(2000))
+
+
+def test_preview_keeps_head_tail_and_handle(store):
+    """The preview fits the budget and the full output is stored once"""
+    output = _output()
+    preview = store.preview(output, 1000)
+    handle = next(iter(store.sizes))
+    assert preview.startswith(output[:500])
+    assert preview.endswith(output[-500:])
+    assert f"handle '{handle}'" in preview
+    assert len(preview) < 1400
+    assert store.preview(output, 1000) == preview
+    assert len(store.sizes) == 1
+
+
+def test_read_tool_output_pages_and_greps(store):
+    """Spilled outputs can be read by page, byte range and pattern"""
+    output = _output()
+    handle = store.put(output)
+
+    page = read_tool_output(handle, length=100, page=2)
+    assert page.splitlines()[0] == \
+        f"[{handle}: bytes 200-300 of {len(output)}, next page 3]"
+    assert page.split("\n", 1)[1] == output[200:300]
+
+    assert read_tool_output(handle, offset=len(output) - 5).endswith(
+        output[-5:])
+
+    matches = read_tool_output(handle, pattern=r"\bopen$")
+    assert matches.splitlines()[0].startswith(f"[{handle}: 40 lines of 2000")
+    assert "51:line 50 open" in matches
+    assert "closed" not in matches
+    assert read_tool_output("0" * 16).startswith("Error")
+
+
+def test_paging_tool_offered_after_spill(store):
+    """Agents with tools get read_tool_output once something spilled"""
+    def generic_linux_command(command: str) -> str:
+        return command
+
+    agent = Agent(model="gpt-4o", functions=[generic_linux_command])
+    assert CAI.agent_functions(agent) == [generic_linux_command]
+    store.put(_output())
+    assert CAI.agent_functions(agent) == [generic_linux_command,
+                                          read_tool_output]
+
+
+def test_pages_are_not_spilled_again(store):
+    """A page read back is recorded in full, not as another handle"""
+    output = _output() * 2
+    client = CAI(log_training_data=False)
+    client.max_chars_per_message = 5000
+    handle = store.put(output)
+    page = read_tool_output(handle, length=16000)
+    assert len(page) > 16000
+
+    response = Response(messages=[], agent=None, context_variables={})
+    client.record_tool_result(
+        response, _tool_call("read_tool_output"), {}, page,
+        Agent(model="gpt-4o"), True)
+    assert response.messages[0]["content"] == page
+    assert len(store.sizes) == 1
+
+    client.record_tool_result(
+        response, _tool_call("generic_linux_command"), {}, output,
+        Agent(model="gpt-4o"), True)
+    assert len(response.messages[1]["content"]) < 6000
@@ -0,0 +1,155 @@
+import os
+import stat
+import subprocess
+import threading
+import time
+
+from cai.tools import common
+from cai.tools.command_and_control.sshpass import (
+    run_ssh_command_with_credentials,
+)
+from cai.tools.common import run_command
+
+import pytest
+
+# Stand-in for ssh: the ControlMaster is a file at the ControlPath
+# (holding "stale" once the master is dead, or "dying" if it dies
+# while the next command runs); commands run on the host.
+# Each call is logged as master, check, exit, mux or direct.
+FAKE_SSH = """#!/bin/sh
+mode=run
+while [ $# -gt 1 ]; do
+    case "$1" in
+        -M) mode=master ;;
+        -O) mode=$2; shift ;;
+        -o) case "$2" in ControlPath=*) path=${2#ControlPath=} ;; esac
+            shift ;;
+        -p) shift ;;
+    esac
+    shift
+done
+case $mode in
+    master) echo master >> "$SSH_CALLS"; echo alive > "$path" ;;
+    check) grep -q alive "$path" 2>/dev/null ;;
+    exit) echo exit >> "$SSH_CALLS"; rm -f "$path" ;;
+    run)
+        if [ ! -e "$path" ]; then echo direct >> "$SSH_CALLS"
+        elif grep -q stale "$path"; then
+            echo "mux_client_request_session: read from master failed" >&2
+            exit 255
+        elif grep -q dying "$path"; then
+            echo stale > "$path"; sh -c "$1"
+            echo "Shared connection to target closed." >&2
+            exit 255
+        else echo mux >> "$SSH_CALLS"; fi
+        exec sh -c "$1" ;;
+esac
+"""
+
+
+@pytest.fixture(autouse=True)
+def ssh(tmp_path, monkeypatch):
+    """Put the fake ssh first in PATH, with an SSH target set"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ssh"
+    script.write_text(FAKE_SSH)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    calls = tmp_path / "calls"
+    calls.touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("SSH_CALLS", str(calls))
+    monkeypatch.setenv("SSH_USER", "user")
+    monkeypatch.setenv("SSH_HOST", "target")
+    monkeypatch.delenv("SSH_PASS", raising=False)
+    monkeypatch.delenv("CAI_ACTIVE_CONTAINER", raising=False)
+    monkeypatch.setattr(common, "SSH_CONTROL_DIR", str(tmp_path / "control"))
+    monkeypatch.chdir(tmp_path)
+    yield lambda: calls.read_text().split()
+    common.close_ssh_transports()
+
+
+def test_commands_reuse_one_connection(ssh):
+    """Only the first command connects; the rest use the master"""
+    assert run_command("echo one") == "one"
+    assert run_command("echo two; exit 3") == "two"
+    assert ssh() == ["master", "mux", "mux"]
+
+
+def test_dead_master_is_restarted(ssh, tmp_path):
+    """A command that could not open its session because the master
+    died is run again on a new master; a command returning 255 itself,
+    or cut by the master dying while it ran, is not"""
+    run_command("true")
+    transport = common.get_ssh_transport("user", "target")
+    with open(transport.control_path, "w", encoding="utf-8") as f:
+        f.write("stale")
+    assert run_command("echo again") == "again"
+    assert ssh() == ["master", "mux", "exit", "master", "mux"]
+    run_command("echo once >> ran; exit 255")
+    assert (tmp_path / "ran").read_text() == "once\n"
+    with open(transport.control_path, "w", encoding="utf-8") as f:
+        f.write("dying")
+    run_command("echo twice >> ran")
+    assert (tmp_path / "ran").read_text() == "once\ntwice\n"
+
+
+def test_control_dir_must_be_private(tmp_path, monkeypatch):
+    """A control directory open to other users is not trusted"""
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    monkeypatch.setattr(common, "SSH_CONTROL_DIR", str(shared))
+    transport = common._SshTransport("user", "other")  # pylint: disable=protected-access
+    assert not transport.control_path.startswith(str(shared))
+    assert os.stat(os.path.dirname(transport.control_path)).st_mode \
+        & 0o077 == 0
+
+
+def test_failed_master_connects_directly(ssh, monkeypatch):
+    """Without a master, commands connect on their own"""
+    monkeypatch.setattr(common._SshTransport, "_start_master",  # pylint: disable=protected-access
+                        lambda self, timeout: False)
+    assert run_command("echo plain") == "plain"
+    monkeypatch.setenv("CAI_SSH_MULTIPLEX", "false")
+    assert run_command("echo plain") == "plain"
+    assert ssh() == ["direct", "direct"]
+
+
+def test_master_startup_counts_against_the_timeout(ssh, monkeypatch):
+    """Starting the master gets a short budget, and the command only
+    what is left of its timeout"""
+    budgets = []
+
+    def slow_master(self, timeout):
+        budgets.append(timeout)
+        time.sleep(1.5)
+        return False
+    monkeypatch.setattr(common._SshTransport, "_start_master",  # pylint: disable=protected-access
+                        slow_master)
+    transport = common.get_ssh_transport("user", "target")
+    with pytest.raises(subprocess.TimeoutExpired):
+        transport.run("sleep 1.2; echo late", timeout=2)
+    common.close_ssh_transports()
+    transport = common.get_ssh_transport("user", "target")
+    assert transport.run("echo on time").stdout == "on time\n"
+    assert budgets == [2, common.SSH_MASTER_TIMEOUT]
+
+
+def test_channels_per_host_are_limited(ssh, monkeypatch):
+    """No more than CAI_SSH_MAX_SESSIONS commands run at once"""
+    monkeypatch.setenv("CAI_SSH_MAX_SESSIONS", "2")
+    monkeypatch.delenv("SSH_USER")
+    outputs = []
+    threads = [threading.Thread(target=lambda i=i: outputs.append(
+        run_ssh_command_with_credentials(
+            "target", "user", "", f"sleep 0.2; echo {i}")))
+        for i in range(6)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.time() - start >= 0.6
+    assert sorted(outputs) == [str(i) for i in range(6)]
+    assert ssh().count("master") == 1
@@ -0,0 +1,93 @@
+import asyncio
+import subprocess
+import time
+
+from cai.tools.common import (
+    OutputCapture,
+    arun_command,
+    run_command,
+    stream_command,
+)
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    """Run the commands locally, in a temporary workspace"""
+    monkeypatch.chdir(tmp_path)
+    for var in ("CAI_WORKSPACE", "CAI_WORKSPACE_DIR", "CAI_ACTIVE_CONTAINER",
+                "SSH_USER", "CAI_COMMAND_OUTPUT_LIMIT",
+                "CAI_COMMAND_OUTPUT_CAP"):
+        monkeypatch.delenv(var, raising=False)
+
+
+def test_output_is_handed_over_as_it_is_produced():
+    """Chunks arrive while the command runs, per stream"""
+    seen = []
+    start = time.time()
+    result = stream_command(
+        "echo first; echo oops >&2; sleep 0.5; echo second",
+        on_output=lambda stream, text: seen.append(
+            (stream, text, time.time() - start)))
+    assert result.returncode == 0
+    assert result.output == "first\nsecond\n"
+    assert result.text("stderr") == "oops\n"
+    first = next(t for stream, text, t in seen if text == "first\n")
+    assert first < 0.4
+    assert ("stderr", "oops\n") in [(stream, text) for stream, text, _ in seen]
+
+
+def test_capture_keeps_head_and_tail():
+    """Only the ends of a long output are kept, without cutting
+    characters in half"""
+    capture = OutputCapture(limit=8)
+    for _ in range(1000):
+        capture.write("aé€".encode())
+    assert capture.size == 6000
+    assert capture.text() == "aé\n[... 5994 bytes omitted ...]\n€"
+
+    small = OutputCapture(limit=100)
+    small.write(b"short")
+    assert small.text() == "short"
+
+
+def test_runaway_output_is_capped():
+    """A command printing without end is killed at the cap, long
+    before its timeout"""
+    start = time.time()
+    result = stream_command("yes", limit=1000, cap=10 << 20, timeout=30)
+    assert time.time() - start < 10
+    assert result.capped and result.stdout.size >= 10 << 20
+    assert len(result.output) < 1200
+    assert result.output.startswith("y\ny\n")
+    assert "bytes omitted" in result.output
+    assert result.output.endswith("reached: command killed]")
+    assert "killed at the output cap" in result.stats
+
+
+def test_timeout_keeps_the_output_so_far():
+    """A timeout kills the command and reports what it printed"""
+    with pytest.raises(subprocess.TimeoutExpired) as error:
+        stream_command("echo started; sleep 10", timeout=0.5)
+    assert error.value.stdout == "started\n"
+    assert run_command("echo started; sleep 10", timeout=0.5) == \
+        "Timeout executing local command: started\n"
+    assert asyncio.run(arun_command("echo started; sleep 10", timeout=0.5)) \
+        == "Timeout executing local command: started\n"
+
+
+def test_run_command_applies_the_limits(monkeypatch):
+    """run_command and arun_command return the head and tail of long
+    outputs, and stop runaway ones"""
+    monkeypatch.setenv("CAI_COMMAND_OUTPUT_LIMIT", "100")
+    output = run_command("seq 100000")
+    assert output.startswith("1\n2\n") and output.endswith("99999\n100000")
+    assert "bytes omitted" in output
+    assert asyncio.run(arun_command("seq 100000")) == output
+
+    monkeypatch.setenv("CAI_COMMAND_OUTPUT_CAP", "100000")
+    for output in (run_command("yes | cat"),
+                   asyncio.run(arun_command("yes | cat"))):
+        assert output.endswith("[Output cap of 100000 bytes reached: "
+                               "command killed]")
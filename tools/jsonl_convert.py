@@ -0,0 +1,57 @@
+"""
+Convert JSONL history files between the v1 and v2 log layouts.
+
+v1 logs repeat every message and tool schema in every request record
+and grow quadratically with the session; v2 logs write each of them
+once (see cai/datarecorder.py). All the tools/jsonl_* scripts read
+both layouts, as well as segmented (rotated) and compressed logs.
+
+An output path ending in .zst or .gz is compressed, which is the way
+to archive old logs: a v2 .jsonl.zst log is usually tens of times
+smaller than the v1 .jsonl it comes from.
+
+Usage:
+    JSONL_FILE_PATH="logs/cai_20250307_114836.jsonl" \
+        python3 tools/jsonl_convert.py
+
+Environment Variables:
+    JSONL_FILE_PATH: Path to the JSONL file to convert (required)
+    CAI_LOG_FORMAT: Layout to convert to, 1 or 2 (default: 2)
+    OUTPUT_FILE_PATH: Path of the converted file, compressed if it
+        ends in .zst or .gz (default: the input path with a .v1.jsonl
+        or .v2.jsonl extension)
+"""
+import os
+import sys
+
+from wasabi import color  # pylint: disable=import-error
+
+from cai.datarecorder import convert_jsonl, log_files
+
+
+def main():
+    """Convert JSONL_FILE_PATH to the layout given by CAI_LOG_FORMAT."""
+    jsonl_file_path = os.environ.get("JSONL_FILE_PATH")
+    if not jsonl_file_path:
+        print(color("Error: JSONL_FILE_PATH environment variable is required",
+                    fg="red"))
+        sys.exit(1)
+    version = int(os.environ.get("CAI_LOG_FORMAT", "2"))
+    output_file = os.environ.get(
+        "OUTPUT_FILE_PATH",
+        f"{jsonl_file_path.split('.jsonl')[0]}.v{version}.jsonl")
+
+    try:
+        requests = convert_jsonl(jsonl_file_path, output_file, version)
+    except (OSError, KeyError) as e:
+        print(color(f"Error: {str(e)}", fg="red"))
+        sys.exit(1)
+    before = sum(os.path.getsize(path)
+                 for path in log_files(jsonl_file_path))
+    after = os.path.getsize(output_file)
+    print(color(f"Converted {requests} requests to v{version}: "
+                f"{output_file} ({before} -> {after} bytes)", fg="green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Build a cassette from JSONL history files, to re-run them offline.
+
+Each request/completion pair recorded by the DataRecorder is stored in
+the cassette under the hash of its request (see cai/cassette.py). CAI
+then replays those completions instead of calling the model, while
+the tools still run for real.
+
+Usage:
+    JSONL_FILE_PATH="logs/cai_20250307_114836.jsonl" \
+        CAI_CASSETTE="cassettes/engagement.sqlite" \
+        python3 tools/jsonl_to_cassette.py
+
+    CAI_CASSETTE="cassettes/engagement.sqlite" \
+        CAI_CASSETTE_MODE="replay" cai
+
+Environment Variables:
+    JSONL_FILE_PATH: Path of the JSONL file, or several separated by
+        os.pathsep (":" on Linux) (required)
+    CAI_CASSETTE: Path of the cassette to create or extend (required)
+
+Notes:
+    - A request replays only if CAI sends exactly the same request
+      (model, messages, tools...), so the system prompt and the tool
+      outputs must match the recorded ones.
+"""
+import os
+import sys
+
+from wasabi import color  # pylint: disable=import-error
+
+from cai.cassette import Cassette
+
+
+def main():
+    """Import the JSONL files given in JSONL_FILE_PATH into CAI_CASSETTE."""
+    jsonl_file_path = os.environ.get("JSONL_FILE_PATH")
+    cassette_path = os.environ.get("CAI_CASSETTE")
+    if not jsonl_file_path or not cassette_path:
+        print(color("Error: JSONL_FILE_PATH and CAI_CASSETTE environment "
+                    "variables are required", fg="red"))
+        sys.exit(1)
+
+    cassette = Cassette(cassette_path, mode="record")
+    try:
+        for file_path in jsonl_file_path.split(os.pathsep):
+            count = cassette.import_jsonl(file_path)
+            print(color(f"Recorded {count} completions from {file_path}",
+                        fg="blue"))
+        print(color(f"{cassette_path} holds {len(cassette)} completions",
+                    fg="green"))
+    except OSError as e:
+        print(color(f"Error: {str(e)}", fg="red"))
+        sys.exit(1)
+    finally:
+        cassette.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,7 @@ from cai.util import (
     cli_print_state,
     color
 )
-from cai.datarecorder import load_history_from_jsonl
+from cai.datarecorder import iter_jsonl_records, load_history_from_jsonl
 
 # Initialize console object for rich printing
 console = Console()
@@ -78,16 +78,9 @@ def display_execution_time(metrics=None):
 
 
 def load_jsonl(file_path: str) -> List[Dict]:
-    """Load a JSONL file and return its contents as a list of dictionaries."""
-    data = []
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                try:
-                    data.append(json.loads(line))
-                except json.JSONDecodeError:
-                    print(f"Warning: Skipping invalid JSON line: {line[:50]}...")
-    return data
+    """Load a JSONL file (v1 or v2 log layout) and return its records
+    as a list of dictionaries."""
+    return list(iter_jsonl_records(file_path))
 
 
 def replay_conversation(messages: List[Dict], replay_delay: float = 0.5, usage: Tuple = None) -> None: